@@ -0,0 +1,169 @@
+import os
+import hmac
+import base64
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600000
+SALT_BYTES = 16
+AUTH_WORKERS = int(os.environ.get("ENROLLMENT_AUTH_WORKERS", "4"))
+VERIFIED_CACHE_SIZE = 10000
+SESSION_TTL = 8 * 60 * 60
+SESSION_PRUNE_INTERVAL = 60
+
+# =========================
+# Password Hashing
+# =========================
+
+def _b64(data):
+    return base64.b64encode(data).decode()
+
+def _unb64(text):
+    return base64.b64decode(text.encode())
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p)
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+
+def hash_password(password):
+    # Stored as "<scheme>$<parameters>$<salt>$<hash>". scrypt is used where
+    # the interpreter's OpenSSL provides it, PBKDF2 otherwise.
+    salt = secrets.token_bytes(SALT_BYTES)
+    if hasattr(hashlib, 'scrypt'):
+        digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return f"scrypt${SCRYPT_N},{SCRYPT_R},{SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+    digest = _pbkdf2(password, salt, PBKDF2_ITERATIONS)
+    return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${_b64(salt)}${_b64(digest)}"
+
+def is_legacy_hash(stored):
+    return '$' not in stored
+
+def needs_rehash(stored):
+    if is_legacy_hash(stored):
+        return True
+    scheme, params = stored.split('$')[:2]
+    if hasattr(hashlib, 'scrypt'):
+        return scheme != 'scrypt' or params != f"{SCRYPT_N},{SCRYPT_R},{SCRYPT_P}"
+    return scheme != 'pbkdf2_sha256' or int(params) < PBKDF2_ITERATIONS
+
+def check_password(password, stored):
+    if is_legacy_hash(stored):
+        # Unsalted SHA-256 from before the KDF; replaced on the next login.
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+    try:
+        scheme, params, salt, digest = stored.split('$')
+        salt, digest = _unb64(salt), _unb64(digest)
+        if scheme == 'scrypt':
+            n, r, p = (int(part) for part in params.split(','))
+            computed = _scrypt(password, salt, n, r, p)
+        elif scheme == 'pbkdf2_sha256':
+            computed = _pbkdf2(password, salt, int(params))
+        else:
+            return False
+    except ValueError:
+        return False
+    return hmac.compare_digest(computed, digest)
+
+# =========================
+# Verification
+# =========================
+
+class PasswordVerifier:
+    # Runs KDF checks on a small worker pool so a burst of logins cannot
+    # occupy every request thread, and remembers successful checks as a
+    # keyed HMAC so repeat logins against the same stored hash skip the KDF.
+    # The HMAC key lives only in this process.
+
+    def __init__(self, workers=AUTH_WORKERS, cache_size=VERIFIED_CACHE_SIZE):
+        self.workers = workers
+        self.cache_size = cache_size
+        self._key = secrets.token_bytes(32)
+        self._verified = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _fingerprint(self, password):
+        return hmac.new(self._key, password.encode(), hashlib.sha256).digest()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix='password-verify')
+            return self._pool
+
+    def verify(self, password, stored):
+        fingerprint = self._fingerprint(password)
+        with self._lock:
+            cached = self._verified.get(stored)
+            if cached is not None:
+                self._verified.move_to_end(stored)
+        if cached is not None:
+            return hmac.compare_digest(cached, fingerprint)
+        if not self._executor().submit(check_password, password, stored).result():
+            return False
+        with self._lock:
+            self._verified[stored] = fingerprint
+            while len(self._verified) > self.cache_size:
+                self._verified.popitem(last=False)
+        return True
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+# =========================
+# Sessions
+# =========================
+
+class SessionStore:
+    # In-memory bearer tokens. Sessions do not survive a restart; students
+    # simply log in again.
+
+    def __init__(self, ttl=SESSION_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._next_prune = clock() + SESSION_PRUNE_INTERVAL
+
+    def create(self, student_number):
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._prune()
+            self._sessions[token] = (student_number, self.clock() + self.ttl)
+        return token
+
+    def resolve(self, token):
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            student_number, expires = session
+            if expires <= self.clock():
+                del self._sessions[token]
+                return None
+            return student_number
+
+    def revoke(self, token):
+        with self._lock:
+            return self._sessions.pop(token, None) is not None
+
+    def _prune(self):
+        now = self.clock()
+        if now < self._next_prune:
+            return
+        self._next_prune = now + SESSION_PRUNE_INTERVAL
+        for token in [t for t, (_, expires) in self._sessions.items() if expires <= now]:
+            del self._sessions[token]
@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+import main
+from generate_data import generate_dataset, DEFAULT_PASSWORD
+from storage import JsonLinesStorage
+
+# (students, courses, enrollments)
+SIZES = {
+    'small': (1000, 100, 10000),
+    'medium': (10000, 1000, 100000),
+    'large': (100000, 5000, 1000000)
+}
+SEARCH_KEYWORDS = ['cs', 'intro', 'algorithms', 'computer science', 'zzz']
+LOOKUPS = 1000
+ENROLLS = 200
+REGRESSION_THRESHOLD = 1.2
+
+# =========================
+# Timing
+# =========================
+
+def best_time(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def parse_size(name):
+    if name in SIZES:
+        return SIZES[name]
+    students, courses, enrollments = (int(part) for part in name.split(':'))
+    return students, courses, enrollments
+
+# =========================
+# Benchmarks
+# =========================
+
+def run_size(name, data_dir, repeat, seed):
+    students, courses, enrollments = parse_size(name)
+    counts = generate_dataset(data_dir, students, courses, enrollments, seed)
+    rng = random.Random(seed)
+    storage = JsonLinesStorage(data_dir)
+    results = []
+
+    def record(operation, seconds, ops=1):
+        results.append({
+            'size': name,
+            'students': counts['students'],
+            'courses': counts['courses'],
+            'enrollments': counts['enrollments'],
+            'operation': operation,
+            'ops': ops,
+            'seconds': seconds,
+            'us_per_op': seconds / ops * 1e6
+        })
+
+    tables = {}
+    for table in ('students', 'courses', 'enrollments'):
+        load = getattr(storage, f'load_{table}')
+        record(f'load_{table}', best_time(load, repeat))
+        tables[table] = load()
+    for table in ('students', 'courses', 'enrollments'):
+        save = getattr(storage, f'save_{table}')
+        record(f'save_{table}', best_time(lambda: save(tables[table]), repeat))
+
+    student_numbers = list(tables['students'])
+    course_codes = list(tables['courses'])
+    sample = [rng.choice(student_numbers) for _ in range(LOOKUPS)]
+
+    saved_storage = main.use_storage(storage)
+    try:
+        def cold_login():
+            storage.store.invalidate()
+            main.authenticate_student(sample[0], f"{sample[0]}@mocku.edu.ph", DEFAULT_PASSWORD)
+        record('authenticate_student_cold', best_time(cold_login, repeat))
+
+        def warm_logins():
+            for number in sample:
+                main.authenticate_student(number, f"{number}@mocku.edu.ph", DEFAULT_PASSWORD)
+        record('authenticate_student', best_time(warm_logins, repeat), LOOKUPS)
+    finally:
+        main.use_storage(saved_storage)
+
+    storage.search_courses('')
+    for keyword in SEARCH_KEYWORDS:
+        record(f'search_courses[{keyword}]',
+               best_time(lambda: storage.search_courses(keyword), repeat))
+
+    def unit_totals():
+        for number in sample:
+            total = 0
+            for enrollment in storage.student_enrollments(number):
+                course = storage.get_course(enrollment['course_code'])
+                if course:
+                    total += course['units']
+    record('student_unit_totals', best_time(unit_totals, repeat), LOOKUPS)
+
+    def enroll_batch():
+        for _ in range(ENROLLS):
+            storage.enroll({
+                'student_number': rng.choice(student_numbers),
+                'course_code': rng.choice(course_codes),
+                'enrollment_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            })
+    record('enroll', best_time(enroll_batch, 1), ENROLLS)
+
+    def cold_lookup():
+        fresh = JsonLinesStorage(data_dir)
+        fresh.get_student(sample[0])
+        fresh.student_enrollments(sample[0])
+    record('cold_lookup', best_time(cold_lookup, repeat))
+    storage.build_snapshots()
+    record('cold_lookup_snapshot', best_time(cold_lookup, repeat))
+
+    return results
+
+def traced_bytes(load):
+    tracemalloc.start()
+    try:
+        data = load()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del data
+    return size
+
+def measure_enrollment_memory(name, data_dir):
+    # Memory held by the loaded enrollments table, as one dict per line (the
+    # original representation) and as the compact records storage builds.
+    storage = JsonLinesStorage(data_dir)
+
+    def load_dicts():
+        enrollments = {}
+        with open(storage.enrollments_file) as f:
+            for line in f:
+                enrollment = json.loads(line)
+                enrollments.setdefault(enrollment['student_number'], []).append(enrollment)
+        return enrollments
+
+    rows = sum(len(rows) for rows in storage.load_enrollments().values())
+    dict_bytes = traced_bytes(load_dicts)
+    compact_bytes = traced_bytes(storage.load_enrollments)
+    return {
+        'size': name,
+        'rows': rows,
+        'dict_bytes': dict_bytes,
+        'compact_bytes': compact_bytes,
+        'ratio': compact_bytes / dict_bytes if dict_bytes else 0
+    }
+
+def run_benchmarks(sizes, repeat=3, seed=0, keep_dir=None):
+    results = []
+    memory = []
+    for name in sizes:
+        data_dir = os.path.join(keep_dir, name) if keep_dir else tempfile.mkdtemp(prefix='bench_')
+        try:
+            results.extend(run_size(name, data_dir, repeat, seed))
+            memory.append(measure_enrollment_memory(name, data_dir))
+        finally:
+            if not keep_dir:
+                shutil.rmtree(data_dir, ignore_errors=True)
+    return {
+        'generated_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'results': results,
+        'memory': memory
+    }
+
+def compare(previous, current, threshold=REGRESSION_THRESHOLD):
+    before = {(r['size'], r['operation']): r['us_per_op'] for r in previous['results']}
+    regressions = []
+    for result in current['results']:
+        key = (result['size'], result['operation'])
+        if key not in before or not before[key]:
+            continue
+        ratio = result['us_per_op'] / before[key]
+        flag = ' REGRESSION' if ratio > threshold else ''
+        print(f"{key[0]:<8} {key[1]:<32} {before[key]:>12.1f} -> {result['us_per_op']:>12.1f} us/op "
+              f"({ratio:.2f}x){flag}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+# =========================
+# Command Line
+# =========================
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Time storage operations at several dataset sizes.")
+    parser.add_argument("--sizes", default="small,medium",
+                        help="comma-separated presets (small, medium, large) or students:courses:enrollments")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="slowdown ratio reported as a regression")
+    parser.add_argument("--keep-data", help="generate datasets under this directory and keep them")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.sizes.split(','), args.repeat, args.seed, args.keep_data)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'Size':<8} {'Operation':<32} {'Ops':>6} {'us/op':>14}")
+    print("-" * 64)
+    for result in report['results']:
+        print(f"{result['size']:<8} {result['operation']:<32} {result['ops']:>6} {result['us_per_op']:>14.1f}")
+    print(f"\n{'Size':<8} {'Enrollments':>12} {'dict MB':>10} {'compact MB':>11} {'ratio':>7}")
+    print("-" * 52)
+    for usage in report['memory']:
+        print(f"{usage['size']:<8} {usage['rows']:>12} {usage['dict_bytes'] / 2**20:>10.1f} "
+              f"{usage['compact_bytes'] / 2**20:>11.1f} {usage['ratio']:>7.2f}")
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(f"\nComparison with {args.compare}:")
+        if compare(previous, report, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main_cli()
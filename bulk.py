@@ -0,0 +1,307 @@
+import os
+import csv
+import json
+import argparse
+from datetime import datetime
+
+from enrollment_records import enrollment_dict
+from config import DATA_DIR, STORAGE_BACKEND
+from service import (
+    InvalidInput, hash_password, parse_capacity, parse_prerequisites, parse_schedule, validate_email
+)
+from storage import open_storage
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_REJECTS = 20
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+TABLE_FIELDS = {
+    'students': ['student_number', 'name', 'year', 'degree', 'email', 'password_hash'],
+    'courses': ['course_code', 'course_name', 'department', 'units', 'capacity', 'schedule',
+                'prerequisites'],
+    'enrollments': ['student_number', 'course_code', 'enrollment_date']
+}
+
+# =========================
+# Readers/Writers
+# =========================
+
+def detect_format(path):
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+def read_rows(f, fmt):
+    # Yields (line_number, row) where row is None for unparseable input.
+    if fmt == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+def write_rows(f, fmt, table, rows):
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(f, fieldnames=TABLE_FIELDS[table], extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            # Lists (a course's prerequisites) go in one comma-separated cell.
+            writer.writerow({key: ','.join(value) if isinstance(value, list) else value
+                             for key, value in row.items()})
+            count += 1
+        return count
+    for row in rows:
+        f.write(json.dumps(enrollment_dict(row)) + '\n')
+        count += 1
+    return count
+
+# =========================
+# Validation
+# =========================
+
+def _extra_fields(row, skip=()):
+    return {key: value for key, value in row.items() if key is not None and key not in skip}
+
+def _reason(error):
+    # A service error message as a reject reason.
+    message = str(error).rstrip('!')
+    return message[:1].lower() + message[1:]
+
+def _text(row, field):
+    value = row.get(field)
+    return str(value).strip() if value is not None else ''
+
+# Each validator gets the keys of the rows in the chunk not yet committed.
+
+def validate_student(row, storage, replace, pending):
+    student_number = _text(row, 'student_number')
+    if not student_number:
+        return None, "missing student_number"
+    for field in ('name', 'year', 'degree'):
+        if not _text(row, field):
+            return None, f"missing {field}"
+    email = _text(row, 'email') or f"{student_number}@mocku.edu.ph"
+    if not validate_email(email, student_number):
+        return None, f"email must be {student_number}@mocku.edu.ph"
+    if _text(row, 'password_hash'):
+        password = _text(row, 'password_hash')
+    elif _text(row, 'password'):
+        password = hash_password(_text(row, 'password'))
+    else:
+        return None, "missing password"
+    if not replace and storage.get_student(student_number):
+        return None, f"student {student_number} already exists"
+    student = _extra_fields(row, skip=('password_hash',))
+    student.update({
+        'student_number': student_number,
+        'name': _text(row, 'name'),
+        'year': _text(row, 'year'),
+        'degree': _text(row, 'degree'),
+        'email': email,
+        'password': password
+    })
+    return student, None
+
+def validate_course(row, storage, replace, pending):
+    course_code = _text(row, 'course_code').upper()
+    if not course_code:
+        return None, "missing course_code"
+    if not _text(row, 'course_name'):
+        return None, "missing course_name"
+    try:
+        units = int(_text(row, 'units'))
+    except ValueError:
+        return None, "units must be a number"
+    try:
+        capacity = parse_capacity(row.get('capacity'))
+        schedule = parse_schedule(row.get('schedule'))
+        prerequisites = []
+        if row.get('prerequisites') not in (None, ''):
+            prerequisites = parse_prerequisites(row['prerequisites'])
+    except InvalidInput as e:
+        return None, _reason(e)
+    if not replace and storage.get_course(course_code):
+        return None, f"course {course_code} already exists"
+    # Prerequisites must be in the catalog or earlier in the input.
+    unknown = [code for code in prerequisites if code not in pending and not storage.get_course(code)]
+    if unknown:
+        return None, f"unknown prerequisite course(s) {', '.join(unknown)}"
+    if storage.prerequisite_graph().creates_cycle(course_code, prerequisites):
+        return None, f"{course_code} cannot require a course that requires it"
+    course = _extra_fields(row, skip=('capacity', 'schedule', 'prerequisites'))
+    course.update({
+        'course_code': course_code,
+        'course_name': _text(row, 'course_name'),
+        'department': _text(row, 'department'),
+        'units': units
+    })
+    if capacity is not None:
+        course['capacity'] = capacity
+    if schedule:
+        course['schedule'] = schedule
+    if prerequisites:
+        course['prerequisites'] = prerequisites
+    return course, None
+
+def validate_enrollment(row, storage, replace, pending):
+    student_number = _text(row, 'student_number')
+    course_code = _text(row, 'course_code').upper()
+    if not student_number or not course_code:
+        return None, "missing student_number or course_code"
+    enrollment_date = _text(row, 'enrollment_date') or datetime.now().strftime(DATE_FORMAT)
+    try:
+        datetime.strptime(enrollment_date, DATE_FORMAT)
+    except ValueError:
+        return None, f"enrollment_date must look like {DATE_FORMAT}"
+    if not storage.get_student(student_number):
+        return None, f"unknown student {student_number}"
+    if not storage.get_course(course_code):
+        return None, f"unknown course {course_code}"
+    if any(e['course_code'] == course_code for e in storage.student_enrollments(student_number)):
+        return None, f"{student_number} is already enrolled in {course_code}"
+    return {
+        'student_number': student_number,
+        'course_code': course_code,
+        'enrollment_date': enrollment_date
+    }, None
+
+VALIDATORS = {
+    'students': (validate_student, lambda r: r['student_number']),
+    'courses': (validate_course, lambda r: r['course_code']),
+    'enrollments': (validate_enrollment, lambda r: (r['student_number'], r['course_code']))
+}
+
+# =========================
+# Import/Export
+# =========================
+
+class ImportReport:
+    def __init__(self):
+        self.accepted = 0
+        self.rejected = 0
+        self.chunks = 0
+        self.rejects = []
+
+    def reject(self, line_number, reason, rejects_file=None):
+        self.rejected += 1
+        if len(self.rejects) < MAX_REPORTED_REJECTS:
+            self.rejects.append((line_number, reason))
+        if rejects_file is not None:
+            rejects_file.write(json.dumps({'line': line_number, 'reason': reason}) + '\n')
+
+def _commit(storage, table, chunk):
+    if table == 'students':
+        storage.put_students(chunk)
+    elif table == 'courses':
+        storage.put_courses(chunk)
+    else:
+        storage.append_enrollments(chunk)
+
+def import_records(storage, table, f, fmt, chunk_size=DEFAULT_CHUNK_SIZE, replace=False,
+                   rejects_file=None):
+    # Rows are validated against what is already stored, so duplicates from
+    # earlier chunks are caught once those chunks commit; only the current
+    # chunk is held in memory.
+    validate, key_of = VALIDATORS[table]
+    report = ImportReport()
+    chunk = []
+    chunk_keys = set()
+
+    def flush():
+        _commit(storage, table, chunk)
+        report.accepted += len(chunk)
+        report.chunks += 1
+        chunk.clear()
+        chunk_keys.clear()
+
+    for line_number, row in read_rows(f, fmt):
+        if row is None:
+            report.reject(line_number, "malformed row", rejects_file)
+            continue
+        if replace and table == 'courses' and chunk and row.get('prerequisites'):
+            # A replaced course may already be required by the ones in the
+            # chunk; the cycle check needs those committed first.
+            flush()
+        record, reason = validate(row, storage, replace, chunk_keys)
+        if record is not None and key_of(record) in chunk_keys:
+            record, reason = None, "duplicate row in input"
+        if record is None:
+            report.reject(line_number, reason, rejects_file)
+            continue
+        chunk.append(record)
+        chunk_keys.add(key_of(record))
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    return report
+
+def _exported_student(student):
+    # Stored passwords are already hashed; export them under the column the
+    # importer keeps verbatim so a round trip does not hash them twice.
+    row = dict(student)
+    row['password_hash'] = row.pop('password', '')
+    return row
+
+def export_records(storage, table, f, fmt):
+    if table == 'students':
+        rows = (_exported_student(student) for student in storage.iter_students())
+    elif table == 'courses':
+        rows = storage.iter_courses()
+    else:
+        rows = storage.iter_enrollments()
+    return write_rows(f, fmt, table, rows)
+
+# =========================
+# Command Line
+# =========================
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import/export of enrollment data.")
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("table", choices=sorted(TABLE_FIELDS))
+    parser.add_argument("path", help="CSV (.csv) or JSON-lines file")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="override format detection")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--backend", default=STORAGE_BACKEND, choices=["jsonl", "sqlite"])
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--replace", action="store_true", help="overwrite existing students/courses")
+    parser.add_argument("--rejects", help="write every rejected row to this JSON-lines file")
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(args.path)
+    if not os.path.exists(args.data_dir):
+        os.makedirs(args.data_dir)
+    storage = open_storage(args.backend, args.data_dir)
+
+    if args.action == 'export':
+        with open(args.path, 'w', newline='') as f:
+            count = export_records(storage, args.table, f, fmt)
+        print(f"Exported {count} {args.table} to {args.path}")
+        return
+
+    rejects_file = open(args.rejects, 'w') if args.rejects else None
+    try:
+        with open(args.path, 'r', newline='') as f:
+            report = import_records(storage, args.table, f, fmt, args.chunk_size,
+                                    args.replace, rejects_file)
+    finally:
+        if rejects_file is not None:
+            rejects_file.close()
+
+    print(f"Imported {report.accepted} {args.table} in {report.chunks} commit(s)")
+    print(f"Rejected {report.rejected} row(s)")
+    for line_number, reason in report.rejects:
+        print(f"  line {line_number}: {reason}")
+    if report.rejected > len(report.rejects):
+        print(f"  ... {report.rejected - len(report.rejects)} more")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import os
+
+from terms import partition_dir
+
+# Settings shared by the command line tools and the server, read from the
+# environment. Importing this opens nothing; main.py opens the storage.
+
+DATA_ROOT = "data"
+# Each campus keeps its data apart, under data/campuses/<campus>.
+CAMPUS = os.environ.get("ENROLLMENT_CAMPUS") or None
+DATA_DIR = partition_dir(DATA_ROOT, CAMPUS)
+STORAGE_BACKEND = os.environ.get("ENROLLMENT_STORAGE", "jsonl")
+# Where course-change notices go: "file" (data/outbox) or "stub".
+NOTICE_SINK = os.environ.get("ENROLLMENT_NOTICES", "file")
+# Bearer token for the registrar's HTTP routes; unset, they are refused.
+ADMIN_TOKEN = os.environ.get("ENROLLMENT_ADMIN_TOKEN") or None
@@ -0,0 +1,48 @@
+# =========================
+# Course Roster Index
+# =========================
+
+class CourseRosterIndex:
+    # Reverse of the enrollments table: course_code -> {student_number: rows}.
+    # Duplicate enrollment rows are counted per student so a headcount is the
+    # number of distinct students, and a tombstone drops the student outright.
+
+    def __init__(self):
+        self._rosters = {}
+
+    def rebuild(self, enrollments):
+        self._rosters = {}
+        for student_enrollments in enrollments.values():
+            for enrollment in student_enrollments:
+                self._add(enrollment['student_number'], enrollment['course_code'])
+
+    def apply(self, record):
+        if record.get('deleted'):
+            self._remove(record['student_number'], record['course_code'])
+        else:
+            self._add(record['student_number'], record['course_code'])
+
+    def _add(self, student_number, course_code):
+        roster = self._rosters.get(course_code)
+        if roster is None:
+            roster = self._rosters[course_code] = {}
+        roster[student_number] = roster.get(student_number, 0) + 1
+
+    def _remove(self, student_number, course_code):
+        roster = self._rosters.get(course_code)
+        if roster is not None:
+            roster.pop(student_number, None)
+            if not roster:
+                del self._rosters[course_code]
+
+    def roster(self, course_code):
+        return sorted(self._rosters.get(course_code, ()))
+
+    def headcount(self, course_code):
+        return len(self._rosters.get(course_code, ()))
+
+    def headcounts(self):
+        return {code: len(roster) for code, roster in self._rosters.items()}
+
+    def is_enrolled(self, student_number, course_code):
+        return student_number in self._rosters.get(course_code, ())
@@ -0,0 +1,194 @@
+import re
+import sys
+import json
+import threading
+from collections.abc import Mapping
+from datetime import date, datetime
+from json.encoder import encode_basestring_ascii
+
+FIELDS = ('student_number', 'course_code', 'enrollment_date')
+EPOCH = datetime(1970, 1, 1)
+EPOCH_DAY = EPOCH.toordinal()
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# The exact line json.dumps writes for a plain enrollment. Matching it pulls
+# out the compact fields in about the time json.loads takes to build a dict;
+# any other layout goes through json.loads.
+CANONICAL_LINE = re.compile(
+    r'\{"student_number": "([^"\\]*)", "course_code": "([^"\\]*)", '
+    r'"enrollment_date": "(\d{4}-\d\d-\d\d) ([01]\d|2[0-3]):([0-5]\d):([0-5]\d)"\}\s*\Z', re.ASCII)
+
+# =========================
+# Course Codes
+# =========================
+
+class CourseCodeTable:
+    # Interns course codes as small integers. Ids are never reused, so a
+    # record keeps naming the same code for the life of the process.
+
+    def __init__(self):
+        self.codes = []
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def id_for(self, code):
+        code_id = self._ids.get(code)
+        if code_id is None:
+            with self._lock:
+                code_id = self._ids.get(code)
+                if code_id is None:
+                    code_id = len(self.codes)
+                    self.codes.append(sys.intern(code))
+                    self._ids[code] = code_id
+        return code_id
+
+COURSE_CODES = CourseCodeTable()
+
+# =========================
+# Dates
+# =========================
+
+_day_seconds_cache = {}
+_day_text_cache = {}
+# "HH:MM:" for each minute of the day and "SS" for each second, so decoding
+# a date is two lookups rather than a strftime.
+_MINUTE_TEXT = [f"{hours:02d}:{minutes:02d}:" for hours in range(24) for minutes in range(60)]
+_SECOND_TEXT = [f"{seconds:02d}" for seconds in range(60)]
+
+def _day_seconds(text):
+    seconds = _day_seconds_cache.get(text)
+    if seconds is None:
+        try:
+            day = date.fromisoformat(text)
+        except ValueError:
+            return None
+        if day.isoformat() != text:
+            return None
+        seconds = _day_seconds_cache[text] = (day.toordinal() - EPOCH_DAY) * SECONDS_PER_DAY
+    return seconds
+
+def _clock_seconds(hours, minutes, seconds):
+    hours, minutes, seconds = int(hours), int(minutes), int(seconds)
+    if hours > 23 or minutes > 59 or seconds > 59:
+        return None
+    return hours * 3600 + minutes * 60 + seconds
+
+def encode_date(text):
+    # Epoch seconds for a "%Y-%m-%d %H:%M:%S" string, or None if `text` is
+    # anything else, so that decode_date(encode_date(text)) == text.
+    if (not isinstance(text, str) or len(text) != 19 or text[10] != ' '
+            or text[13] != ':' or text[16] != ':'):
+        return None
+    clock = (text[11:13], text[14:16], text[17:])
+    if not all(part.isascii() and part.isdigit() for part in clock):
+        return None
+    day = _day_seconds(text[:10])
+    moment = _clock_seconds(*clock)
+    if day is None or moment is None:
+        return None
+    return day + moment
+
+def decode_date(seconds):
+    day, moment = divmod(seconds, SECONDS_PER_DAY)
+    text = _day_text_cache.get(day)
+    if text is None:
+        text = _day_text_cache[day] = date.fromordinal(EPOCH_DAY + day).isoformat()
+    minute, second = divmod(moment, 60)
+    return f"{text} {_MINUTE_TEXT[minute]}{_SECOND_TEXT[second]}"
+
+# =========================
+# Enrollment Records
+# =========================
+
+class Enrollment(Mapping):
+    # A plain enrollment in three slots: the interned student number, the
+    # course code's id in COURSE_CODES and the date in epoch seconds. It is
+    # read exactly like the dict it replaces; to_dict() gives that dict back,
+    # e.g. for json.dumps.
+
+    __slots__ = ('student_number', 'code_id', 'seconds')
+
+    def __init__(self, student_number, code_id, seconds):
+        self.student_number = student_number
+        self.code_id = code_id
+        self.seconds = seconds
+
+    def __getitem__(self, field):
+        if field == 'student_number':
+            return self.student_number
+        if field == 'course_code':
+            return COURSE_CODES.codes[self.code_id]
+        if field == 'enrollment_date':
+            return decode_date(self.seconds)
+        raise KeyError(field)
+
+    def to_dict(self):
+        return {
+            'student_number': self.student_number,
+            'course_code': COURSE_CODES.codes[self.code_id],
+            'enrollment_date': decode_date(self.seconds)
+        }
+
+    def get(self, field, default=None):
+        return self[field] if field in FIELDS else default
+
+    def __contains__(self, field):
+        return field in FIELDS
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __eq__(self, other):
+        if isinstance(other, Enrollment):
+            return (self.student_number == other.student_number
+                    and self.code_id == other.code_id and self.seconds == other.seconds)
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+def enrollment_dict(enrollment):
+    # The plain dict for a stored enrollment record of either form.
+    return enrollment.to_dict() if isinstance(enrollment, Enrollment) else enrollment
+
+def enrollment_json(enrollment):
+    # json.dumps(enrollment_dict(enrollment)), without building the dict.
+    if not isinstance(enrollment, Enrollment):
+        return json.dumps(enrollment)
+    return (f'{{"student_number": {encode_basestring_ascii(enrollment.student_number)}, '
+            f'"course_code": {encode_basestring_ascii(COURSE_CODES.codes[enrollment.code_id])}, '
+            f'"enrollment_date": "{decode_date(enrollment.seconds)}"}}')
+
+def compact_enrollment(data):
+    # An Enrollment for a plain record. Records with other fields, or values
+    # the compact form cannot reproduce exactly, are returned unchanged.
+    if not isinstance(data, dict) or len(data) != len(FIELDS):
+        return data
+    student_number = data.get('student_number')
+    course_code = data.get('course_code')
+    if not isinstance(student_number, str) or not isinstance(course_code, str):
+        return data
+    seconds = encode_date(data.get('enrollment_date'))
+    if seconds is None:
+        return data
+    return Enrollment(sys.intern(student_number), COURSE_CODES.id_for(course_code), seconds)
+
+def parse_enrollment_line(line):
+    # The Enrollment on a line json.dumps wrote for a plain record, else None.
+    match = CANONICAL_LINE.match(line)
+    if match is None:
+        return None
+    student_number, course_code, day, hours, minutes, seconds = match.groups()
+    # Called once per line of the log, so the common paths are inlined.
+    day_seconds = _day_seconds_cache.get(day)
+    if day_seconds is None:
+        day_seconds = _day_seconds(day)
+        if day_seconds is None:
+            return None
+    return Enrollment(sys.intern(student_number), COURSE_CODES.id_for(course_code),
+                      day_seconds + int(hours) * 3600 + int(minutes) * 60 + int(seconds))
@@ -0,0 +1,127 @@
+import os
+import json
+import random
+import hashlib
+import argparse
+from datetime import datetime, timedelta
+
+from storage import STUDENTS_FILENAME, COURSES_FILENAME, ENROLLMENTS_FILENAME
+
+DEPARTMENTS = [
+    ('CS', 'Computer Science'),
+    ('IT', 'Information Technology'),
+    ('CE', 'Computer Engineering'),
+    ('MATH', 'Mathematics'),
+    ('ENG', 'English'),
+    ('PHYS', 'Physics'),
+    ('CHEM', 'Chemistry'),
+    ('BIO', 'Biology'),
+    ('ECON', 'Economics'),
+    ('HIST', 'History')
+]
+DEGREES = ['BS Computer Science', 'BS Information Technology', 'BS Computer Engineering',
+           'BS Mathematics', 'BS Biology', 'AB Economics']
+YEARS = ['1st Year', '2nd Year', '3rd Year', '4th Year']
+FIRST_NAMES = ['Juan', 'Maria', 'Pedro', 'Ana', 'Carlos', 'Jose', 'Rosa', 'Miguel', 'Luz', 'Ramon',
+               'Elena', 'Andres', 'Carmen', 'Rafael', 'Teresa', 'Antonio', 'Isabel', 'Manuel']
+LAST_NAMES = ['dela Cruz', 'Santos', 'Reyes', 'Garcia', 'Mendoza', 'Bautista', 'Ramos', 'Aquino',
+              'Villanueva', 'Castillo', 'Flores', 'Torres', 'Navarro', 'Domingo', 'Salazar']
+TOPICS = ['Introduction to', 'Advanced', 'Applied', 'Foundations of', 'Topics in', 'Seminar in',
+          'Principles of', 'Laboratory in']
+SUBJECTS = ['Programming', 'Algorithms', 'Databases', 'Networks', 'Calculus', 'Statistics',
+            'Writing', 'Mechanics', 'Genetics', 'Microeconomics', 'Logic Design', 'Security',
+            'Linear Algebra', 'Organic Chemistry', 'World History', 'Operating Systems']
+
+DEFAULT_PASSWORD = 'password123'
+TERM_START = datetime(2025, 8, 1)
+
+# =========================
+# Generators
+# =========================
+
+def student_number_for(i):
+    return f"{2020000 + i:07d}"
+
+def course_code_for(i):
+    return f"{DEPARTMENTS[i % len(DEPARTMENTS)][0]}{100 + i // len(DEPARTMENTS)}"
+
+def generate_students(count, rng):
+    password = hashlib.sha256(DEFAULT_PASSWORD.encode()).hexdigest()
+    for i in range(count):
+        student_number = student_number_for(i)
+        yield {
+            'student_number': student_number,
+            'name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            'year': rng.choice(YEARS),
+            'degree': rng.choice(DEGREES),
+            'email': f"{student_number}@mocku.edu.ph",
+            'password': password
+        }
+
+def generate_courses(count, rng):
+    for i in range(count):
+        yield {
+            'course_code': course_code_for(i),
+            'course_name': f"{rng.choice(TOPICS)} {rng.choice(SUBJECTS)}",
+            'department': DEPARTMENTS[i % len(DEPARTMENTS)][1],
+            'units': rng.choice([1, 2, 3, 3, 3, 4, 5])
+        }
+
+def generate_enrollments(student_numbers, course_codes, count, rng):
+    # Spreads `count` enrollments evenly over the students, each student
+    # taking distinct courses, with dates scattered over the first weeks of term.
+    per_student, extra = divmod(count, len(student_numbers)) if student_numbers else (0, 0)
+    for i, student_number in enumerate(student_numbers):
+        taken = min(per_student + (1 if i < extra else 0), len(course_codes))
+        for course_code in rng.sample(course_codes, taken):
+            enrolled_at = TERM_START + timedelta(seconds=rng.randrange(60 * 60 * 24 * 21))
+            yield {
+                'student_number': student_number,
+                'course_code': course_code,
+                'enrollment_date': enrolled_at.strftime("%Y-%m-%d %H:%M:%S")
+            }
+
+def _write(path, records):
+    count = 0
+    with open(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+            count += 1
+    return count
+
+def generate_dataset(data_dir, students, courses, enrollments, seed=0):
+    rng = random.Random(seed)
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    student_numbers = [student_number_for(i) for i in range(students)]
+    course_codes = [course_code_for(i) for i in range(courses)]
+    return {
+        'students': _write(os.path.join(data_dir, STUDENTS_FILENAME),
+                           generate_students(students, rng)),
+        'courses': _write(os.path.join(data_dir, COURSES_FILENAME),
+                          generate_courses(courses, rng)),
+        'enrollments': _write(os.path.join(data_dir, ENROLLMENTS_FILENAME),
+                              generate_enrollments(student_numbers, course_codes,
+                                                   enrollments, rng))
+    }
+
+# =========================
+# Command Line
+# =========================
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic dataset in the data/*.txt format.")
+    parser.add_argument("--data-dir", default="bench_data")
+    parser.add_argument("--students", type=int, default=100000)
+    parser.add_argument("--courses", type=int, default=5000)
+    parser.add_argument("--enrollments", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    counts = generate_dataset(args.data_dir, args.students, args.courses, args.enrollments, args.seed)
+    print(f"Wrote {counts['students']} students, {counts['courses']} courses and "
+          f"{counts['enrollments']} enrollments to {args.data_dir}")
+    print(f"Every student's password is {DEFAULT_PASSWORD}")
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,12 @@
 import os
 import json
-import hashlib
+
+from auth import hash_password
 
 DATA_DIR = "data"
 STUDENTS_FILE = os.path.join(DATA_DIR, "students.txt")
 COURSES_FILE = os.path.join(DATA_DIR, "courses.txt")
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
 def initialize_students():
     students = [
         {
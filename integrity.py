@@ -0,0 +1,232 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+from datetime import datetime
+
+from enrollment_records import encode_date, parse_enrollment_line
+
+MAX_REPORTED_ISSUES = 20
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Enrollment logs larger than this are checked a partition at a time.
+PARTITION_BYTES = 64 * 1024 * 1024
+
+# Kinds of problem found in the enrollment log.
+MALFORMED = 'malformed line'
+DUPLICATE = 'duplicate enrollment'
+ORPHANED_COURSE = 'unknown course code'
+UNKNOWN_STUDENT = 'unknown student number'
+ISSUE_KINDS = (MALFORMED, DUPLICATE, ORPHANED_COURSE, UNKNOWN_STUDENT)
+# A tombstone dropped quietly: it cancels nothing that was kept.
+SKIPPED = 'skipped'
+
+# =========================
+# Scanning
+# =========================
+
+class IntegrityReport:
+    def __init__(self):
+        self.lines = 0
+        self.kept = 0
+        self.counts = dict.fromkeys(ISSUE_KINDS, 0)
+        self.issues = []
+
+    def flag(self, line_number, kind, detail):
+        self.counts[kind] += 1
+        if len(self.issues) < MAX_REPORTED_ISSUES:
+            self.issues.append((line_number, kind, detail))
+
+    @property
+    def problems(self):
+        return sum(self.counts.values())
+
+    @property
+    def clean(self):
+        return self.problems == 0
+
+def _parse(raw):
+    try:
+        data = json.loads(raw)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    return data if isinstance(data, dict) else None
+
+def log_keys(path, key):
+    # The keys of a last-write-wins log (students.txt, courses.txt), read one
+    # line at a time.
+    keys = set()
+    if not os.path.exists(path):
+        return keys
+    with open(path, 'rb') as f:
+        for raw in f:
+            data = _parse(raw)
+            if data is not None and isinstance(data.get(key), str):
+                keys.add(data[key])
+    return keys
+
+def _malformed(data):
+    # The reason an enrollment log record is unusable, or None.
+    if data is None:
+        return "not a JSON object"
+    if not isinstance(data.get('student_number'), str) or not isinstance(data.get('course_code'), str):
+        return "missing student_number or course_code"
+    if data.get('deleted') or encode_date(data.get('enrollment_date')) is not None:
+        return None
+    try:
+        datetime.strptime(data.get('enrollment_date'), DATE_FORMAT)
+    except (TypeError, ValueError):
+        return f"enrollment_date must look like {DATE_FORMAT}"
+    return None
+
+def _parse_record(raw):
+    # (data, None) for a usable enrollment log line, else (None, reason).
+    try:
+        line = raw.decode()
+    except UnicodeDecodeError:
+        return None, "not UTF-8"
+    # Lines in the usual layout skip json.loads and the date checks.
+    data = parse_enrollment_line(line)
+    if data is None:
+        data = _parse(line)
+        reason = _malformed(data)
+        if reason is not None:
+            return None, reason
+    return data, None
+
+def _verdict(pair, deleted, live, student_numbers, course_codes):
+    # None keeps the line, SKIPPED drops a tombstone that cancels no kept
+    # enrollment, and an issue kind drops the line as that problem. `live`
+    # holds the pairs with a kept line; a dropped orphan is not tracked, so
+    # a later row for the same pair is judged on its own.
+    if deleted:
+        if pair not in live:
+            return SKIPPED
+        live.discard(pair)
+        return None
+    if pair in live:
+        return DUPLICATE
+    if pair[1] not in course_codes:
+        return ORPHANED_COURSE
+    if pair[0] not in student_numbers:
+        return UNKNOWN_STUDENT
+    live.add(pair)
+    return None
+
+def _verdicts(enrollments_path, student_numbers, course_codes):
+    # (line_number, raw, kind, detail) for each non-blank line, in one pass.
+    live = set()
+    with open(enrollments_path, 'rb') as f:
+        for line_number, raw in enumerate(f, 1):
+            if not raw.strip():
+                continue
+            data, reason = _parse_record(raw)
+            if data is None:
+                yield line_number, raw, MALFORMED, reason
+                continue
+            pair = (sys.intern(data['student_number']), sys.intern(data['course_code']))
+            kind = _verdict(pair, data.get('deleted'), live, student_numbers, course_codes)
+            yield line_number, raw, kind, kind and f"{pair[0]} / {pair[1]}"
+
+def _partitioned_verdicts(enrollments_path, student_numbers, course_codes, partitions):
+    # As _verdicts, but the pairs are first spread over temporary partition
+    # files by hash, each judged on its own with only its pairs in memory.
+    # What is kept between passes is the line numbers of dropped lines.
+    dropped = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, str(i)) for i in range(partitions)]
+        files = [open(path, 'w') for path in paths]
+        try:
+            with open(enrollments_path, 'rb') as f:
+                for line_number, raw in enumerate(f, 1):
+                    if not raw.strip():
+                        continue
+                    data, reason = _parse_record(raw)
+                    if data is None:
+                        dropped[line_number] = (MALFORMED, reason)
+                        continue
+                    pair = (data['student_number'], data['course_code'])
+                    files[hash(pair) % partitions].write(
+                        json.dumps([line_number, *pair, bool(data.get('deleted'))]) + '\n')
+        finally:
+            for partition in files:
+                partition.close()
+        for path in paths:
+            live = set()
+            with open(path) as partition:
+                for line in partition:
+                    line_number, student_number, course_code, deleted = json.loads(line)
+                    pair = (student_number, course_code)
+                    kind = _verdict(pair, deleted, live, student_numbers, course_codes)
+                    if kind is not None:
+                        dropped[line_number] = (kind, f"{student_number} / {course_code}")
+    with open(enrollments_path, 'rb') as f:
+        for line_number, raw in enumerate(f, 1):
+            if raw.strip():
+                yield (line_number, raw, *dropped.get(line_number, (None, None)))
+
+def scan_enrollments(enrollments_path, student_numbers, course_codes, repaired=None,
+                     partition_bytes=PARTITION_BYTES):
+    # Streams the enrollment log, never holding the file itself. Lines that
+    # pass every check are written to `repaired` unchanged and in order;
+    # tombstones are kept only while they cancel a kept enrollment. A log up
+    # to partition_bytes is judged in one pass holding each distinct
+    # student/course pair; a larger one is split by pair into about that
+    # much per partition, so memory follows the partition size and the
+    # number of dropped lines rather than the whole log.
+    report = IntegrityReport()
+    if not os.path.exists(enrollments_path):
+        return report
+    partitions = os.path.getsize(enrollments_path) // partition_bytes + 1
+    if partitions == 1:
+        verdicts = _verdicts(enrollments_path, student_numbers, course_codes)
+    else:
+        verdicts = _partitioned_verdicts(enrollments_path, student_numbers, course_codes,
+                                         partitions)
+    for line_number, raw, kind, detail in verdicts:
+        report.lines += 1
+        if kind is SKIPPED:
+            continue
+        if kind is not None:
+            report.flag(line_number, kind, detail)
+            continue
+        report.kept += 1
+        if repaired is not None:
+            repaired.write(raw if raw.endswith(b'\n') else raw + b'\n')
+    return report
+
+# =========================
+# Command Line
+# =========================
+
+def main():
+    from config import CAMPUS, DATA_ROOT
+    from storage import JsonLinesStorage
+    from terms import partition_dir
+
+    parser = argparse.ArgumentParser(
+        description="Check the enrollment log for duplicates, orphans and malformed lines.")
+    parser.add_argument("action", choices=["check", "repair"])
+    parser.add_argument("--data-dir", default=DATA_ROOT)
+    parser.add_argument("--campus", default=CAMPUS, help="check one campus's partition")
+    args = parser.parse_args()
+
+    storage = JsonLinesStorage(partition_dir(args.data_dir, args.campus))
+    report = storage.check_enrollments(repair=args.action == 'repair')
+
+    print(f"Scanned {report.lines} enrollment record(s)")
+    for kind in ISSUE_KINDS:
+        print(f"  {kind}: {report.counts[kind]}")
+    for line_number, kind, detail in report.issues:
+        print(f"  line {line_number}: {kind} ({detail})")
+    if report.problems > len(report.issues):
+        print(f"  ... {report.problems - len(report.issues)} more")
+    if report.clean:
+        print("No problems found")
+    elif args.action == 'repair':
+        print(f"Rewrote {storage.enrollments_file} with {report.kept} record(s)")
+    else:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
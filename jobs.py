@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import uuid
+import threading
+
+from locking import FileLock
+
+JOBS_FILENAME = "jobs.txt"
+OUTBOX_DIRNAME = "outbox"
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+STATUSES = (PENDING, RUNNING, DONE, FAILED)
+
+WORKERS = 4
+# A job is tried this many times; the wait before each retry doubles.
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 1.0
+# A running job whose worker has not finished it by then (because its
+# process died) is handed to another worker.
+LEASE_SECONDS = 60.0
+# Idle workers look for new or retryable jobs at least this often.
+POLL_INTERVAL = 0.5
+# Finished jobs are dropped from the queue file once it grows past this.
+COMPACT_BYTES = 1024 * 1024
+
+# =========================
+# Job Queue
+# =========================
+
+class JobQueue:
+    # Jobs are kept in a JSON-lines file with one record per state change;
+    # the last record for a job_id wins, as in the data files. Each change
+    # is appended under a FileLock after reading what other processes have
+    # appended, so workers in several processes can share one queue. A
+    # worker claims a job by appending a 'running' record with a lease.
+    #
+    # Only enqueued jobs are fsynced. A claim or a result lost in a crash
+    # just means the job runs again, so delivery is at least once.
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = FileLock(path + '.lock')
+        self._jobs = {}
+        self._open = {}
+        self._offset = 0
+        self._inode = None
+        self._next_due = None
+        self._changed = threading.Condition()
+
+    def enqueue(self, kind, payloads, label=''):
+        # One job per payload, sharing a batch id that progress() reports on.
+        batch = uuid.uuid4().hex[:12]
+        now = time.time()
+        jobs = [{
+            'job_id': f"{batch}-{i}",
+            'batch': batch,
+            'label': label,
+            'kind': kind,
+            'payload': payload,
+            'status': PENDING,
+            'attempts': 0,
+            'run_at': now,
+            'error': None
+        } for i, payload in enumerate(payloads)]
+        if jobs:
+            with self._lock:
+                self._refresh()
+                self._append(jobs, sync=True)
+            self.wake()
+        return batch
+
+    def claim(self, owner):
+        # The oldest job that is due, or None.
+        with self._lock:
+            self._refresh()
+            now = time.time()
+            next_due = None
+            for job_id in self._open:
+                job = self._jobs[job_id]
+                if job['run_at'] <= now:
+                    claimed = dict(job, status=RUNNING, attempts=job['attempts'] + 1,
+                                   run_at=now + LEASE_SECONDS, owner=owner)
+                    self._append([claimed])
+                    return claimed
+                if next_due is None or job['run_at'] < next_due:
+                    next_due = job['run_at']
+            self._next_due = next_due
+        return None
+
+    def complete(self, job):
+        with self._lock:
+            self._refresh()
+            self._append([dict(job, status=DONE, error=None)])
+
+    def fail(self, job, error):
+        with self._lock:
+            self._refresh()
+            if job['attempts'] >= MAX_ATTEMPTS:
+                self._append([dict(job, status=FAILED, error=error)])
+            else:
+                delay = RETRY_DELAY * 2 ** (job['attempts'] - 1)
+                self._append([dict(job, status=PENDING, error=error, run_at=time.time() + delay)])
+        self.wake()
+
+    def progress(self, batch=None):
+        # Job counts by status, over one batch or the whole queue.
+        counts = dict.fromkeys(STATUSES, 0)
+        with self._lock:
+            self._refresh()
+            for job in self._jobs.values():
+                if batch is None or job['batch'] == batch:
+                    counts[job['status']] += 1
+        counts['total'] = sum(counts.values())
+        return counts
+
+    def batches(self):
+        # Progress of each batch still in the queue, oldest first.
+        batches = {}
+        with self._lock:
+            self._refresh()
+            for job in self._jobs.values():
+                row = batches.get(job['batch'])
+                if row is None:
+                    row = batches[job['batch']] = dict(dict.fromkeys(STATUSES, 0), batch=job['batch'],
+                                                       label=job['label'], total=0)
+                row[job['status']] += 1
+                row['total'] += 1
+        return list(batches.values())
+
+    def failed(self, batch=None):
+        with self._lock:
+            self._refresh()
+            return [job for job in self._jobs.values()
+                    if job['status'] == FAILED and (batch is None or job['batch'] == batch)]
+
+    def wait(self, timeout):
+        # Returns early when jobs are queued or put back for a retry, or
+        # when the next retry seen by claim() falls due.
+        next_due = self._next_due
+        if next_due is not None:
+            timeout = max(0.0, min(timeout, next_due - time.time()))
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def compact(self, max_bytes=COMPACT_BYTES):
+        # Rewrites the file without finished jobs once it is over max_bytes.
+        with self._lock:
+            self._refresh()
+            if self._offset <= max_bytes:
+                return False
+            keep = [job for job in self._jobs.values() if job['status'] != DONE]
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                for job in keep:
+                    f.write(json.dumps(job) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._jobs, self._open, self._offset, self._inode = {}, {}, 0, None
+            self._refresh()
+            return True
+
+    def wake(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    # Caller holds the lock for the rest.
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._jobs, self._open, self._offset, self._inode = {}, {}, 0, None
+            return
+        if stat.st_ino != self._inode:
+            # First read, or another process compacted the file.
+            self._jobs, self._open, self._offset, self._inode = {}, {}, 0, stat.st_ino
+        if stat.st_size == self._offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                self._offset += len(raw)
+                try:
+                    job = json.loads(raw)
+                except ValueError:
+                    continue
+                self._apply(job)
+
+    def _apply(self, job):
+        self._jobs[job['job_id']] = job
+        if job['status'] in (DONE, FAILED):
+            self._open.pop(job['job_id'], None)
+        else:
+            self._open.setdefault(job['job_id'], None)
+
+    def _append(self, jobs, sync=False):
+        with open(self.path, 'a') as f:
+            if f.tell() > self._offset:
+                # Unreadable bytes at the end, left by a writer that died.
+                f.write('\n')
+            f.write(''.join(json.dumps(job) + '\n' for job in jobs))
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+            self._offset = f.tell()
+            self._inode = os.fstat(f.fileno()).st_ino
+        for job in jobs:
+            self._apply(job)
+
+# =========================
+# Worker Pool
+# =========================
+
+class WorkerPool:
+    # Background threads that run queued jobs through handlers[job['kind']].
+    # A handler that raises has its job retried later, up to MAX_ATTEMPTS.
+
+    def __init__(self, queue, handlers, workers=WORKERS):
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = workers
+        self._threads = []
+        self._stopping = threading.Event()
+
+    def start(self):
+        self._stopping.clear()
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self.queue.wake()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def wait(self, batch=None, timeout=None):
+        # True once the batch (or the whole queue) has no unfinished jobs.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            progress = self.queue.progress(batch)
+            if not progress[PENDING] and not progress[RUNNING]:
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def _work(self):
+        owner = f"{os.getpid()}-{threading.get_ident()}"
+        while not self._stopping.is_set():
+            job = self.queue.claim(owner)
+            if job is None:
+                self.queue.compact()
+                self.queue.wait(POLL_INTERVAL)
+                continue
+            try:
+                self.handlers[job['kind']](job)
+            except Exception as e:
+                self.queue.fail(job, f"{type(e).__name__}: {e}")
+            else:
+                self.queue.complete(job)
+
+# =========================
+# Delivery
+# =========================
+
+class FileSink:
+    # Writes each message to <outbox>/<key>.txt. A retried job rewrites its
+    # own file, so a message is never delivered twice.
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def deliver(self, recipient, subject, body, key):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{key}.txt")
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(f"To: {recipient}\nSubject: {subject}\n\n{body}")
+        os.replace(tmp_path, path)
+
+class StubMailer:
+    # Keeps messages in memory instead of sending them, keyed like FileSink.
+
+    def __init__(self):
+        self.sent = {}
+        self._lock = threading.Lock()
+
+    def deliver(self, recipient, subject, body, key):
+        with self._lock:
+            self.sent[key] = {'to': recipient, 'subject': subject, 'body': body}
+
+def make_sink(kind, outbox):
+    if kind == 'file':
+        return FileSink(outbox)
+    if kind == 'stub':
+        return StubMailer()
+    raise ValueError(f"Unknown notice sink {kind!r}; use 'file' or 'stub'")
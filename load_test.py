@@ -0,0 +1,162 @@
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from http.client import HTTPConnection
+
+from generate_data import generate_dataset, student_number_for, course_code_for
+from server import make_server
+from service import EnrollmentService
+from storage import JsonLinesStorage, open_storage, migrate
+
+DROPS = 10
+
+# =========================
+# Load Test
+# =========================
+
+def _request(port, method, path, token, body=None):
+    conn = HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request(method, path, body=json.dumps(body) if body is not None else None,
+                     headers={'Authorization': f"Bearer {token}",
+                              'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+def _fire(port, requests, concurrency):
+    # Every worker waits on a barrier so the first wave hits the server at once.
+    statuses = [None] * len(requests)
+    barrier = threading.Barrier(concurrency)
+    cursor = iter(range(len(requests)))
+    cursor_lock = threading.Lock()
+
+    def worker():
+        barrier.wait()
+        while True:
+            with cursor_lock:
+                i = next(cursor, None)
+            if i is None:
+                return
+            method, path, token, body = requests[i]
+            try:
+                statuses[i] = _request(port, method, path, token, body)[0]
+            except OSError as e:
+                statuses[i] = type(e).__name__
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses, time.perf_counter() - start
+
+def _check(condition, message, failures):
+    if not condition:
+        failures.append(message)
+
+def run_load_test(data_dir, requests=2000, capacity=100, concurrency=64, backend='jsonl'):
+    # One hot course with `capacity` seats and `requests` students enrolling
+    # at the same moment. Passwords are not part of the test: sessions are
+    # issued directly so only seat allocation is measured.
+    generate_dataset(data_dir, requests, 1, 0)
+    if backend != 'jsonl':
+        migrate(JsonLinesStorage(data_dir), open_storage(backend, data_dir))
+    course_code = course_code_for(0)
+    service = EnrollmentService(open_storage(backend, data_dir))
+    service.update_course(course_code, capacity=capacity)
+    students = [student_number_for(i) for i in range(requests)]
+    tokens = {number: service.sessions.create(number) for number in students}
+
+    server = make_server(service, port=0, quiet=True)
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    failures = []
+    try:
+        statuses, seconds = _fire(port, [
+            ('POST', f"/students/{number}/enrollments", tokens[number], {'course_code': course_code})
+            for number in students
+        ], concurrency)
+        enrolled = statuses.count(201)
+        waitlisted = statuses.count(202)
+        _check(enrolled == min(capacity, requests),
+               f"{enrolled} enrollments accepted for {capacity} seats", failures)
+        _check(enrolled + waitlisted == requests,
+               f"{requests - enrolled - waitlisted} requests failed: "
+               f"{sorted(set(map(str, statuses)) - {'201', '202'})}", failures)
+
+        # A fresh storage instance sees only what reached disk.
+        stored = open_storage(backend, data_dir)
+        roster = stored.course_roster(course_code)
+        waitlist = [entry['student_number'] for entry in stored.waitlist(course_code)]
+        _check(len(roster) == enrolled, f"{len(roster)} students stored, {enrolled} accepted",
+               failures)
+        _check(len(waitlist) == waitlisted and len(set(waitlist)) == len(waitlist),
+               f"{len(waitlist)} waitlist entries stored, {waitlisted} accepted", failures)
+        _check(not set(roster) & set(waitlist), "students both enrolled and waitlisted", failures)
+
+        dropped = roster[:DROPS]
+        drop_statuses, _ = _fire(port, [
+            ('DELETE', f"/students/{number}/enrollments/{course_code}", tokens[number], None)
+            for number in dropped
+        ], min(concurrency, len(dropped)) or 1)
+        stored = open_storage(backend, data_dir)
+        promoted = waitlist[:len(dropped)]
+        _check(drop_statuses == [200] * len(dropped), f"drops returned {drop_statuses}", failures)
+        _check(stored.course_headcount(course_code) == enrolled,
+               "headcount changed after drops and promotions", failures)
+        _check(all(number in stored.course_roster(course_code) for number in promoted),
+               "freed seats did not go to the head of the waitlist", failures)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return {
+        'requests': requests,
+        'capacity': capacity,
+        'concurrency': concurrency,
+        'backend': backend,
+        'enrolled': enrolled,
+        'waitlisted': waitlisted,
+        'seconds': seconds,
+        'requests_per_second': requests / seconds if seconds else 0,
+        'failures': failures
+    }
+
+# =========================
+# Command Line
+# =========================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fire simultaneous enrollments at one course and check for overbooking.")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--capacity", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--backend", default="jsonl", choices=["jsonl", "sqlite"])
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='load_')
+    try:
+        report = run_load_test(data_dir, args.requests, args.capacity, args.concurrency, args.backend)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    print(f"{report['requests']} requests for {report['capacity']} seats "
+          f"({report['concurrency']} concurrent clients, {report['backend']})")
+    print(f"Enrolled: {report['enrolled']}  Waitlisted: {report['waitlisted']}")
+    print(f"{report['seconds']:.2f}s, {report['requests_per_second']:.0f} requests/s")
+    for failure in report['failures']:
+        print(f"FAIL: {failure}")
+    if report['failures']:
+        sys.exit(1)
+    print("No overbooking")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import os
+import time
+import threading
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+# Writers wait at most this long for another process to finish before the
+# operation is abandoned with LockTimeout.
+LOCK_TIMEOUT = 5.0
+LOCK_POLL_INTERVAL = 0.005
+LOCK_POLL_MAX_INTERVAL = 0.1
+
+class LockTimeout(Exception):
+    pass
+
+def _try_lock(fd):
+    try:
+        if os.name == 'nt':
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+def _unlock(fd):
+    if os.name == 'nt':
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+class FileLock:
+    # Exclusive advisory lock on a sidecar file, shared between processes.
+    # It is re-entrant within a process: threads queue on an in-process lock
+    # and only the outermost holder takes the OS-level lock.
+
+    def __init__(self, path, timeout=LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        if not self._thread_lock.acquire(timeout=timeout):
+            raise LockTimeout(f"Timed out waiting for {self.path}")
+        if self._depth == 0:
+            try:
+                self._fd = self._lock_file(deadline)
+            except BaseException:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+
+    def _lock_file(self, deadline):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        interval = LOCK_POLL_INTERVAL
+        while not _try_lock(fd):
+            if time.monotonic() >= deadline:
+                os.close(fd)
+                raise LockTimeout(f"Timed out waiting for {self.path}")
+            time.sleep(interval)
+            interval = min(interval * 2, LOCK_POLL_MAX_INTERVAL)
+        return fd
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            fd, self._fd = self._fd, None
+            try:
+                _unlock(fd)
+            finally:
+                os.close(fd)
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
@@ -1,12 +1,12 @@
 import os
-import hashlib
-import json
-from datetime import datetime
 
-DATA_DIR = "data"
-STUDENTS_FILE = os.path.join(DATA_DIR, "students.txt")
-COURSES_FILE = os.path.join(DATA_DIR, "courses.txt")
-ENROLLMENTS_FILE = os.path.join(DATA_DIR, "enrollments.txt")
+from config import DATA_DIR, NOTICE_SINK, STORAGE_BACKEND
+from service import (
+    EnrollmentService, ServiceError, Unauthorized, WAITLISTED, PAGE_SIZE,
+    hash_password, start_notices, validate_email
+)
+from storage import ANY, open_storage
+from terms import TermArchive
 
 # =========================
 # Utility Functions
@@ -15,242 +15,321 @@ ENROLLMENTS_FILE = os.path.join(DATA_DIR, "enrollments.txt")
 def cls():
     os.system('cls' if os.name == 'nt' else 'clear')
 
+def cleared_or_kept(value):
+    # A blank answer keeps the current value; 'none' clears it.
+    if not value:
+        return ANY
+    return None if value.lower() == 'none' else value
+
 def ensure_data_directory():
     if not os.path.exists(DATA_DIR):
         os.makedirs(DATA_DIR)
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
 # =========================
 # Data Loading/Saving
 # =========================
 
+storage = open_storage(STORAGE_BACKEND, DATA_DIR)
+service = EnrollmentService(storage, terms=TermArchive(DATA_DIR))
+
+def use_storage(new_storage):
+    global storage, service
+    previous = storage
+    storage = new_storage
+    # Past terms are read from the new storage's own directory; queued
+    # notices stay on the same job queue.
+    service = EnrollmentService(new_storage, jobs=service.jobs,
+                                terms=TermArchive(new_storage.data_dir))
+    return previous
+
 def load_students():
-    if not os.path.exists(STUDENTS_FILE):
-        return {}
-    students = {}
-    with open(STUDENTS_FILE, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                data = json.loads(line)
-                students[data['student_number']] = data
-    return students
+    return storage.load_students()
 
 def save_students(students):
-    with open(STUDENTS_FILE, 'w') as f:
-        for student in students.values():
-            f.write(json.dumps(student) + '\n')
+    storage.save_students(students)
 
 def load_courses():
-    if not os.path.exists(COURSES_FILE):
-        return {}
-    courses = {}
-    with open(COURSES_FILE, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                data = json.loads(line)
-                courses[data['course_code']] = data
-    return courses
+    return storage.load_courses()
 
 def save_courses(courses):
-    with open(COURSES_FILE, 'w') as f:
-        for course in courses.values():
-            f.write(json.dumps(course) + '\n')
+    storage.save_courses(courses)
 
 def load_enrollments():
-    if not os.path.exists(ENROLLMENTS_FILE):
-        return {}
-    enrollments = {}
-    with open(ENROLLMENTS_FILE, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                data = json.loads(line)
-                student_num = data['student_number']
-                if student_num not in enrollments:
-                    enrollments[student_num] = []
-                enrollments[student_num].append(data)
-    return enrollments
+    return storage.load_enrollments()
 
 def save_enrollments(enrollments):
-    with open(ENROLLMENTS_FILE, 'w') as f:
-        for student_enrollments in enrollments.values():
-            for enrollment in student_enrollments:
-                f.write(json.dumps(enrollment) + '\n')
+    storage.save_enrollments(enrollments)
+
+def append_enrollment(enrollment):
+    return storage.append_enrollment(enrollment)
+
+def remove_enrollment(student_number, course_code):
+    storage.remove_enrollment(student_number, course_code)
+
+def compact_enrollments():
+    return storage.compact_enrollments()
+
+def get_course_roster(course_code):
+    return storage.course_roster(course_code)
+
+def get_course_headcount(course_code):
+    return storage.course_headcount(course_code)
+
+def get_course_headcounts():
+    return storage.course_headcounts()
 
 # =========================
 # Authentication & Validation
 # =========================
 
 def authenticate_student(student_number, email, password):
-    students = load_students()
-    if student_number in students:
-        student = students[student_number]
-        if student['email'] == email and student['password'] == hash_password(password):
-            return student
-    return None
-
-def validate_email(email, student_number):
-    expected_email = f"{student_number}@mocku.edu.ph"
-    return email == expected_email
+    try:
+        return service.authenticate(student_number, email, password)
+    except Unauthorized:
+        return None
 
 # =========================
 # Course Management Functions
 # =========================
 
+def print_course_line(course):
+    schedule = f" [{course['schedule']}]" if course.get('schedule') else ""
+    print(f"{course['course_code']}: {course['course_name']} - {course['department']} ({course['units']} units){schedule}")
+
+def print_course_lines(courses):
+    for course in courses:
+        print_course_line(course)
+
+def print_course_table(courses):
+    print(f"\n{'Code':<10} {'Course Name':<30} {'Department':<20} {'Units':<6}")
+    print("-" * 70)
+    for course in courses:
+        print(f"{course['course_code']:<10} {course['course_name']:<30} {course['department']:<20} {course['units']:<6}")
+
+def browse_courses(print_page, student_number=None):
+    # Shows the catalog a page at a time in course-code order, optionally
+    # filtered. Returns False if no course matched.
+    department = input("Filter by department (blank for all): ").strip()
+    units = input("Filter by units (blank for all): ").strip()
+    after = None
+    while True:
+        try:
+            page = service.course_page(after, PAGE_SIZE, department, units, student_number)
+        except ServiceError as e:
+            print(f"Error: {e}")
+            return False
+        if after is None and not page['courses']:
+            return False
+        print_page(page['courses'])
+        if page['next'] is None:
+            return True
+        if input("\nPress Enter for more, or q to stop: ").strip().lower() == 'q':
+            return True
+        after = page['next']
+
 def add_course():
     cls()
     print("\n=== ADD NEW COURSE ===")
-    courses = load_courses()
     
     course_code = input("Enter Course Code: ").strip().upper()
-    if course_code in courses:
+    if service.course_exists(course_code):
         print(f"Error: Course {course_code} already exists!")
         input("\nPress Enter to continue...")
         return
     
     department = input("Enter Department: ").strip()
+    units = input("Enter Units: ").strip()
     try:
-        units = int(input("Enter Units: ").strip())
+        int(units)
     except ValueError:
         print("Error: Units must be a number!")
         input("\nPress Enter to continue...")
         return
     
     course_name = input("Enter Course Name: ").strip()
+    capacity = input("Enter Capacity (blank for unlimited): ").strip()
+    schedule = input("Enter Meeting Times, e.g. Mon/Wed 09:00-10:30 (blank for none): ").strip()
+    prerequisites = input("Enter Prerequisites, comma-separated (blank for none): ").strip()
     
-    courses[course_code] = {
-        'course_code': course_code,
-        'department': department,
-        'units': units,
-        'course_name': course_name
-    }
-    
-    save_courses(courses)
+    try:
+        service.add_course(course_code, department, units, course_name, capacity, schedule,
+                           prerequisites)
+    except ServiceError as e:
+        print(f"Error: {e}")
+        input("\nPress Enter to continue...")
+        return
     print(f"\nCourse {course_code} added successfully!")
     input("\nPress Enter to continue...")
 
 def update_course():
     cls()
     print("\n=== UPDATE COURSE ===")
-    courses = load_courses()
-    
-    if not courses:
+    if not service.has_courses():
         print("No courses available to update.")
         input("\nPress Enter to continue...")
         return
     
-    print("\nAvailable Courses:")
-    for code, course in courses.items():
-        print(f"{code}: {course['course_name']} - {course['department']} ({course['units']} units)")
+    if not browse_courses(print_course_lines):
+        print("No courses matched.")
     
     course_code = input("\nEnter Course Code to update: ").strip().upper()
-    if course_code not in courses:
-        print(f"Error: Course {course_code} not found!")
+    try:
+        course = service.get_course(course_code)
+    except ServiceError as e:
+        print(f"Error: {e}")
         input("\nPress Enter to continue...")
         return
     
-    course = courses[course_code]
     print(f"\nCurrent details for {course_code}:")
     print(f"Course Name: {course['course_name']}")
     print(f"Department: {course['department']}")
     print(f"Units: {course['units']}")
+    print(f"Capacity: {course.get('capacity', 'unlimited')}")
+    print(f"Meeting Times: {course.get('schedule') or 'none'}")
+    print(f"Prerequisites: {', '.join(course.get('prerequisites', ())) or 'none'}")
     
-    print("\nEnter new values (press Enter to keep current value):")
+    print("\nEnter new values (press Enter to keep current value, 'none' to clear):")
     new_name = input(f"Course Name [{course['course_name']}]: ").strip()
     new_dept = input(f"Department [{course['department']}]: ").strip()
     new_units = input(f"Units [{course['units']}]: ").strip()
+    new_capacity = input(f"Capacity [{course.get('capacity', 'unlimited')}]: ").strip()
+    new_schedule = input(f"Meeting Times [{course.get('schedule') or 'none'}]: ").strip()
+    new_prerequisites = input(f"Prerequisites [{', '.join(course.get('prerequisites', ())) or 'none'}]: ").strip()
     
-    if new_name:
-        course['course_name'] = new_name
-    if new_dept:
-        course['department'] = new_dept
     if new_units:
         try:
-            course['units'] = int(new_units)
+            int(new_units)
         except ValueError:
             print("Invalid units value, keeping current value.")
+            new_units = None
     
-    save_courses(courses)
+    try:
+        service.update_course(course_code, new_name, new_dept, new_units, expected=course,
+                              capacity=cleared_or_kept(new_capacity),
+                              schedule=cleared_or_kept(new_schedule),
+                              prerequisites=new_prerequisites)
+    except ServiceError as e:
+        print(f"Error: {e}")
+        input("\nPress Enter to continue...")
+        return
     print(f"\nCourse {course_code} updated successfully!")
+    if service.jobs is not None:
+        print("Affected students will be notified in the background.")
     input("\nPress Enter to continue...")
 
 def delete_course():
     cls()
     print("\n=== DELETE COURSE ===")
-    courses = load_courses()
-    
-    if not courses:
+    if not service.has_courses():
         print("No courses available to delete.")
         input("\nPress Enter to continue...")
         return
     
-    print("\nAvailable Courses:")
-    for code, course in courses.items():
-        print(f"{code}: {course['course_name']} - {course['department']} ({course['units']} units)")
+    if not browse_courses(print_course_lines):
+        print("No courses matched.")
     
     course_code = input("\nEnter Course Code to delete: ").strip().upper()
-    if course_code not in courses:
-        print(f"Error: Course {course_code} not found!")
+    try:
+        course = service.get_course(course_code)
+    except ServiceError as e:
+        print(f"Error: {e}")
         input("\nPress Enter to continue...")
         return
     
+    headcount = service.course_headcount(course_code)
+    archive = True
+    if headcount:
+        print(f"Warning: {headcount} student(s) are currently enrolled in {course_code}.")
+        print("Their enrollments will be removed along with the course.")
+        archive = input("Keep a copy in the enrollment archive? (yes/no): ").strip().lower() != 'no'
+    
     confirm = input(f"Are you sure you want to delete {course_code}? (yes/no): ").strip().lower()
     if confirm == 'yes':
-        del courses[course_code]
-        save_courses(courses)
-        print(f"\nCourse {course_code} deleted successfully!")
+        try:
+            result = service.delete_course(course_code, expected=course, archive=archive)
+            print(f"\nCourse {course_code} deleted successfully!")
+            removed = result['removed']
+            if removed['enrollments'] or removed['waitlist']:
+                print(f"Removed {removed['enrollments']} enrollment(s) and "
+                      f"{removed['waitlist']} waitlist request(s)"
+                      f"{' (archived)' if archive else ''}.")
+            if result['notices']:
+                print("Affected students will be notified in the background.")
+        except ServiceError as e:
+            print(f"Error: {e}")
     else:
         print("Deletion cancelled.")
     input("\nPress Enter to continue...")
 
+def rename_course():
+    cls()
+    print("\n=== RENAME COURSE ===")
+    if not service.has_courses():
+        print("No courses available to rename.")
+        input("\nPress Enter to continue...")
+        return
+    
+    if not browse_courses(print_course_lines):
+        print("No courses matched.")
+    
+    course_code = input("\nEnter Course Code to rename: ").strip().upper()
+    try:
+        course = service.get_course(course_code)
+    except ServiceError as e:
+        print(f"Error: {e}")
+        input("\nPress Enter to continue...")
+        return
+    
+    new_code = input("Enter the new Course Code: ").strip().upper()
+    try:
+        result = service.rename_course(course_code, new_code, expected=course)
+    except ServiceError as e:
+        print(f"Error: {e}")
+        input("\nPress Enter to continue...")
+        return
+    moved = result['moved']
+    print(f"\nCourse {course_code} is now {new_code}!")
+    print(f"Moved {moved['enrollments']} enrollment(s) and {moved['waitlist']} waitlist request(s).")
+    if result['notices']:
+        print("Affected students will be notified in the background.")
+    input("\nPress Enter to continue...")
+
 def view_available_courses():
     cls()
     print("\n=== AVAILABLE COURSES ===")
-    courses = load_courses()
-    
-    if not courses:
+    if not service.has_courses():
         print("No courses available.")
         input("\nPress Enter to continue...")
         return
     
-    print(f"\n{'Code':<10} {'Course Name':<30} {'Department':<20} {'Units':<6}")
-    print("-" * 70)
-    for code, course in sorted(courses.items()):
-        print(f"{code:<10} {course['course_name']:<30} {course['department']:<20} {course['units']:<6}")
+    if not browse_courses(print_course_table):
+        print("\nNo courses matched.")
     input("\nPress Enter to continue...")
 
 def search_courses():
     cls()
     print("\n=== SEARCH COURSES ===")
-    courses = load_courses()
     
-    if not courses:
+    if not service.has_courses():
         print("No courses available to search.")
         input("\nPress Enter to continue...")
         return
     
-    keyword = input("Enter keyword to search (Course Code, Name, or Department): ").strip().lower()
-    
-    results = []
-    for course in courses.values():
-        if (keyword in course['course_code'].lower() or
-            keyword in course['course_name'].lower() or
-            keyword in course['department'].lower()):
-            results.append(course)
+    query = input("Enter keyword to search (Course Code, Name, or Department): ").strip()
     
-    if not results:
-        print("\nNo courses matched your search.")
-        input("\nPress Enter to continue...")
-        return
-    
-    print(f"\n{'Code':<10} {'Course Name':<30} {'Department':<20} {'Units':<6}")
-    print("-" * 70)
-    for course in results:
-        print(f"{course['course_code']:<10} {course['course_name']:<30} {course['department']:<20} {course['units']:<6}")
+    # Best matches first, a page at a time; small typos are forgiven.
+    offset = 0
+    while True:
+        page = service.ranked_search(query, PAGE_SIZE, offset)
+        if not offset and not page['courses']:
+            print("\nNo courses matched your search.")
+            break
+        print_course_table(page['courses'])
+        if page['next'] is None:
+            break
+        if input("\nPress Enter for more, or q to stop: ").strip().lower() == 'q':
+            return
+        offset = page['next']
     input("\nPress Enter to continue...")
 
 # =========================
@@ -260,64 +339,79 @@ def search_courses():
 def enroll_in_course(student):
     cls()
     print("\n=== ENROLL IN COURSE ===")
-    courses = load_courses()
-    enrollments = load_enrollments()
     
-    if not courses:
+    if not service.has_courses():
         print("No courses available for enrollment.")
         input("\nPress Enter to continue...")
         return
     
     student_num = student['student_number']
-    enrolled_courses = [e['course_code'] for e in enrollments.get(student_num, [])]
+    if not browse_courses(print_course_lines, student_num):
+        print("No courses you can still enroll in matched.")
+        input("\nPress Enter to continue...")
+        return
     
-    print("\nAvailable Courses:")
-    available = False
-    for code, course in sorted(courses.items()):
-        if code not in enrolled_courses:
-            print(f"{code}: {course['course_name']} - {course['department']} ({course['units']} units)")
-            available = True
+    codes = input("\nEnter Course Code(s) to enroll, separated by commas: ").replace(',', ' ').upper().split()
     
-    if not available:
-        print("You are already enrolled in all available courses.")
+    if len(codes) > 1:
+        try:
+            batch = service.enroll_many(student_num, codes)
+        except ServiceError as e:
+            print(f"Error: {e}")
+            print("No courses were enrolled.")
+            input("\nPress Enter to continue...")
+            return
+        print(f"\nSuccessfully enrolled in {', '.join(codes)} ({batch['units']} units)!")
         input("\nPress Enter to continue...")
         return
     
-    course_code = input("\nEnter Course Code to enroll: ").strip().upper()
-    
-    if course_code not in courses:
-        print(f"Error: Course {course_code} not found!")
+    course_code = codes[0] if codes else ''
+    try:
+        enrollment = service.enroll(student_num, course_code)
+    except ServiceError as e:
+        print(f"Error: {e}")
         input("\nPress Enter to continue...")
         return
+    if enrollment['status'] == WAITLISTED:
+        print(f"\n{course_code} is full. You are #{enrollment['position']} on the waitlist.")
+    else:
+        print(f"\nSuccessfully enrolled in {course_code}!")
+    input("\nPress Enter to continue...")
+
+def drop_course(student):
+    cls()
+    print("\n=== DROP COURSE ===")
+    student_num = student['student_number']
+    schedule = service.my_courses(student_num)
     
-    if course_code in enrolled_courses:
-        print(f"Error: You are already enrolled in {course_code}!")
+    if not schedule['courses'] and not schedule['waitlist']:
+        print("You are not enrolled in any courses yet.")
         input("\nPress Enter to continue...")
         return
     
-    if student_num not in enrollments:
-        enrollments[student_num] = []
+    for row in schedule['courses']:
+        print_course_line(row['course'])
+    for row in schedule['waitlist']:
+        course = row['course']
+        print(f"{course['course_code']} - {course['course_name']} (waitlist #{row['position']})")
     
-    enrollments[student_num].append({
-        'student_number': student_num,
-        'course_code': course_code,
-        'enrollment_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    })
+    course_code = input("\nEnter Course Code to drop: ").strip().upper()
     
-    save_enrollments(enrollments)
-    print(f"\nSuccessfully enrolled in {course_code}!")
+    try:
+        service.drop(student_num, course_code)
+    except ServiceError as e:
+        print(f"Error: {e}")
+        input("\nPress Enter to continue...")
+        return
+    print(f"\nDropped {course_code}.")
     input("\nPress Enter to continue...")
 
 def view_my_courses(student):
     cls()
     print("\n=== MY ENROLLED COURSES ===")
-    courses = load_courses()
-    enrollments = load_enrollments()
-    
-    student_num = student['student_number']
-    student_enrollments = enrollments.get(student_num, [])
+    schedule = service.my_courses(student['student_number'])
     
-    if not student_enrollments:
+    if not schedule['courses'] and not schedule['waitlist']:
         print("You are not enrolled in any courses yet.")
         input("\nPress Enter to continue...")
         return
@@ -325,16 +419,50 @@ def view_my_courses(student):
     print(f"\n{'Code':<10} {'Course Name':<30} {'Department':<20} {'Units':<6} {'Enrolled On':<20}")
     print("-" * 90)
     
-    total_units = 0
-    for enrollment in student_enrollments:
-        course_code = enrollment['course_code']
-        if course_code in courses:
-            course = courses[course_code]
-            print(f"{course_code:<10} {course['course_name']:<30} {course['department']:<20} {course['units']:<6} {enrollment['enrollment_date']:<20}")
-            total_units += course['units']
+    for row in schedule['courses']:
+        course = row['course']
+        print(f"{course['course_code']:<10} {course['course_name']:<30} {course['department']:<20} {course['units']:<6} {row['enrollment_date']:<20}")
     
     print("-" * 90)
-    print(f"Total Units: {total_units}")
+    print(f"Total Units: {schedule['total_units']}")
+    
+    if schedule['waitlist']:
+        print("\nWaitlisted:")
+        for row in schedule['waitlist']:
+            course = row['course']
+            print(f"{course['course_code']:<10} {course['course_name']:<30} Position: {row['position']}")
+    input("\nPress Enter to continue...")
+
+def view_past_terms(student):
+    cls()
+    print("\n=== PAST TERMS ===")
+    history = service.student_history(student['student_number'])
+    if not history:
+        print("No enrollments in past terms.")
+        input("\nPress Enter to continue...")
+        return
+    
+    for entry in history:
+        print(f"\n{entry['term']}")
+        print("-" * 70)
+        for course in entry['courses']:
+            print(f"{course['course_code']:<10} {course['course_name']:<30} {course['enrollment_date']:<20}")
+    input("\nPress Enter to continue...")
+
+def view_notice_progress():
+    cls()
+    print("\n=== NOTICE PROGRESS ===")
+    batches = service.notice_batches()
+    if not batches:
+        print("No notices are queued.")
+        input("\nPress Enter to continue...")
+        return
+    
+    print(f"\n{'Batch':<14} {'Change':<30} {'Sent':<10} {'Waiting':<8} {'Failed':<6}")
+    print("-" * 72)
+    for batch in batches:
+        print(f"{batch['batch']:<14} {batch['label']:<30} {batch['done']:>4}/{batch['total']:<5} "
+              f"{batch['pending'] + batch['running']:<8} {batch['failed']:<6}")
     input("\nPress Enter to continue...")
 
 # =========================
@@ -353,9 +481,11 @@ def student_menu(student):
         print("\n1. View Available Courses")
         print("2. Enroll in Course")
         print("3. View My Enrolled Courses")
-        print("4. Logout")
+        print("4. Drop a Course")
+        print("5. View Past Terms")
+        print("6. Logout")
         
-        choice = input("\nEnter your choice (1-4): ").strip()
+        choice = input("\nEnter your choice (1-6): ").strip()
         
         if choice == '1':
             view_available_courses()
@@ -364,6 +494,10 @@ def student_menu(student):
         elif choice == '3':
             view_my_courses(student)
         elif choice == '4':
+            drop_course(student)
+        elif choice == '5':
+            view_past_terms(student)
+        elif choice == '6':
             print("\nLogging out...")
             input("\nPress Enter to continue...")
             break
@@ -381,10 +515,12 @@ def course_management_menu():
         print("2. Add Course")
         print("3. Update Course")
         print("4. Delete Course")
-        print("5. Search Courses")
-        print("6. Back to Main Menu")
+        print("5. Rename Course")
+        print("6. Search Courses")
+        print("7. Notice Progress")
+        print("8. Back to Main Menu")
         
-        choice = input("\nEnter your choice (1-6): ").strip()
+        choice = input("\nEnter your choice (1-8): ").strip()
         
         if choice == '1':
             view_available_courses()
@@ -395,8 +531,12 @@ def course_management_menu():
         elif choice == '4':
             delete_course()
         elif choice == '5':
-            search_courses()
+            rename_course()
         elif choice == '6':
+            search_courses()
+        elif choice == '7':
+            view_notice_progress()
+        elif choice == '8':
             break
         else:
             print("Invalid choice. Please try again.")
@@ -408,7 +548,16 @@ def course_management_menu():
 
 def main():
     ensure_data_directory()
-    
+    workers = start_notices(service, DATA_DIR, NOTICE_SINK)
+    try:
+        run_menu()
+    finally:
+        workers.stop()
+        waiting = service.jobs.progress()
+        if waiting['pending'] + waiting['running']:
+            print(f"{waiting['pending'] + waiting['running']} notice(s) will be sent next time.")
+
+def run_menu():
     while True:
         cls()
         print(f"\n{'='*50}")
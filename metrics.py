@@ -0,0 +1,148 @@
+import os
+import bisect
+import atexit
+import functools
+import threading
+from time import perf_counter
+
+# Set ENROLLMENT_METRICS=1 to record metrics. The choice is made when the
+# modules are imported: with it unset, timed() hands back the function
+# unchanged and the counters are skipped behind a check of ENABLED, so the
+# instrumentation costs nothing measurable.
+ENABLED = os.environ.get("ENROLLMENT_METRICS", "").lower() in ("1", "true", "yes", "on")
+# Where the Prometheus text dump is written when the process exits.
+METRICS_FILE = os.environ.get("ENROLLMENT_METRICS_FILE", "metrics.prom")
+
+# Latency histogram bucket bounds, in seconds.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Counter name -> (label name, help text).
+COUNTERS = {
+    'bytes_read': ('file', "Bytes read from data files."),
+    'bytes_written': ('file', "Bytes written to data files."),
+    'records_parsed': ('file', "Records parsed from data files.")
+}
+
+# =========================
+# Registry
+# =========================
+
+class _Histogram:
+    __slots__ = ('buckets', 'count', 'sum')
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._counters = {name: {} for name in COUNTERS}
+
+    def observe(self, operation, seconds):
+        with self._lock:
+            histogram = self._latencies.get(operation)
+            if histogram is None:
+                histogram = self._latencies[operation] = _Histogram()
+            histogram.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+            histogram.count += 1
+            histogram.sum += seconds
+
+    def add(self, counter, label, amount):
+        with self._lock:
+            values = self._counters[counter]
+            values[label] = values.get(label, 0) + amount
+
+    def snapshot(self):
+        # A plain-dict dump: per-operation count, total seconds and
+        # cumulative bucket counts keyed by upper bound, plus the counters.
+        with self._lock:
+            operations = {}
+            for operation, histogram in sorted(self._latencies.items()):
+                cumulative = 0
+                buckets = {}
+                for bound, count in zip(BUCKETS + ('+Inf',), histogram.buckets):
+                    cumulative += count
+                    buckets[str(bound)] = cumulative
+                operations[operation] = {'count': histogram.count, 'seconds': histogram.sum,
+                                         'buckets': buckets}
+            counters = {name: dict(sorted(values.items())) for name, values in self._counters.items()}
+        return {'operations': operations, 'counters': counters}
+
+    def reset(self):
+        with self._lock:
+            self._latencies = {}
+            self._counters = {name: {} for name in COUNTERS}
+
+REGISTRY = MetricsRegistry()
+
+# =========================
+# Instrumentation
+# =========================
+
+def timed(operation):
+    # Decorator recording the latency of every call under `operation`.
+    def decorate(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                REGISTRY.observe(operation, perf_counter() - start)
+        return wrapper
+    return decorate
+
+def observe(operation, seconds):
+    if ENABLED:
+        REGISTRY.observe(operation, seconds)
+
+def tally(counter, path, amount):
+    # Adds to a per-file counter; `path` is labelled by its file name.
+    if ENABLED and amount:
+        REGISTRY.add(counter, os.path.basename(path), amount)
+
+# =========================
+# Export
+# =========================
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render(snapshot=None):
+    # Prometheus text exposition format.
+    snapshot = REGISTRY.snapshot() if snapshot is None else snapshot
+    lines = [
+        "# HELP enrollment_operation_seconds Latency of each operation.",
+        "# TYPE enrollment_operation_seconds histogram"
+    ]
+    for operation, histogram in snapshot['operations'].items():
+        name = _label(operation)
+        for bound, cumulative in histogram['buckets'].items():
+            lines.append(f'enrollment_operation_seconds_bucket{{operation="{name}",le="{bound}"}} '
+                         f'{cumulative}')
+        lines.append(f'enrollment_operation_seconds_sum{{operation="{name}"}} {histogram["seconds"]!r}')
+        lines.append(f'enrollment_operation_seconds_count{{operation="{name}"}} {histogram["count"]}')
+    for counter, (label, help_text) in COUNTERS.items():
+        metric = f"enrollment_{counter}_total"
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for value, amount in snapshot['counters'][counter].items():
+            lines.append(f'{metric}{{{label}="{_label(value)}"}} {amount}')
+    return '\n'.join(lines) + '\n'
+
+def dump(path=None):
+    path = METRICS_FILE if path is None else path
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+    return path
+
+if ENABLED and METRICS_FILE:
+    atexit.register(dump)
@@ -0,0 +1,34 @@
+import os
+import argparse
+
+from storage import JsonLinesStorage, SQLiteStorage, SQLITE_FILENAME, migrate
+from terms import copy_terms
+
+DATA_DIR = "data"
+
+def main():
+    parser = argparse.ArgumentParser(description="Import the data/*.txt files into an SQLite database.")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="directory holding the JSON-lines files")
+    parser.add_argument("--database", help=f"SQLite file to create (default: <data-dir>/{SQLITE_FILENAME})")
+    args = parser.parse_args()
+    
+    database = args.database or os.path.join(args.data_dir, SQLITE_FILENAME)
+    source = JsonLinesStorage(args.data_dir)
+    target = SQLiteStorage(database)
+    
+    print(f"Migrating {args.data_dir} into {database}...")
+    print("-" * 50)
+    migrate(source, target)
+    terms = copy_terms(args.data_dir, os.path.dirname(database) or '.')
+    print(f"Students: {len(target.load_students())}")
+    print(f"Courses: {target.course_count()}")
+    print(f"Enrollments: {sum(len(e) for e in target.load_enrollments().values())}")
+    print(f"Waitlist requests: {sum(len(q) for q in target.load_waitlists().values())}")
+    print(f"Archived enrollments: {len(target.archived_enrollments())}")
+    print(f"Archived terms: {len(terms)}")
+    target.close()
+    print("-" * 50)
+    print("\nMigration complete. Run with ENROLLMENT_STORAGE=sqlite to use the database.")
+
+if __name__ == "__main__":
+    main()
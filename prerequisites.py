@@ -0,0 +1,157 @@
+from enrollment_records import COURSE_CODES
+
+# =========================
+# Prerequisite Graph
+# =========================
+
+def _bit(code):
+    return 1 << COURSE_CODES.id_for(code)
+
+def _codes(mask):
+    codes = COURSE_CODES.codes
+    found = []
+    while mask:
+        low = mask & -mask
+        found.append(codes[low.bit_length() - 1])
+        mask ^= low
+    return found
+
+class PrerequisiteGraph:
+    # The prerequisite DAG over course codes, with each course's transitive
+    # prerequisites held as a bitmask over COURSE_CODES ids. Attached to the
+    # courses table, it is rebuilt on reload and patched as courses change:
+    # only the changed course and the courses that depend on it, directly or
+    # not, have their closure recomputed, in topological order.
+    #
+    # A student's completed courses become one mask, widened by each course's
+    # own closure (passing CS201 implies its prerequisites), so whether a
+    # course is open to them is a single AND against its direct prerequisites.
+
+    def __init__(self):
+        self._requires = {}
+        self._required_by = {}
+        self._direct = {}
+        self._closure = {}
+
+    def rebuild(self, courses):
+        self.__init__()
+        for code, course in courses.items():
+            self._link(code, course.get('prerequisites') or ())
+        self._recompute(list(self._requires))
+
+    def update(self, code, old, new):
+        before = tuple((old or {}).get('prerequisites') or ())
+        after = tuple((new or {}).get('prerequisites') or ())
+        if (old is None) == (new is None) and before == after:
+            return
+        self._unlink(code)
+        if new is not None:
+            self._link(code, after)
+        self._recompute(self._dependents(code))
+
+    def apply(self, course):
+        code = course['course_code']
+        old = {'prerequisites': self._requires[code]} if code in self._requires else None
+        self.update(code, old, None if course.get('deleted') else course)
+
+    def _link(self, code, prerequisites):
+        self._requires[code] = tuple(prerequisites)
+        for prerequisite in prerequisites:
+            self._required_by.setdefault(prerequisite, set()).add(code)
+
+    def _unlink(self, code):
+        for prerequisite in self._requires.pop(code, ()):
+            dependents = self._required_by.get(prerequisite)
+            if dependents is not None:
+                dependents.discard(code)
+                if not dependents:
+                    del self._required_by[prerequisite]
+        self._direct.pop(code, None)
+        self._closure.pop(code, None)
+
+    def _dependents(self, code):
+        # code and every course that needs it, directly or transitively.
+        found = {code}
+        stack = [code]
+        while stack:
+            for dependent in self._required_by.get(stack.pop(), ()):
+                if dependent not in found:
+                    found.add(dependent)
+                    stack.append(dependent)
+        return found
+
+    def _recompute(self, codes):
+        # Kahn's algorithm over the affected courses; prerequisites outside
+        # the set already have their closure.
+        codes = [code for code in codes if code in self._requires]
+        affected = set(codes)
+        pending = {code: sum(1 for p in self._requires[code] if p in affected) for code in codes}
+        ready = [code for code, count in pending.items() if not count]
+        while ready:
+            code = ready.pop()
+            direct = closure = 0
+            for prerequisite in self._present(code):
+                bit = _bit(prerequisite)
+                direct |= bit
+                closure |= bit | self._closure.get(prerequisite, 0)
+            self._direct[code] = direct
+            self._closure[code] = closure
+            del pending[code]
+            for dependent in self._required_by.get(code, ()):
+                if dependent in pending:
+                    pending[dependent] -= 1
+                    if not pending[dependent]:
+                        ready.append(dependent)
+        # Whatever is left sits on or behind a cycle, which only files edited
+        # by hand can contain; such courses need everything they can reach.
+        for code in pending:
+            direct = 0
+            for prerequisite in self._present(code):
+                direct |= _bit(prerequisite)
+            self._direct[code] = direct
+            self._closure[code] = self._reach(code)
+
+    def _present(self, code):
+        # A prerequisite no longer in the catalog (left by a hand-edited
+        # file) is not required; it comes back into force if re-added.
+        return [p for p in self._requires[code] if p in self._requires]
+
+    def _reach(self, code):
+        mask = 0
+        stack = list(self._requires.get(code, ()))
+        while stack:
+            prerequisite = stack.pop()
+            bit = _bit(prerequisite)
+            if not mask & bit:
+                mask |= bit
+                stack.extend(self._requires.get(prerequisite, ()))
+        return mask
+
+    # Queries
+
+    def prerequisites(self, code):
+        return list(self._requires.get(code, ()))
+
+    def required_by(self, code):
+        # Courses that list `code` as a direct prerequisite.
+        return sorted(self._required_by.get(code, ()))
+
+    def all_prerequisites(self, code):
+        return sorted(_codes(self._closure.get(code, 0)))
+
+    def creates_cycle(self, code, prerequisites):
+        # Whether giving `code` these prerequisites would close a loop.
+        bit = _bit(code)
+        return any(p == code or self._closure.get(p, 0) & bit for p in prerequisites)
+
+    def completed_mask(self, completed):
+        mask = 0
+        for code in completed:
+            mask |= _bit(code) | self._closure.get(code, 0)
+        return mask
+
+    def is_eligible(self, code, completed_mask):
+        return not self._direct.get(code, 0) & ~completed_mask
+
+    def missing(self, code, completed_mask):
+        return sorted(_codes(self._direct.get(code, 0) & ~completed_mask))
@@ -0,0 +1,262 @@
+import argparse
+from array import array
+from collections import Counter
+from datetime import date
+
+from enrollment_records import COURSE_CODES, EPOCH_DAY, SECONDS_PER_DAY, Enrollment, encode_date
+
+PERIODS = ('day', 'month', 'year')
+UNKNOWN = 'unknown'
+
+# =========================
+# Columns
+# =========================
+
+def enrollment_day(enrollment):
+    # Days since the epoch of an enrollment row, or -1 if its date is unreadable.
+    if isinstance(enrollment, Enrollment):
+        return enrollment.seconds // SECONDS_PER_DAY
+    seconds = encode_date(enrollment.get('enrollment_date'))
+    return -1 if seconds is None else seconds // SECONDS_PER_DAY
+
+def _first_row(rows, course_code):
+    for row in rows:
+        if row['course_code'] == course_code:
+            return row
+    return None
+
+class EnrollmentColumns:
+    # The distinct (student, course) rows of an enrollments table as parallel
+    # columns, so each aggregate is a Counter pass over a flat array rather
+    # than a walk over records. Duplicate rows count once, dated by the first.
+
+    __slots__ = ('students', 'code_ids', 'days')
+
+    def __init__(self):
+        self.students = []
+        self.code_ids = array('l')
+        self.days = array('l')
+
+    @classmethod
+    def from_table(cls, enrollments):
+        columns = cls()
+        students, code_ids, days = columns.students, columns.code_ids, columns.days
+        id_for = COURSE_CODES.id_for
+        for student_number, rows in enrollments.items():
+            try:
+                ids = [row.code_id for row in rows]
+            except AttributeError:
+                ids = None
+            if ids is not None and len(set(ids)) == len(ids):
+                # The usual case: compact records and no duplicate rows.
+                students.extend([student_number] * len(ids))
+                code_ids.extend(ids)
+                days.extend([row.seconds // SECONDS_PER_DAY for row in rows])
+                continue
+            seen = set()
+            for row in rows:
+                code_id = row.code_id if isinstance(row, Enrollment) else id_for(row['course_code'])
+                if code_id in seen:
+                    continue
+                seen.add(code_id)
+                students.append(student_number)
+                code_ids.append(code_id)
+                days.append(enrollment_day(row))
+        return columns
+
+    def counts(self):
+        codes = COURSE_CODES.codes
+        return {
+            'courses': Counter({codes[code_id]: count
+                                for code_id, count in Counter(self.code_ids).items()}),
+            'students': Counter(self.students),
+            'days': Counter(self.days)
+        }
+
+    def unit_totals(self, courses):
+        # student_number -> units carried; rows for unknown courses are skipped.
+        units = {COURSE_CODES.id_for(code): int(course['units']) for code, course in courses.items()}
+        totals = Counter()
+        for student_number, code_id in zip(self.students, self.code_ids):
+            if code_id in units:
+                totals[student_number] += units[code_id]
+        return totals
+
+# =========================
+# Incremental Counters
+# =========================
+
+def _bump(counter, key, delta):
+    counter[key] += delta
+    if not counter[key]:
+        del counter[key]
+
+class EnrollmentCounters:
+    # Materialized counts over the enrollments table: distinct students per
+    # course, courses per student and enrollments per day. Attached to the
+    # DataStore, it is counted from columns the first time it is read after
+    # a full load, and from then on kept current from each appended record.
+    # The store hands it a record before applying it, so duplicates and
+    # tombstones are judged against the rows they affect.
+
+    def __init__(self):
+        self._enrollments = {}
+        self._counted = False
+        self.courses = Counter()
+        self.students = Counter()
+        self.days = Counter()
+
+    def rebuild(self, enrollments):
+        self._enrollments = enrollments
+        self._counted = False
+
+    def apply(self, record):
+        if not self._counted:
+            return
+        student_number = record['student_number']
+        course_code = record['course_code']
+        current = _first_row(self._enrollments.get(student_number, ()), course_code)
+        if record.get('deleted'):
+            if current is not None:
+                self._count(student_number, course_code, current, -1)
+        elif current is None:
+            self._count(student_number, course_code, record, 1)
+
+    def _count(self, student_number, course_code, row, delta):
+        _bump(self.courses, course_code, delta)
+        _bump(self.students, student_number, delta)
+        _bump(self.days, enrollment_day(row), delta)
+
+    def counts(self):
+        if not self._counted:
+            counts = EnrollmentColumns.from_table(self._enrollments).counts()
+            self.courses, self.students, self.days = (
+                counts['courses'], counts['students'], counts['days'])
+            self._counted = True
+        return {'courses': Counter(self.courses), 'students': Counter(self.students),
+                'days': Counter(self.days)}
+
+# =========================
+# Reports
+# =========================
+
+def course_report(storage, department=None, recompute=False):
+    # Enrolled students per course, busiest first.
+    counts = storage.enrollment_counts(recompute)['courses']
+    courses = storage.list_courses()
+    if department is not None:
+        department = department.lower()
+    rows = []
+    for code, course in courses.items():
+        if department is not None and course['department'].lower() != department:
+            continue
+        rows.append({
+            'course_code': code,
+            'course_name': course['course_name'],
+            'department': course['department'],
+            'units': course['units'],
+            'enrolled': counts.get(code, 0)
+        })
+    rows.sort(key=lambda row: (-row['enrolled'], row['course_code']))
+    return rows
+
+def department_report(storage, recompute=False):
+    # Per department: courses offered, enrollments and unit-enrollments.
+    counts = storage.enrollment_counts(recompute)['courses']
+    departments = {}
+    for code, course in storage.list_courses().items():
+        row = departments.setdefault(course['department'],
+                                     {'courses': 0, 'enrollments': 0, 'units': 0})
+        enrolled = counts.get(code, 0)
+        row['courses'] += 1
+        row['enrollments'] += enrolled
+        row['units'] += enrolled * int(course['units'])
+    return dict(sorted(departments.items()))
+
+def unit_load_report(storage):
+    # How many students carry each total number of units.
+    totals = storage.student_unit_totals()
+    return dict(sorted(Counter(totals.values()).items()))
+
+def year_degree_report(storage, recompute=False):
+    # Enrolled students and their enrollments per (year, degree).
+    counts = storage.enrollment_counts(recompute)['students']
+    loads = {}
+
+    def add(key, enrolled):
+        row = loads.setdefault(key, {'students': 0, 'enrollments': 0})
+        row['students'] += 1
+        row['enrollments'] += enrolled
+
+    for student in storage.iter_students():
+        enrolled = counts.pop(student['student_number'], 0)
+        if enrolled:
+            add((student.get('year', UNKNOWN), student.get('degree', UNKNOWN)), enrolled)
+    # Whatever is left was enrolled under a student number no longer on file.
+    for enrolled in counts.values():
+        add((UNKNOWN, UNKNOWN), enrolled)
+    return dict(sorted(loads.items()))
+
+def _period_label(day, period):
+    if day < 0:
+        return UNKNOWN
+    text = date.fromordinal(EPOCH_DAY + day).isoformat()
+    return text[:{'day': 10, 'month': 7, 'year': 4}[period]]
+
+def enrollment_rate_report(storage, period='month', recompute=False):
+    # Current enrollments by the day, month or year they were made.
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+    rates = Counter()
+    for day, count in storage.enrollment_counts(recompute)['days'].items():
+        rates[_period_label(day, period)] += count
+    return dict(sorted(rates.items()))
+
+# =========================
+# Command Line
+# =========================
+
+def _print_table(headers, rows):
+    widths = [max(len(str(value)) for value in column) for column in zip(headers, *rows)]
+    for row in [headers, ['-' * width for width in widths], *rows]:
+        print('  '.join(str(value).ljust(width) for value, width in zip(row, widths)))
+
+def main():
+    from config import DATA_DIR, STORAGE_BACKEND
+    from storage import open_storage
+
+    parser = argparse.ArgumentParser(description="Enrollment reports.")
+    parser.add_argument("report", choices=["courses", "departments", "units", "load", "rate"])
+    parser.add_argument("--department", help="only this department's courses (courses report)")
+    parser.add_argument("--period", choices=PERIODS, default="month", help="rate report buckets")
+    parser.add_argument("--recompute", action="store_true",
+                        help="recount from the full table instead of the live counters")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--backend", default=STORAGE_BACKEND, choices=["jsonl", "sqlite"])
+    args = parser.parse_args()
+
+    storage = open_storage(args.backend, args.data_dir)
+    if args.report == 'courses':
+        rows = course_report(storage, args.department, args.recompute)
+        _print_table(['Code', 'Course Name', 'Department', 'Units', 'Enrolled'],
+                     [[r['course_code'], r['course_name'], r['department'], r['units'], r['enrolled']]
+                      for r in rows])
+    elif args.report == 'departments':
+        report = department_report(storage, args.recompute)
+        _print_table(['Department', 'Courses', 'Enrollments', 'Unit-Enrollments'],
+                     [[name, r['courses'], r['enrollments'], r['units']] for name, r in report.items()])
+    elif args.report == 'units':
+        report = unit_load_report(storage)
+        _print_table(['Units', 'Students'], [[units, count] for units, count in report.items()])
+    elif args.report == 'load':
+        report = year_degree_report(storage, args.recompute)
+        _print_table(['Year', 'Degree', 'Students', 'Enrollments'],
+                     [[year, degree, r['students'], r['enrollments']]
+                      for (year, degree), r in report.items()])
+    else:
+        report = enrollment_rate_report(storage, args.period, args.recompute)
+        _print_table([args.period.capitalize(), 'Enrollments'],
+                     [[label, count] for label, count in report.items()])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import re
+import argparse
+from functools import lru_cache
+
+DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+# A week is cut into slots of this many minutes; meeting times must fall on
+# slot boundaries so that a timetable is exactly a set of slots.
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+_MEETING = re.compile(r'^([A-Za-z/]+)\s+(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})$')
+
+# =========================
+# Meeting Times
+# =========================
+
+def _day(name):
+    for index, day in enumerate(DAYS):
+        if name[:3].lower() == day.lower():
+            return index
+    raise ValueError(f"Unknown day {name!r}; use {', '.join(DAYS)}")
+
+def _minutes(hours, minutes):
+    hours, minutes = int(hours), int(minutes)
+    if minutes > 59 or hours > 24 or (hours == 24 and minutes):
+        raise ValueError(f"Invalid time {hours}:{minutes:02d}")
+    total = hours * 60 + minutes
+    if total % SLOT_MINUTES:
+        raise ValueError(f"Times must be multiples of {SLOT_MINUTES} minutes")
+    return total
+
+def parse_schedule(text):
+    # "Mon/Wed 09:00-10:30; Fri 13:00-15:00" -> sorted [(day, start, end)],
+    # with days counted from Monday and times in minutes past midnight.
+    meetings = set()
+    for part in re.split(r'[;,]', text or ''):
+        part = part.strip()
+        if not part:
+            continue
+        match = _MEETING.match(part)
+        if not match:
+            raise ValueError(f"Meeting times look like 'Mon/Wed 09:00-10:30', not {part!r}")
+        days, start_h, start_m, end_h, end_m = match.groups()
+        start, end = _minutes(start_h, start_m), _minutes(end_h, end_m)
+        if end <= start:
+            raise ValueError(f"{part!r} ends before it starts")
+        for name in days.split('/'):
+            meetings.add((_day(name), start, end))
+    return sorted(meetings)
+
+def format_schedule(meetings):
+    return '; '.join(f"{DAYS[day]} {start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d}"
+                     for day, start, end in sorted(meetings))
+
+def normalize_schedule(text):
+    # The canonical spelling stored on a course; '' for no meeting times.
+    return format_schedule(parse_schedule(text))
+
+# =========================
+# Weekly Bitmasks
+# =========================
+
+@lru_cache(maxsize=4096)
+def schedule_mask(text):
+    # One bit per slot of the week. Meetings are half-open, so a class ending
+    # at 10:30 does not clash with one starting at 10:30.
+    mask = 0
+    for day, start, end in parse_schedule(text):
+        first = day * SLOTS_PER_DAY + start // SLOT_MINUTES
+        mask |= ((1 << ((end - start) // SLOT_MINUTES)) - 1) << first
+    return mask
+
+def course_mask(course):
+    # Courses without (or with unreadable) meeting times never clash.
+    if not course or not course.get('schedule'):
+        return 0
+    try:
+        return schedule_mask(course['schedule'])
+    except ValueError:
+        return 0
+
+# =========================
+# Timetable Index
+# =========================
+
+class TimetableIndex:
+    # student_number -> the weekly bitmask of the courses they are enrolled
+    # in, so a clash check is one AND. A student's mask is worked out on
+    # first use and dropped whenever an enrollment record of theirs arrives;
+    # all of them are dropped when the courses table changes, since any
+    # course's meeting times may have moved.
+
+    def __init__(self, courses, courses_version):
+        self._courses = courses
+        self._courses_version = courses_version
+        self._enrollments = {}
+        self._masks = {}
+        self._version = None
+
+    def rebuild(self, enrollments):
+        self._enrollments = enrollments
+        self._masks = {}
+
+    def apply(self, record):
+        self._masks.pop(record['student_number'], None)
+
+    def timetable(self, student_number):
+        courses = self._courses()
+        version = self._courses_version()
+        if version != self._version:
+            self._masks = {}
+            self._version = version
+        mask = self._masks.get(student_number)
+        if mask is None:
+            mask = 0
+            for row in self._enrollments.get(student_number, ()):
+                mask |= course_mask(courses.get(row['course_code']))
+            self._masks[student_number] = mask
+        return mask
+
+# =========================
+# Conflict Sweep
+# =========================
+
+def find_conflicts(storage):
+    # Every enrollment that meets at the same time as an earlier enrollment
+    # of the same student, in one pass over the enrollments table.
+    masks = {code: course_mask(course) for code, course in storage.list_courses().items()}
+    busy = {}
+    scheduled = {}
+    conflicts = []
+    for enrollment in storage.iter_enrollments():
+        mask = masks.get(enrollment['course_code'], 0)
+        if not mask:
+            continue
+        student_number = enrollment['student_number']
+        taken = busy.get(student_number, 0)
+        if taken & mask:
+            conflicts.append({
+                'student_number': student_number,
+                'course_code': enrollment['course_code'],
+                'conflicts_with': [code for code in scheduled[student_number]
+                                   if masks[code] & mask]
+            })
+        busy[student_number] = taken | mask
+        scheduled.setdefault(student_number, []).append(enrollment['course_code'])
+    return conflicts
+
+# =========================
+# Command Line
+# =========================
+
+def main():
+    from config import DATA_DIR, STORAGE_BACKEND
+    from storage import open_storage
+
+    parser = argparse.ArgumentParser(description="List enrollments with clashing meeting times.")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--backend", default=STORAGE_BACKEND, choices=["jsonl", "sqlite"])
+    args = parser.parse_args()
+
+    conflicts = find_conflicts(open_storage(args.backend, args.data_dir))
+    for conflict in conflicts:
+        print(f"{conflict['student_number']}: {conflict['course_code']} clashes with "
+              f"{', '.join(conflict['conflicts_with'])}")
+    print(f"{len(conflicts)} conflicting enrollment(s)")
+
+if __name__ == "__main__":
+    main()
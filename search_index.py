@@ -0,0 +1,409 @@
+import re
+import heapq
+import bisect
+from functools import lru_cache
+
+# Every substring of up to NGRAM_SIZE characters is indexed, so short
+# keywords are answered directly from the postings and longer ones by
+# intersecting the postings of their n-grams and verifying the survivors.
+NGRAM_SIZE = 3
+SEARCH_FIELDS = ('course_code', 'course_name', 'department')
+
+_TOKEN_RE = re.compile(r'\w+')
+
+# Ranked search scores each field of a course and adds them up with these
+# weights (code, name, department). A field that contains the whole query,
+# from the start of a word, scores 1, or up to 1.5 when it starts with or
+# equals it; otherwise each query word is matched to its most similar word in
+# the field and the field scores the average. Words match when the query word
+# starts the field word or their trigrams are close enough (Dice coefficient),
+# which is what lets a typo like "calclus" still find Calculus. Courses that
+# search() finds, with the query anywhere in a field, come first of all.
+FIELD_WEIGHTS = (1.0, 0.8, 0.5)
+PREFIX_MATCH = 0.9
+WORD_SIMILARITY = 0.5
+MIN_SCORE = 0.2
+SUBSTRING_TIER = 10.0
+
+def _ngrams(text):
+    grams = set()
+    for n in range(1, NGRAM_SIZE + 1):
+        for i in range(len(text) - n + 1):
+            grams.add(text[i:i + n])
+    return grams
+
+def _tokens(text):
+    return set(_TOKEN_RE.findall(text))
+
+@lru_cache(maxsize=65536)
+def _word_grams(word):
+    if len(word) < NGRAM_SIZE:
+        return frozenset((word,))
+    return frozenset(word[i:i + NGRAM_SIZE] for i in range(len(word) - NGRAM_SIZE + 1))
+
+def word_similarity(token, word):
+    if token == word:
+        return 1.0
+    if word.startswith(token):
+        return PREFIX_MATCH
+    grams, other = _word_grams(token), _word_grams(word)
+    similarity = 2 * len(grams & other) / (len(grams) + len(other))
+    return similarity if similarity >= WORD_SIMILARITY else 0.0
+
+@lru_cache(maxsize=1024)
+def _word_start(query):
+    return re.compile(r'(?<!\w)' + re.escape(query))
+
+def _bonus(query, field):
+    # 1 for containing the query from the start of a word, plus a quarter
+    # each for starting with it and for being exactly it; 0 otherwise.
+    if not _word_start(query).search(field):
+        return 0.0
+    return 1.0 + 0.25 * field.startswith(query) + 0.25 * (field == query)
+
+def field_score(query, query_tokens, field):
+    if not query_tokens:
+        return 0.0
+    bonus = _bonus(query, field)
+    if bonus:
+        return bonus
+    words = _tokens(field)
+    total = 0.0
+    for token in query_tokens:
+        total += max((word_similarity(token, word) for word in words), default=0.0)
+    return total / len(query_tokens)
+
+def code_score(query, code):
+    # Codes only match whole, or by prefix once the query has a digit in it,
+    # so "cs" is left to the department rather than matching every CS course.
+    if code == query or (code.startswith(query) and any(c.isdigit() for c in query)):
+        return _bonus(query, code)
+    return 0.0
+
+def score_fields(query, query_tokens, fields):
+    # fields are the lowercased (code, name, department) of one course;
+    # query_tokens is sorted so that scores add up identically everywhere.
+    code, name, department = fields
+    score = _total(code_score(query, code),
+                   field_score(query, query_tokens, name),
+                   field_score(query, query_tokens, department))
+    return score + (SUBSTRING_TIER if any(query in field for field in fields) else 0.0)
+
+def _total(code, name, department):
+    return FIELD_WEIGHTS[0] * code + FIELD_WEIGHTS[1] * name + FIELD_WEIGHTS[2] * department
+
+def top_matches(query, courses, limit, offset=0):
+    # courses yields (code, fields, order); returns the codes ranked
+    # offset..offset+limit by score, ties in catalog order, without sorting
+    # the rest.
+    query = query.lower().strip()
+    query_tokens = sorted(_tokens(query))
+    scored = []
+    for code, fields, order in courses:
+        score = score_fields(query, query_tokens, fields)
+        if score >= MIN_SCORE:
+            scored.append((score, -order, code))
+    return [code for _, _, code in heapq.nlargest(offset + limit, scored)][offset:]
+
+def query_trigrams(query):
+    # Trigrams that every course top_matches() can return shares with the
+    # query, for narrowing candidates elsewhere; None when a query word is
+    # too short to have any.
+    tokens = _tokens(query.lower())
+    if not tokens or any(len(token) < NGRAM_SIZE for token in tokens):
+        return None
+    return set().union(*(_word_grams(token) for token in tokens))
+
+def _add_posting(postings, key, code):
+    if key not in postings:
+        postings[key] = set()
+    postings[key].add(code)
+
+def _remove_posting(postings, key, code):
+    codes = postings.get(key)
+    if codes is not None:
+        codes.discard(code)
+        if not codes:
+            del postings[key]
+
+def _containing(postings, text):
+    # Candidates holding every trigram of text, a string longer than one.
+    grams = {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+    return set.intersection(*sorted((postings.get(gram, set()) for gram in grams), key=len))
+
+def _remove_sorted(codes, code):
+    i = bisect.bisect_left(codes, code)
+    if i < len(codes) and codes[i] == code:
+        del codes[i]
+
+class CourseSearchIndex:
+    def __init__(self):
+        self._fields = {}
+        self._order = {}
+        self._next_order = 0
+        self._grams = {}
+        # Codes kept sorted, overall and per department, for paged listings.
+        self._sorted = []
+        self._sorted_departments = {}
+        # For ranked search: (order, code) per distinct (name, department),
+        # kept in catalog order; the pairs each name and department is in;
+        # the names and departments each word appears in; and the words
+        # themselves, by trigram and sorted for prefix lookups.
+        self._pairs = {}
+        self._name_pairs = {}
+        self._department_pairs = {}
+        self._word_values = ({}, {})
+        self._vocabulary = {}
+        self._words = []
+        # Every substring of up to NGRAM_SIZE characters of each distinct
+        # name and department, and of each code, for the substring tier.
+        self._value_grams = ({}, {})
+        self._code_grams = {}
+
+    def rebuild(self, courses):
+        self.__init__()
+        for code, course in courses.items():
+            self._add(code, course, keep_sorted=False)
+        self._sorted.sort()
+        for codes in self._sorted_departments.values():
+            codes.sort()
+
+    def update(self, code, old, new):
+        if old is not None and code in self._fields:
+            self._remove(code)
+            if new is None:
+                del self._order[code]
+        if new is not None:
+            self._add(code, new)
+
+    def apply(self, course):
+        code = course['course_code']
+        self.update(code, self._fields.get(code), None if course.get('deleted') else course)
+
+    def _add(self, code, course, keep_sorted=True):
+        fields = tuple(str(course[name]).lower() for name in SEARCH_FIELDS)
+        self._fields[code] = fields
+        if code not in self._order:
+            self._order[code] = self._next_order
+            self._next_order += 1
+        for field in fields:
+            for gram in _ngrams(field):
+                _add_posting(self._grams, gram, code)
+        department = self._sorted_departments.setdefault(fields[2], [])
+        if keep_sorted:
+            bisect.insort(self._sorted, code)
+            bisect.insort(department, code)
+        else:
+            self._sorted.append(code)
+            department.append(code)
+        self._add_pair(code, fields[1], fields[2])
+        for gram in _ngrams(fields[0]):
+            _add_posting(self._code_grams, gram, code)
+
+    def _remove(self, code):
+        fields = self._fields.pop(code)
+        for field in fields:
+            for gram in _ngrams(field):
+                _remove_posting(self._grams, gram, code)
+        _remove_sorted(self._sorted, code)
+        department = self._sorted_departments[fields[2]]
+        _remove_sorted(department, code)
+        if not department:
+            del self._sorted_departments[fields[2]]
+        self._remove_pair(code, fields[1], fields[2])
+        for gram in _ngrams(fields[0]):
+            _remove_posting(self._code_grams, gram, code)
+
+    def _add_pair(self, code, name, department):
+        pair = (name, department)
+        entries = self._pairs.get(pair)
+        if entries is None:
+            entries = self._pairs[pair] = []
+            for field, value, pairs in ((0, name, self._name_pairs),
+                                        (1, department, self._department_pairs)):
+                if value not in pairs:
+                    pairs[value] = set()
+                    self._add_words(field, value)
+                pairs[value].add(pair)
+        bisect.insort(entries, (self._order[code], code))
+
+    def _remove_pair(self, code, name, department):
+        pair = (name, department)
+        entries = self._pairs[pair]
+        _remove_sorted(entries, (self._order[code], code))
+        if entries:
+            return
+        del self._pairs[pair]
+        for field, value, pairs in ((0, name, self._name_pairs),
+                                    (1, department, self._department_pairs)):
+            pairs[value].discard(pair)
+            if not pairs[value]:
+                del pairs[value]
+                self._remove_words(field, value)
+
+    def _known(self, word):
+        return word in self._word_values[0] or word in self._word_values[1]
+
+    def _add_words(self, field, value):
+        for word in _tokens(value):
+            if not self._known(word):
+                for gram in _word_grams(word):
+                    _add_posting(self._vocabulary, gram, word)
+                bisect.insort(self._words, word)
+            _add_posting(self._word_values[field], word, value)
+        for gram in _ngrams(value):
+            _add_posting(self._value_grams[field], gram, value)
+
+    def _remove_words(self, field, value):
+        for word in _tokens(value):
+            _remove_posting(self._word_values[field], word, value)
+            if not self._known(word):
+                for gram in _word_grams(word):
+                    _remove_posting(self._vocabulary, gram, word)
+                _remove_sorted(self._words, word)
+        for gram in _ngrams(value):
+            _remove_posting(self._value_grams[field], gram, value)
+
+    def _in_order(self, codes):
+        return sorted(codes, key=self._order.__getitem__)
+
+    def search(self, keyword):
+        keyword = keyword.lower()
+        if not keyword:
+            return self._in_order(self._fields)
+        if len(keyword) <= NGRAM_SIZE:
+            return self._in_order(self._grams.get(keyword, ()))
+        grams = {keyword[i:i + NGRAM_SIZE] for i in range(len(keyword) - NGRAM_SIZE + 1)}
+        postings = sorted((self._grams.get(gram, set()) for gram in grams), key=len)
+        candidates = set.intersection(*postings)
+        return self._in_order(code for code in candidates
+                              if any(keyword in field for field in self._fields[code]))
+
+    def sorted_codes(self, after=None, department=None, limit=None):
+        # Up to `limit` course codes in code order, starting after the
+        # cursor `after`, optionally within one department.
+        if department is None:
+            codes = self._sorted
+        else:
+            codes = self._sorted_departments.get(department.lower(), [])
+        start = 0 if after is None else bisect.bisect_right(codes, after)
+        return codes[start:None if limit is None else start + limit]
+
+    def rank(self, query, limit, offset=0):
+        # The same ranking as top_matches() over every course, worked out
+        # from the words of the query instead: each query word is matched
+        # against the vocabulary, each distinct name and department that
+        # holds a match or contains the query is scored once, and courses
+        # sharing a name and department share a score, so only the groups
+        # that make the page are walked, in catalog order. Courses whose code
+        # contains the query are scored one by one.
+        query = query.lower().strip()
+        query_tokens = sorted(_tokens(query))
+        similar = [self._similar_words(token) for token in query_tokens]
+        names = self._score_values(0, query, similar)
+        departments = self._score_values(1, query, similar)
+
+        containing = set()
+        for name in self._values_containing(0, query):
+            containing.update(self._name_pairs[name])
+        for department in self._values_containing(1, query):
+            containing.update(self._department_pairs[department])
+
+        hits = {}
+        totals = {}
+        digits = any(c.isdigit() for c in query)
+        for code in self._codes_containing(query) if query else ():
+            fields = self._fields[code]
+            # Only the exact code and, with a digit, a prefix score as codes.
+            key = (fields[0] == query, digits and fields[0].startswith(query), fields[1], fields[2])
+            score = totals.get(key)
+            if score is None:
+                matched = code_score(query, fields[0])
+                if not matched and key[2:] in containing:
+                    # Ranked with the rest of its name and department.
+                    score = None
+                else:
+                    score = _total(matched, names.get(fields[1], 0.0),
+                                   departments.get(fields[2], 0.0)) + SUBSTRING_TIER
+                totals[key] = score
+            if score is not None:
+                hits[code] = score
+
+        pairs = set(containing)
+        for name in names:
+            pairs.update(self._name_pairs[name])
+        for department in departments:
+            pairs.update(self._department_pairs[department])
+        levels = {}
+        for pair in pairs:
+            score = _total(0.0, names.get(pair[0], 0.0), departments.get(pair[1], 0.0)) \
+                + (SUBSTRING_TIER if pair in containing else 0.0)
+            if score >= MIN_SCORE:
+                levels.setdefault(score, []).append(self._pairs[pair])
+        single = {}
+        for code, score in hits.items():
+            single.setdefault(score, []).append((self._order[code], code, True))
+        for score, entries in single.items():
+            entries.sort()
+            levels.setdefault(score, []).append(entries)
+
+        needed = offset + limit
+        ranked = []
+        for score in sorted(levels, reverse=True):
+            for entry in heapq.merge(*levels[score]):
+                # A course scored on its own is skipped in its group.
+                if len(entry) == 2 and entry[1] in hits:
+                    continue
+                ranked.append(entry[1])
+                if len(ranked) >= needed:
+                    return ranked[offset:]
+        return ranked[offset:]
+
+    def _similar_words(self, token):
+        # word -> word_similarity(token, word), for the words it is above 0.
+        grams = _word_grams(token)
+        shared = {}
+        for gram in grams:
+            for word in self._vocabulary.get(gram, ()):
+                shared[word] = shared.get(word, 0) + 1
+        found = {}
+        for word, count in shared.items():
+            similarity = 2 * count / (len(grams) + len(_word_grams(word)))
+            if similarity >= WORD_SIMILARITY:
+                found[word] = similarity
+        i = bisect.bisect_left(self._words, token)
+        while i < len(self._words) and self._words[i].startswith(token):
+            word = self._words[i]
+            found[word] = 1.0 if word == token else PREFIX_MATCH
+            i += 1
+        return found
+
+    def _score_values(self, field, query, similar):
+        # field_score() of every name (field 0) or department (field 1)
+        # holding a word similar to one of the query words.
+        totals = {}
+        for matches in similar:
+            best = {}
+            for word, similarity in matches.items():
+                for value in self._word_values[field].get(word, ()):
+                    if similarity > best.get(value, 0.0):
+                        best[value] = similarity
+            for value, similarity in best.items():
+                totals[value] = totals.get(value, 0.0) + similarity
+        return {value: _bonus(query, value) or total / len(similar)
+                for value, total in totals.items()}
+
+    def _values_containing(self, field, query):
+        # The distinct names (field 0) or departments (field 1) holding query.
+        values = self._value_grams[field]
+        if not query:
+            return list(self._name_pairs if field == 0 else self._department_pairs)
+        if len(query) <= NGRAM_SIZE:
+            return list(values.get(query, ()))
+        return [value for value in _containing(values, query) if query in value]
+
+    def _codes_containing(self, query):
+        if len(query) <= NGRAM_SIZE:
+            return list(self._code_grams.get(query, ()))
+        return [code for code in _containing(self._code_grams, query)
+                if query in self._fields[code][0]]
@@ -0,0 +1,322 @@
+import os
+import re
+import hmac
+import json
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import metrics
+from config import ADMIN_TOKEN, CAMPUS, DATA_ROOT, NOTICE_SINK, STORAGE_BACKEND
+from service import (
+    EnrollmentService, ServiceError, InvalidInput, NotFound, Forbidden, Unauthorized, ENROLLED,
+    PAGE_SIZE, public_student, start_notices
+)
+from storage import ANY, open_storage
+from terms import TermArchive, partition_dir
+
+# =========================
+# Routes
+# =========================
+
+ROUTES = []
+
+def route(method, pattern):
+    def register(handler):
+        timed = metrics.timed(f"http.{handler.__name__}")(handler)
+        ROUTES.append((method, re.compile(f"^{pattern}$"), timed))
+        return handler
+    return register
+
+class Request:
+    __slots__ = ('body', 'query', 'token', 'admin')
+
+    def __init__(self, body, query, token, admin=False):
+        self.body = body
+        self.query = query
+        self.token = token
+        # Whether the token is the server's administrator token.
+        self.admin = admin
+
+def _require(body, *fields):
+    missing = [field for field in fields if body.get(field) in (None, '')]
+    if missing:
+        raise InvalidInput(f"Missing field(s): {', '.join(missing)}")
+
+# Any of these on a course listing asks for one page of it.
+PAGING_PARAMS = ('after', 'limit', 'department', 'units')
+
+def _paged(request):
+    return any(name in request.query for name in PAGING_PARAMS)
+
+def _course_page(service, request, student_number=None):
+    query = {name: values[0] for name, values in request.query.items() if name in PAGING_PARAMS}
+    return service.course_page(query.get('after'), query.get('limit', PAGE_SIZE),
+                               query.get('department'), query.get('units'), student_number)
+
+def _require_admin(request):
+    # Registrar routes take the token the server was started with.
+    if request.token is None:
+        raise Unauthorized("Please log in")
+    if not request.admin:
+        raise Forbidden("Only the registrar can do this")
+
+def _session_for(service, request, student_number):
+    # Student routes act only on the logged-in student's own records.
+    student = service.session_student(request.token)
+    if student['student_number'] != student_number:
+        raise Forbidden("You can only access your own records")
+    return student
+
+@route('POST', r'/login')
+def login(service, request):
+    body = request.body
+    _require(body, 'student_number', 'email', 'password')
+    token, student = service.login(body['student_number'], body['email'], body['password'])
+    return 200, {'token': token, 'student': public_student(student)}
+
+@route('POST', r'/logout')
+def logout(service, request):
+    service.logout(request.token)
+    return 200, {}
+
+@route('GET', r'/courses')
+def list_courses(service, request):
+    search = request.query.get('search', [None])[0]
+    if search is not None:
+        # Ranked, typo-tolerant search, paged by offset.
+        return 200, service.ranked_search(search, request.query.get('limit', [PAGE_SIZE])[0],
+                                          request.query.get('offset', [0])[0])
+    keyword = request.query.get('q', [None])[0]
+    if keyword is not None:
+        return 200, {'courses': service.search_courses(keyword)}
+    if _paged(request):
+        return 200, _course_page(service, request)
+    return 200, {'courses': service.list_courses()}
+
+@route('POST', r'/courses')
+def add_course(service, request):
+    body = request.body
+    _require(body, 'course_code', 'units')
+    course = service.add_course(body['course_code'], body.get('department', ''),
+                                body['units'], body.get('course_name', ''), body.get('capacity'),
+                                body.get('schedule'), body.get('prerequisites'))
+    return 201, {'course': course}
+
+@route('GET', r'/courses/(?P<course_code>[^/]+)')
+def get_course(service, request, course_code):
+    return 200, {'course': service.get_course(course_code)}
+
+@route('PUT', r'/courses/(?P<course_code>[^/]+)')
+def update_course(service, request, course_code):
+    body = request.body
+    # capacity and schedule change only if present; null clears them.
+    course = service.update_course(course_code, body.get('course_name'),
+                                   body.get('department'), body.get('units'),
+                                   capacity=body.get('capacity', ANY),
+                                   schedule=body.get('schedule', ANY),
+                                   prerequisites=body.get('prerequisites'))
+    return 200, {'course': course}
+
+@route('DELETE', r'/courses/(?P<course_code>[^/]+)')
+def delete_course(service, request, course_code):
+    # ?archive=false drops the course's enrollments instead of archiving them.
+    archive = request.query.get('archive', ['true'])[0].lower() not in ('false', '0', 'no')
+    return 200, service.delete_course(course_code, archive=archive)
+
+@route('POST', r'/courses/(?P<course_code>[^/]+)/rename')
+def rename_course(service, request, course_code):
+    _require(request.body, 'new_code')
+    return 200, service.rename_course(course_code, request.body['new_code'])
+
+@route('GET', r'/courses/(?P<course_code>[^/]+)/roster')
+def course_roster(service, request, course_code):
+    return 200, service.course_roster(course_code)
+
+@route('GET', r'/students/(?P<student_number>[^/]+)/available-courses')
+def available_courses(service, request, student_number):
+    _session_for(service, request, student_number)
+    if _paged(request):
+        return 200, _course_page(service, request, student_number)
+    return 200, {'courses': service.available_courses(student_number)}
+
+@route('GET', r'/students/(?P<student_number>[^/]+)/courses')
+def my_courses(service, request, student_number):
+    _session_for(service, request, student_number)
+    return 200, service.my_courses(student_number)
+
+@route('POST', r'/students/(?P<student_number>[^/]+)/completed-courses')
+def record_completed(service, request, student_number):
+    # Passing a course is the registrar's to record, not the student's.
+    _require_admin(request)
+    _require(request.body, 'course_codes')
+    return 200, {'completed_courses': service.record_completed(student_number,
+                                                               request.body['course_codes'])}
+
+@route('POST', r'/students/(?P<student_number>[^/]+)/enrollments')
+def enroll(service, request, student_number):
+    if 'course_codes' in request.body:
+        _session_for(service, request, student_number)
+        codes = request.body['course_codes']
+        if not isinstance(codes, list):
+            raise InvalidInput("course_codes must be a list")
+        return 201, service.enroll_many(student_number, codes)
+    _require(request.body, 'course_code')
+    _session_for(service, request, student_number)
+    enrollment = service.enroll(student_number, request.body['course_code'])
+    # 202 when the course was full and the student joined its waitlist.
+    return (201 if enrollment['status'] == ENROLLED else 202), {'enrollment': enrollment}
+
+@route('DELETE', r'/students/(?P<student_number>[^/]+)/enrollments/(?P<course_code>[^/]+)')
+def drop(service, request, student_number, course_code):
+    _session_for(service, request, student_number)
+    return 200, service.drop(student_number, course_code)
+
+@route('GET', r'/students/(?P<student_number>[^/]+)/history')
+def student_history(service, request, student_number):
+    _session_for(service, request, student_number)
+    term = request.query.get('term', [None])[0]
+    return 200, {'terms': service.student_history(student_number, term)}
+
+@route('GET', r'/courses/(?P<course_code>[^/]+)/history')
+def course_history(service, request, course_code):
+    term = request.query.get('term', [None])[0]
+    return 200, {'terms': service.course_history(course_code, term)}
+
+@route('GET', r'/terms')
+def terms(service, request):
+    return 200, service.term_summary()
+
+@route('GET', r'/notices')
+def notice_batches(service, request):
+    return 200, {'batches': service.notice_batches()}
+
+@route('GET', r'/notices/(?P<batch>[^/]+)')
+def notice_progress(service, request, batch):
+    return 200, service.notice_progress(batch)
+
+@route('GET', r'/metrics')
+def metrics_text(service, request):
+    # Prometheus text; empty of samples unless ENROLLMENT_METRICS is set.
+    return 200, metrics.render()
+
+# =========================
+# HTTP Server
+# =========================
+
+class EnrollmentRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except json.JSONDecodeError:
+            raise InvalidInput("Request body must be JSON")
+        if not isinstance(body, dict):
+            raise InvalidInput("Request body must be a JSON object")
+        return body
+
+    def _token(self):
+        scheme, _, token = (self.headers.get('Authorization') or '').partition(' ')
+        return token.strip() if scheme.lower() == 'bearer' else None
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        try:
+            token = self._token()
+            admin = self.server.admin_token is not None and token is not None \
+                and hmac.compare_digest(token, self.server.admin_token)
+            request = Request(self._read_body(), parse_qs(url.query), token, admin)
+            for route_method, pattern, handler in ROUTES:
+                match = pattern.match(url.path)
+                if match and route_method == method:
+                    status, payload = handler(self.server.service, request, **match.groupdict())
+                    break
+            else:
+                raise NotFound(f"No route for {method} {url.path}")
+        except ServiceError as e:
+            status, payload = e.status, {'error': str(e)}
+        except Exception as e:
+            status, payload = 500, {'error': f"Internal error: {e}"}
+        self._send(status, payload)
+
+    def _send(self, status, payload):
+        if isinstance(payload, str):
+            data, content_type = payload.encode(), 'text/plain; version=0.0.4'
+        else:
+            data, content_type = json.dumps(payload).encode(), 'application/json'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class EnrollmentServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # socketserver's default backlog of 5 resets connections when
+    # registration opens and every client connects at once.
+    request_queue_size = 1024
+
+    def __init__(self, address, service, quiet=False, admin_token=None):
+        super().__init__(address, EnrollmentRequestHandler)
+        self.service = service
+        self.quiet = quiet
+        self.admin_token = admin_token
+
+def make_server(service, host='127.0.0.1', port=8000, quiet=False, admin_token=None):
+    return EnrollmentServer((host, port), service, quiet, admin_token)
+
+# =========================
+# Command Line
+# =========================
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the enrollment system over HTTP/JSON.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--data-dir", default=DATA_ROOT)
+    parser.add_argument("--campus", default=CAMPUS, help="serve one campus's partition")
+    parser.add_argument("--backend", default=STORAGE_BACKEND, choices=["jsonl", "sqlite"])
+    parser.add_argument("--quiet", action="store_true", help="do not log each request")
+    parser.add_argument("--admin-token", default=ADMIN_TOKEN,
+                        help="bearer token for registrar routes (default $ENROLLMENT_ADMIN_TOKEN)")
+    parser.add_argument("--notices", default=NOTICE_SINK, choices=["file", "stub"],
+                        help="where course-change notices are delivered")
+    args = parser.parse_args()
+
+    data_dir = partition_dir(args.data_dir, args.campus)
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    service = EnrollmentService(open_storage(args.backend, data_dir), terms=TermArchive(data_dir))
+    workers = start_notices(service, data_dir, args.notices)
+    server = make_server(service, args.host, args.port, args.quiet, args.admin_token)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        workers.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,637 @@
+import os
+from datetime import datetime
+from itertools import islice
+
+from auth import PasswordVerifier, SessionStore, hash_password, needs_rehash
+from jobs import JOBS_FILENAME, OUTBOX_DIRNAME, WORKERS, JobQueue, WorkerPool, make_sink
+from locking import LockTimeout
+from metrics import timed
+from schedule import course_mask, normalize_schedule
+from storage import ANY, ConflictError, ENROLLED, WAITLISTED, ALREADY_ENROLLED, ALREADY_WAITLISTED
+
+# Most units a student may carry in one term.
+MAX_UNITS = 24
+
+# Job kind of the notice sent to each student a course change affects.
+NOTICE_JOB = 'course_notice'
+
+# Courses per page of a listing, and the most a caller may ask for.
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 500
+
+# =========================
+# Errors
+# =========================
+
+class ServiceError(Exception):
+    status = 400
+
+class InvalidInput(ServiceError):
+    status = 400
+
+class Unauthorized(ServiceError):
+    status = 401
+
+class NotFound(ServiceError):
+    status = 404
+
+class Forbidden(ServiceError):
+    status = 403
+
+class Conflict(ServiceError):
+    status = 409
+
+class Busy(ServiceError):
+    status = 503
+
+def validate_email(email, student_number):
+    expected_email = f"{student_number}@mocku.edu.ph"
+    return email == expected_email
+
+def parse_units_filter(units):
+    # Blank means any number of units.
+    if units in (None, ''):
+        return None
+    try:
+        return int(str(units).strip())
+    except ValueError:
+        raise InvalidInput("Units must be a number!")
+
+def _page_size(limit):
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise InvalidInput("Page size must be a number!")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise InvalidInput(f"Page size must be between 1 and {MAX_PAGE_SIZE}!")
+    return limit
+
+def parse_capacity(capacity):
+    # Blank means no limit.
+    if capacity in (None, ''):
+        return None
+    try:
+        capacity = int(str(capacity).strip())
+    except ValueError:
+        raise InvalidInput("Capacity must be a number!")
+    if capacity < 0:
+        raise InvalidInput("Capacity cannot be negative!")
+    return capacity
+
+def parse_schedule(schedule):
+    # Meeting times like "Mon/Wed 09:00-10:30; Fri 13:00-15:00", in canonical
+    # form; blank means none.
+    try:
+        return normalize_schedule(str(schedule or ''))
+    except ValueError as e:
+        raise InvalidInput(f"{e}!")
+
+def parse_course_codes(codes):
+    # A list or comma-separated string of course codes, sorted and deduplicated.
+    if isinstance(codes, str):
+        codes = codes.split(',')
+    if not isinstance(codes, (list, tuple)):
+        raise InvalidInput("Course codes must be a list!")
+    return sorted({str(code).strip().upper() for code in codes if str(code).strip()})
+
+def parse_prerequisites(prerequisites):
+    # As parse_course_codes; 'none' clears them.
+    if isinstance(prerequisites, str) and prerequisites.strip().lower() == 'none':
+        return []
+    return parse_course_codes(prerequisites)
+
+def public_student(student):
+    return {key: value for key, value in student.items() if key != 'password'}
+
+# =========================
+# Enrollment Service
+# =========================
+
+class EnrollmentService:
+    # Business rules shared by the CLI menus and the HTTP server. Methods
+    # return plain records and report failures as ServiceError subclasses;
+    # nothing here prompts or prints.
+
+    def __init__(self, storage, verifier=None, sessions=None, jobs=None, terms=None):
+        self.storage = storage
+        self.verifier = verifier or PasswordVerifier()
+        self.sessions = sessions or SessionStore()
+        # A JobQueue for course-change notices; without one none are sent.
+        self.jobs = jobs
+        # A TermArchive of past terms; without one only the current term
+        # is visible.
+        self.terms = terms
+
+    def _write(self, operation, *args, **kwargs):
+        try:
+            return operation(*args, **kwargs)
+        except ConflictError as e:
+            raise Conflict(str(e)) from e
+        except LockTimeout as e:
+            raise Busy("The system is busy. Please try again.") from e
+
+    # Students
+
+    @timed('service.authenticate')
+    def authenticate(self, student_number, email, password):
+        if not validate_email(email, student_number):
+            raise Unauthorized("Email must be in format [student_number]@mocku.edu.ph")
+        student = self.storage.get_student(student_number)
+        if not student or student['email'] != email:
+            raise Unauthorized("Invalid credentials")
+        if not self.verifier.verify(password, student['password']):
+            raise Unauthorized("Invalid credentials")
+        if needs_rehash(student['password']):
+            student = dict(student, password=hash_password(password))
+            self._write(self.storage.put_students, [student])
+        return student
+
+    @timed('service.login')
+    def login(self, student_number, email, password):
+        student = self.authenticate(student_number, email, password)
+        return self.sessions.create(student['student_number']), student
+
+    @timed('service.session_student')
+    def session_student(self, token):
+        student_number = self.sessions.resolve(token) if token else None
+        if student_number is None:
+            raise Unauthorized("Please log in again")
+        return self.get_student(student_number)
+
+    @timed('service.logout')
+    def logout(self, token):
+        self.sessions.revoke(token)
+
+    @timed('service.get_student')
+    def get_student(self, student_number):
+        student = self.storage.get_student(student_number)
+        if not student:
+            raise NotFound(f"Student {student_number} not found!")
+        return student
+
+    # Courses
+
+    @timed('service.list_courses')
+    def list_courses(self):
+        return [course for _, course in sorted(self.storage.list_courses().items())]
+
+    def courses(self, after=None, department=None, units=None, student_number=None):
+        # Lazily yields courses in course-code order after the cursor `after`.
+        # With a student number, only the courses in available_courses are
+        # yielded.
+        department = str(department).strip() if department else None
+        courses = self.storage.iter_sorted_courses(
+            after or None, department or None, parse_units_filter(units))
+        if student_number is None:
+            return courses
+        return self._open_courses(student_number, courses)
+
+    def _open_courses(self, student_number, courses):
+        # Courses the student is not enrolled or waitlisted in and has the
+        # prerequisites for: a set lookup and one AND per course.
+        taken = self._taken_course_codes(student_number)
+        graph = self.storage.prerequisite_graph()
+        completed = graph.completed_mask(self.completed_courses(student_number))
+        return (course for course in courses
+                if course['course_code'] not in taken
+                and graph.is_eligible(course['course_code'], completed))
+
+    @timed('service.course_page')
+    def course_page(self, after=None, limit=PAGE_SIZE, department=None, units=None,
+                    student_number=None):
+        # One page of courses; `next` is the cursor for the following page,
+        # or None on the last one.
+        limit = _page_size(limit)
+        courses = list(islice(self.courses(after, department, units, student_number), limit + 1))
+        return {
+            'courses': courses[:limit],
+            'next': courses[limit - 1]['course_code'] if len(courses) > limit else None
+        }
+
+    def has_courses(self):
+        return self.storage.course_count() > 0
+
+    @timed('service.search_courses')
+    def search_courses(self, keyword):
+        return self.storage.search_courses(keyword.strip().lower())
+
+    @timed('service.ranked_search')
+    def ranked_search(self, query, limit=PAGE_SIZE, offset=0):
+        # One page of courses, best match first, tolerating typos; `next` is
+        # the offset of the following page, or None on the last one.
+        limit = _page_size(limit)
+        try:
+            offset = int(offset or 0)
+        except (TypeError, ValueError):
+            raise InvalidInput("Offset must be a number!")
+        if offset < 0:
+            raise InvalidInput("Offset cannot be negative!")
+        courses = self.storage.rank_courses(str(query or '').strip(), limit + 1, offset)
+        return {
+            'courses': courses[:limit],
+            'next': offset + limit if len(courses) > limit else None
+        }
+
+    @timed('service.get_course')
+    def get_course(self, course_code):
+        course = self.storage.get_course(course_code.strip().upper())
+        if not course:
+            raise NotFound(f"Course {course_code.strip().upper()} not found!")
+        return course
+
+    def course_exists(self, course_code):
+        return self.storage.get_course(course_code.strip().upper()) is not None
+
+    @timed('service.add_course')
+    def add_course(self, course_code, department, units, course_name, capacity=None,
+                   schedule=None, prerequisites=None):
+        course_code = str(course_code).strip().upper()
+        if not course_code:
+            raise InvalidInput("Course code is required!")
+        try:
+            units = int(str(units).strip())
+        except ValueError:
+            raise InvalidInput("Units must be a number!")
+        course = {
+            'course_code': course_code,
+            'department': str(department).strip(),
+            'units': units,
+            'course_name': str(course_name).strip()
+        }
+        capacity = parse_capacity(capacity)
+        if capacity is not None:
+            course['capacity'] = capacity
+        schedule = parse_schedule(schedule)
+        if schedule:
+            course['schedule'] = schedule
+        if prerequisites not in (None, ''):
+            prerequisites = self._check_prerequisites(course_code, prerequisites)
+            if prerequisites:
+                course['prerequisites'] = prerequisites
+        try:
+            self._write(self.storage.put_course, course, expected=None)
+        except Conflict:
+            raise Conflict(f"Course {course_code} already exists!")
+        return course
+
+    @timed('service.update_course')
+    def update_course(self, course_code, course_name=None, department=None, units=None,
+                      expected=ANY, capacity=ANY, schedule=ANY, prerequisites=None):
+        # capacity and schedule are left alone unless given; None or blank
+        # clears them (no limit, no meeting times).
+        current = self.get_course(course_code)
+        course = dict(current)
+        if course_name:
+            course['course_name'] = str(course_name).strip()
+        if department:
+            course['department'] = str(department).strip()
+        if units not in (None, ''):
+            try:
+                course['units'] = int(str(units).strip())
+            except ValueError:
+                raise InvalidInput("Units must be a number!")
+        if capacity is not ANY:
+            course['capacity'] = parse_capacity(capacity)
+            if course['capacity'] is None:
+                del course['capacity']
+        if schedule is not ANY:
+            course['schedule'] = parse_schedule(schedule)
+            if not course['schedule']:
+                del course['schedule']
+        if prerequisites not in (None, ''):
+            course['prerequisites'] = self._check_prerequisites(course['course_code'], prerequisites)
+            if not course['prerequisites']:
+                del course['prerequisites']
+        self._write(self.storage.put_course, course,
+                    expected=current if expected is ANY else expected)
+        if course.get('capacity') != current.get('capacity'):
+            self._write(self.storage.promote_waitlist, course['course_code'])
+        changed = sorted(key for key in set(course) | set(current) if course.get(key) != current.get(key))
+        if changed:
+            code = course['course_code']
+            self._notify(code, self._affected_students(code),
+                         f"Course {code} ({course['course_name']}) was updated: "
+                         f"{', '.join(key.replace('_', ' ') for key in changed)} changed.")
+        return course
+
+    def _check_prerequisites(self, course_code, prerequisites):
+        prerequisites = parse_prerequisites(prerequisites)
+        unknown = [code for code in prerequisites if not self.storage.get_course(code)]
+        if unknown:
+            raise InvalidInput(f"Unknown prerequisite course(s): {', '.join(unknown)}!")
+        if self.storage.prerequisite_graph().creates_cycle(course_code, prerequisites):
+            raise InvalidInput(f"{course_code} cannot require a course that requires it!")
+        return prerequisites
+
+    @timed('service.delete_course')
+    def delete_course(self, course_code, expected=ANY, archive=True):
+        # The course's enrollments and waitlist go with it; by default the
+        # enrollments are kept in the archive.
+        course = self.get_course(course_code)
+        affected = self._affected_students(course['course_code'])
+        removed = self._write(self.storage.delete_course, course['course_code'],
+                              expected=course if expected is ANY else expected, archive=archive)
+        if removed is None:
+            raise NotFound(f"Course {course['course_code']} not found!")
+        notices = self._notify(course['course_code'], affected,
+                               f"Course {course['course_code']} ({course['course_name']}) was "
+                               f"cancelled and removed from your schedule.")
+        return {'course': course, 'removed': removed, 'archived': archive, 'notices': notices}
+
+    @timed('service.rename_course')
+    def rename_course(self, course_code, new_code, expected=ANY):
+        course = self.get_course(course_code)
+        new_code = str(new_code or '').strip().upper()
+        if not new_code:
+            raise InvalidInput("New course code is required!")
+        moved = self._write(self.storage.rename_course, course['course_code'], new_code,
+                            expected=course if expected is ANY else expected)
+        if moved is None:
+            raise NotFound(f"Course {course['course_code']} not found!")
+        notices = self._notify(new_code, self._affected_students(new_code),
+                               f"Course {course['course_code']} ({course['course_name']}) "
+                               f"is now {new_code}.")
+        return {'course': dict(course, course_code=new_code), 'moved': moved, 'notices': notices}
+
+    # Notices
+
+    def _affected_students(self, course_code):
+        students = set(self.storage.course_roster(course_code))
+        students.update(entry['student_number'] for entry in self.storage.waitlist(course_code))
+        return students
+
+    def _notify(self, course_code, students, message):
+        # Queues one notice per student; returns the batch id, or None.
+        if self.jobs is None or not students:
+            return None
+        return self.jobs.enqueue(NOTICE_JOB, [
+            {'student_number': student_number, 'course_code': course_code, 'message': message}
+            for student_number in sorted(students)
+        ], label=f"{course_code}: {len(students)} notice(s)")
+
+    def compose_notice(self, payload):
+        # The notice text with the student's schedule as it is now.
+        schedule = self.my_courses(payload['student_number'])
+        lines = [payload['message'], '', "Your current schedule:"]
+        for row in schedule['courses']:
+            course = row['course']
+            lines.append(f"  {course['course_code']}: {course['course_name']} "
+                         f"({course['units']} units)")
+        if not schedule['courses']:
+            lines.append("  (no courses)")
+        lines.append(f"Total units: {schedule['total_units']}")
+        for row in schedule['waitlist']:
+            lines.append(f"Waitlisted for {row['course']['course_code']}, position {row['position']}")
+        return f"Course change: {payload['course_code']}", '\n'.join(lines) + '\n'
+
+    def notice_batches(self):
+        # Progress of each batch of notices still in the queue.
+        return [] if self.jobs is None else self.jobs.batches()
+
+    def notice_progress(self, batch):
+        if self.jobs is None:
+            raise NotFound("Notices are not enabled!")
+        progress = self.jobs.progress(batch)
+        if not progress['total']:
+            raise NotFound(f"No notices in batch {batch}!")
+        return dict(progress, batch=batch)
+
+    @timed('service.course_roster')
+    def course_roster(self, course_code):
+        course = self.get_course(course_code)
+        roster = self.storage.course_roster(course['course_code'])
+        waitlist = self.storage.waitlist(course['course_code'])
+        return {
+            'course_code': course['course_code'],
+            'capacity': course.get('capacity'),
+            'headcount': len(roster),
+            'students': roster,
+            'waitlist': [entry['student_number'] for entry in waitlist]
+        }
+
+    def course_headcount(self, course_code):
+        return self.storage.course_headcount(course_code)
+
+    # Enrollment
+
+    def enrolled_course_codes(self, student_number):
+        return [e['course_code'] for e in self.storage.student_enrollments(student_number)]
+
+    def _taken_course_codes(self, student_number):
+        taken = set(self.enrolled_course_codes(student_number))
+        taken.update(e['course_code'] for e in self.storage.student_waitlist(student_number))
+        return taken
+
+    def completed_courses(self, student_number):
+        student = self.storage.get_student(student_number)
+        return list(student.get('completed_courses', ())) if student else []
+
+    @timed('service.record_completed')
+    def record_completed(self, student_number, course_codes):
+        # Adds to the courses the student has passed, which count toward
+        # prerequisites.
+        student = dict(self.get_student(student_number))
+        codes = parse_course_codes(course_codes)
+        if not codes:
+            raise InvalidInput("Select at least one course!")
+        unknown = [code for code in codes if not self.storage.get_course(code)]
+        if unknown:
+            raise InvalidInput(f"Unknown course(s): {', '.join(unknown)}!")
+        student['completed_courses'] = sorted(set(student.get('completed_courses', ())) | set(codes))
+        self._write(self.storage.put_students, [student])
+        return student['completed_courses']
+
+    @timed('service.available_courses')
+    def available_courses(self, student_number):
+        return list(self._open_courses(student_number, self.list_courses()))
+
+    @timed('service.enroll')
+    def enroll(self, student_number, course_code):
+        # Returns the enrollment with its `status`: ENROLLED, or WAITLISTED
+        # together with the student's `position` when the course is full.
+        course = self.get_course(course_code)
+        course_code = course['course_code']
+        self._check_eligible(student_number, [course])
+        enrollment = {
+            'student_number': student_number,
+            'course_code': course_code,
+            'enrollment_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        outcome = self._write(self.storage.request_seat, enrollment,
+                              self._seat_validator(student_number, [course]))
+        if outcome == ALREADY_ENROLLED:
+            raise Conflict(f"You are already enrolled in {course_code}!")
+        if outcome == ALREADY_WAITLISTED:
+            raise Conflict(f"You are already on the waitlist for {course_code}!")
+        result = dict(enrollment, status=outcome)
+        if outcome == WAITLISTED:
+            result['position'] = self.waitlist_position(student_number, course_code)
+        return result
+
+    @timed('service.enroll_many')
+    def enroll_many(self, student_number, course_codes):
+        # All of the courses, in one write, or none of them. A full course
+        # fails the batch instead of waitlisting part of it.
+        codes = [str(code).strip().upper() for code in course_codes if str(code).strip()]
+        if not codes:
+            raise InvalidInput("Select at least one course!")
+        if len(set(codes)) != len(codes):
+            raise InvalidInput("Each course can only be selected once!")
+        courses = [self.get_course(code) for code in codes]
+        self._check_eligible(student_number, courses)
+        enrolled_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        enrollments = [{
+            'student_number': student_number,
+            'course_code': code,
+            'enrollment_date': enrolled_at
+        } for code in codes]
+        self._write(self.storage.enroll_batch, enrollments,
+                    self._seat_validator(student_number, courses, require_seats=True))
+        return {
+            'enrollments': enrollments,
+            'units': sum(course['units'] for course in courses)
+        }
+
+    def _seat_validator(self, student_number, courses, require_seats=False):
+        # Runs under the storage write lock, against the student's current
+        # enrollments, so concurrent requests cannot exceed MAX_UNITS together.
+        def validate(enrolled, waitlisted, seats):
+            for course in courses:
+                code = course['course_code']
+                if code in enrolled:
+                    raise Conflict(f"You are already enrolled in {code}!")
+                if code in waitlisted:
+                    raise Conflict(f"You are already on the waitlist for {code}!")
+            if require_seats:
+                full = [c['course_code'] for c in courses
+                        if seats[c['course_code']] is not None and seats[c['course_code']] <= 0]
+                if full:
+                    raise Conflict(f"No seats left in {', '.join(full)}!")
+            current = 0
+            for code in enrolled:
+                course = self.storage.get_course(code)
+                if course:
+                    current += course['units']
+            total = current + sum(course['units'] for course in courses)
+            if total > MAX_UNITS:
+                raise InvalidInput(f"Enrolling would bring you to {total} units; "
+                                   f"the limit is {MAX_UNITS}.")
+            self._check_timetable(student_number, enrolled, courses)
+        return validate
+
+    def _check_eligible(self, student_number, courses):
+        graph = self.storage.prerequisite_graph()
+        completed = graph.completed_mask(self.completed_courses(student_number))
+        for course in courses:
+            missing = graph.missing(course['course_code'], completed)
+            if missing:
+                raise InvalidInput(f"{course['course_code']} requires {', '.join(missing)} first!")
+
+    def _check_timetable(self, student_number, enrolled, courses):
+        # One AND per requested course against the student's weekly timetable;
+        # the clashing courses are only looked up once a clash is found.
+        masks = [(course['course_code'], course_mask(course)) for course in courses]
+        if not any(mask for _, mask in masks):
+            return
+        busy = self.storage.student_timetable(student_number)
+        for index, (code, mask) in enumerate(masks):
+            if busy & mask:
+                clashes = [other for other in sorted(enrolled)
+                           if course_mask(self.storage.get_course(other)) & mask]
+                clashes += [other for other, other_mask in masks[:index] if other_mask & mask]
+                raise Conflict(f"{code} meets at the same time as {', '.join(clashes)}!")
+            busy |= mask
+
+    @timed('service.drop')
+    def drop(self, student_number, course_code):
+        course_code = course_code.strip().upper()
+        promoted = self._write(self.storage.drop_enrollment, student_number, course_code)
+        if promoted is None:
+            raise NotFound(f"You are not enrolled in or waitlisted for {course_code}!")
+        return {'course_code': course_code, 'promoted': promoted}
+
+    @timed('service.waitlist_position')
+    def waitlist_position(self, student_number, course_code):
+        return self.storage.waitlist_position(student_number, course_code)
+
+    @timed('service.my_courses')
+    def my_courses(self, student_number):
+        rows = []
+        total_units = 0
+        for enrollment in self.storage.student_enrollments(student_number):
+            course = self.storage.get_course(enrollment['course_code'])
+            if course:
+                rows.append({'course': course, 'enrollment_date': enrollment['enrollment_date']})
+                total_units += course['units']
+        waitlist = []
+        for entry in self.storage.student_waitlist(student_number):
+            course = self.storage.get_course(entry['course_code'])
+            if course:
+                waitlist.append({
+                    'course': course,
+                    'position': self.waitlist_position(student_number, entry['course_code']),
+                    'requested_at': entry['requested_at']
+                })
+        return {'courses': rows, 'total_units': total_units, 'waitlist': waitlist}
+
+    # Terms
+
+    def term_summary(self):
+        # The current term and the archived ones, oldest first.
+        if self.terms is None:
+            return {'current': None, 'archived': []}
+        archived = []
+        for term in self.terms.terms():
+            manifest = self.terms.manifest(term)
+            archived.append({'term': term, 'archived_at': manifest['archived_at'],
+                             'enrollments': manifest['enrollments']})
+        return {'current': self.terms.current_term(), 'archived': archived}
+
+    @timed('service.student_history')
+    def student_history(self, student_number, term=None):
+        # The student's enrollments in past terms, or in the one named.
+        if self.terms is None:
+            return []
+        try:
+            return self.terms.student_history(student_number, None if term is None else [term])
+        except KeyError:
+            raise NotFound(f"Term {term} not found!")
+
+    @timed('service.course_history')
+    def course_history(self, course_code, term=None):
+        if self.terms is None:
+            return []
+        try:
+            return self.terms.course_history(course_code.strip().upper(),
+                                             None if term is None else [term])
+        except KeyError:
+            raise NotFound(f"Term {term} not found!")
+
+    @timed('service.rollover_term')
+    def rollover_term(self, next_term):
+        # Archives the current term's enrollments and starts next_term.
+        if self.terms is None:
+            raise InvalidInput("Terms are not enabled!")
+        try:
+            return self._write(self.terms.rollover, self.storage, next_term)
+        except ValueError as e:
+            raise InvalidInput(str(e))
+
+# =========================
+# Background Notices
+# =========================
+
+def start_notices(service, data_dir, sink='file', workers=WORKERS):
+    # Gives the service a job queue in data_dir and starts the workers that
+    # deliver its notices. `sink` is 'file' (the outbox directory), 'stub'
+    # or any object with FileSink's deliver().
+    queue = JobQueue(os.path.join(data_dir, JOBS_FILENAME))
+    if isinstance(sink, str):
+        sink = make_sink(sink, os.path.join(data_dir, OUTBOX_DIRNAME))
+
+    def deliver(job):
+        subject, body = service.compose_notice(job['payload'])
+        sink.deliver(job['payload']['student_number'], subject, body, job['job_id'])
+
+    service.jobs = queue
+    return WorkerPool(queue, {NOTICE_JOB: deliver}, workers).start()
@@ -0,0 +1,292 @@
+import os
+import mmap
+import json
+import struct
+import hashlib
+import argparse
+import threading
+
+from enrollment_records import COURSE_CODES, FIELDS, Enrollment, encode_date
+
+SNAPSHOT_SUFFIX = '.snap'
+SNAPSHOT_VERSION = 1
+
+# Bytes of the log just before the snapshot offset whose digest ties the
+# snapshot to that exact log, so a rewritten log is never overlaid on it.
+DIGEST_WINDOW = 4096
+
+KEYED = 1        # students/courses: key -> one JSON record
+ENROLLMENTS = 2  # student_number -> rows of (course code id, epoch seconds)
+
+MAGIC = b'ENRLSNAP'
+# magic, version, kind, key width, log inode, log offset, log digest,
+# key count, row count, code table bytes
+HEADER = struct.Struct('<8sHHIQQ32sQQQ')
+KEYED_ENTRY = struct.Struct('<QI')
+STUDENT_ENTRY = struct.Struct('<QI')
+ENROLLMENT_ROW = struct.Struct('<Iq')
+
+# =========================
+# Log Identity
+# =========================
+
+def log_digest(f, offset):
+    start = max(0, offset - DIGEST_WINDOW)
+    f.seek(start)
+    return hashlib.sha256(f.read(offset - start)).digest()
+
+def _fixed_width(keys):
+    encoded = [key.encode() for key in keys]
+    return encoded, max((len(key) for key in encoded), default=0)
+
+# =========================
+# Writing
+# =========================
+
+def _write_file(path, header, sections):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        for section in sections:
+            f.write(section)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def write_keyed_snapshot(path, records, log_ino, log_offset, digest):
+    # records: {key: record}. Keys are stored sorted and padded to a fixed
+    # width so a lookup is a binary search over the mapped index.
+    keys = sorted(records)
+    encoded, width = _fixed_width(keys)
+    index = bytearray()
+    blob = bytearray()
+    for key, raw_key in zip(keys, encoded):
+        data = json.dumps(records[key]).encode()
+        index += raw_key.ljust(width, b'\0')
+        index += KEYED_ENTRY.pack(len(blob), len(data))
+        blob += data
+    header = HEADER.pack(MAGIC, SNAPSHOT_VERSION, KEYED, width, log_ino, log_offset, digest,
+                         len(keys), 0, 0)
+    _write_file(path, header, (index, blob))
+
+def write_enrollment_snapshot(path, enrollments, log_ino, log_offset, digest):
+    # enrollments: {student_number: [enrollment, ...]}. Returns False when a
+    # record carries fields or dates the compact rows cannot represent.
+    codes = sorted({e['course_code'] for rows in enrollments.values() for e in rows})
+    code_ids = {code: i for i, code in enumerate(codes)}
+    students = sorted(enrollments)
+    encoded, width = _fixed_width(students)
+    index = bytearray()
+    rows = bytearray()
+    row_count = 0
+    for student_number, raw_key in zip(students, encoded):
+        student_rows = enrollments[student_number]
+        index += raw_key.ljust(width, b'\0')
+        index += STUDENT_ENTRY.pack(row_count, len(student_rows))
+        for e in student_rows:
+            if isinstance(e, Enrollment):
+                seconds = e.seconds
+            elif set(e) == set(FIELDS):
+                seconds = encode_date(e['enrollment_date'])
+            else:
+                return False
+            if seconds is None:
+                return False
+            rows += ENROLLMENT_ROW.pack(code_ids[e['course_code']], seconds)
+        row_count += len(student_rows)
+    code_table = '\n'.join(codes).encode()
+    header = HEADER.pack(MAGIC, SNAPSHOT_VERSION, ENROLLMENTS, width, log_ino, log_offset, digest,
+                         len(students), row_count, len(code_table))
+    _write_file(path, header, (code_table, index, rows))
+    return True
+
+# =========================
+# Reading
+# =========================
+
+class Snapshot:
+    # A memory-mapped snapshot. Only the header and the interned course
+    # code table are read when it is opened; records are decoded one key at
+    # a time.
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.kind, self.width, self.log_ino, self.log_offset, self.digest,
+         self.count, row_count, code_bytes) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != SNAPSHOT_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a snapshot")
+        position = HEADER.size
+        self.codes = []
+        if self.kind == ENROLLMENTS:
+            if code_bytes:
+                self.codes = self._map[position:position + code_bytes].decode().split('\n')
+            position += code_bytes
+            self._entry = STUDENT_ENTRY
+        else:
+            self._entry = KEYED_ENTRY
+        self._index = position
+        self._stride = self.width + self._entry.size
+        self._data = self._index + self.count * self._stride
+
+    def matches(self, f, ino, size):
+        # True if the open log `f` is the one this snapshot was taken from.
+        return (ino == self.log_ino and size >= self.log_offset
+                and log_digest(f, self.log_offset) == self.digest)
+
+    def _find(self, key):
+        raw = key.encode()
+        if len(raw) > self.width:
+            return None
+        raw = raw.ljust(self.width, b'\0')
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            start = self._index + mid * self._stride
+            probe = self._map[start:start + self.width]
+            if probe < raw:
+                low = mid + 1
+            elif probe > raw:
+                high = mid
+            else:
+                return self._entry.unpack_from(self._map, start + self.width)
+        return None
+
+    def get(self, key):
+        # The stored record, a fresh list of Enrollments, or None.
+        entry = self._find(key)
+        if entry is None:
+            return None
+        first, length = entry
+        if self.kind == KEYED:
+            start = self._data + first
+            return json.loads(self._map[start:start + length])
+        rows = []
+        for i in range(first, first + length):
+            code_id, seconds = ENROLLMENT_ROW.unpack_from(self._map, self._data + i * ENROLLMENT_ROW.size)
+            rows.append(Enrollment(key, COURSE_CODES.id_for(self.codes[code_id]), seconds))
+        return rows
+
+    def close(self):
+        self._map.close()
+
+# =========================
+# Lazy Tables
+# =========================
+
+class LazyTable:
+    # Point lookups against a snapshot plus the log records appended after
+    # it, without materializing the table. `apply` is the log's record
+    # applier and `key` the field records are looked up by. get() returns
+    # MISSING when there is no usable snapshot, telling the caller to fall
+    # back to a full load.
+
+    MISSING = object()
+
+    def __init__(self, log_path, key, apply):
+        self.log_path = log_path
+        self.snapshot_path = log_path + SNAPSHOT_SUFFIX
+        self.key = key
+        self.apply = apply
+        self._snapshot = None
+        self._log_ino = None
+        self._offset = 0
+        self._tail = {}
+        self._lock = threading.Lock()
+
+    def _open(self):
+        self.close()
+        try:
+            snapshot = Snapshot(self.snapshot_path)
+        except (OSError, ValueError):
+            return
+        try:
+            with open(self.log_path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                if not snapshot.matches(f, stat.st_ino, stat.st_size):
+                    snapshot.close()
+                    return
+        except OSError:
+            snapshot.close()
+            return
+        self._snapshot = snapshot
+        self._log_ino = snapshot.log_ino
+        self._offset = snapshot.log_offset
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            self.close()
+            return
+        if self._snapshot is None or stat.st_ino != self._log_ino or stat.st_size < self._offset:
+            self._open()
+            if self._snapshot is None:
+                return
+        if stat.st_size > self._offset:
+            self._read_tail()
+
+    def _read_tail(self):
+        with open(self.log_path, 'rb') as f:
+            f.seek(self._offset)
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                self._offset += len(raw)
+                try:
+                    record = json.loads(raw)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(record, dict) and self.key in record:
+                    self._tail.setdefault(record[self.key], []).append(record)
+
+    def get(self, key):
+        with self._lock:
+            self._refresh()
+            if self._snapshot is None:
+                return self.MISSING
+            value = self._snapshot.get(key)
+            records = {key: value} if value is not None else {}
+            for record in self._tail.get(key, ()):
+                self.apply(records, record)
+            return records.get(key)
+
+    def available(self):
+        with self._lock:
+            self._refresh()
+            return self._snapshot is not None
+
+    def close(self):
+        if self._snapshot is not None:
+            self._snapshot.close()
+        self._snapshot = None
+        self._log_ino = None
+        self._offset = 0
+        self._tail = {}
+
+# =========================
+# Command Line
+# =========================
+
+def main():
+    from config import CAMPUS, DATA_ROOT
+    from storage import JsonLinesStorage
+    from terms import partition_dir
+
+    parser = argparse.ArgumentParser(description="Build or remove binary snapshots of the data files.")
+    parser.add_argument("action", choices=["build", "remove"])
+    parser.add_argument("--data-dir", default=DATA_ROOT)
+    parser.add_argument("--campus", default=CAMPUS, help="use one campus's partition")
+    args = parser.parse_args()
+
+    storage = JsonLinesStorage(partition_dir(args.data_dir, args.campus))
+    if args.action == 'remove':
+        for table in storage.remove_snapshots():
+            print(f"Removed {table} snapshot")
+        return
+    for table, built in storage.build_snapshots().items():
+        print(f"{table}: {'snapshot written' if built else 'not snapshotted (unsupported records)'}")
+
+if __name__ == "__main__":
+    main()
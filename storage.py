@@ -0,0 +1,1786 @@
+import os
+import json
+import sqlite3
+import functools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from enrollment_index import CourseRosterIndex
+from enrollment_records import (
+    SECONDS_PER_DAY, compact_enrollment, encode_date, enrollment_dict, enrollment_json,
+    parse_enrollment_line
+)
+from integrity import log_keys, scan_enrollments
+from locking import FileLock, LockTimeout, LOCK_TIMEOUT
+from metrics import tally, timed
+from prerequisites import PrerequisiteGraph
+from reports import EnrollmentColumns, EnrollmentCounters
+from schedule import TimetableIndex, course_mask
+from search_index import CourseSearchIndex, SEARCH_FIELDS, query_trigrams, top_matches
+from snapshot import (
+    LazyTable, SNAPSHOT_SUFFIX, log_digest, write_keyed_snapshot, write_enrollment_snapshot
+)
+from store import DataStore
+from wal import WAL_FILENAME, WriteAheadLog
+
+STUDENTS_FILENAME = "students.txt"
+COURSES_FILENAME = "courses.txt"
+ENROLLMENTS_FILENAME = "enrollments.txt"
+WAITLIST_FILENAME = "waitlist.txt"
+ARCHIVE_FILENAME = "archived_enrollments.txt"
+SQLITE_FILENAME = "enrollment.db"
+
+# Number of appended enrollment log records after which a background
+# compaction folds the log back into a fresh snapshot.
+ENROLLMENT_COMPACT_THRESHOLD = 500
+
+# Courses fetched at a time by iter_sorted_courses.
+COURSE_SCAN_CHUNK = 256
+
+# Passed as `expected` to skip the optimistic check on a course mutation.
+ANY = object()
+
+# Outcomes of request_seat.
+ENROLLED = 'enrolled'
+WAITLISTED = 'waitlisted'
+ALREADY_ENROLLED = 'already_enrolled'
+ALREADY_WAITLISTED = 'already_waitlisted'
+
+class ConflictError(Exception):
+    pass
+
+def _check_batch(enrollments, enrolled, waitlisted, seats):
+    for enrollment in enrollments:
+        code = enrollment['course_code']
+        if code in enrolled or code in waitlisted:
+            raise ConflictError(f"Already enrolled or waitlisted in {code}")
+        if seats[code] is not None and seats[code] < sum(
+                1 for e in enrollments if e['course_code'] == code):
+            raise ConflictError(f"Course {code} is full")
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def _seats_left(course, headcount):
+    # None when the course has no capacity limit.
+    capacity = course.get('capacity') if course else None
+    return None if capacity is None else capacity - headcount
+
+def _check_expected(course_code, current, expected):
+    if expected is ANY:
+        return
+    if expected is None and current is not None:
+        raise ConflictError(f"Course {course_code} already exists")
+    if expected is not None and current != expected:
+        raise ConflictError(f"Course {course_code} was changed by another user")
+
+# =========================
+# Storage Interface
+# =========================
+
+class Storage:
+    # Whole-table access mirrors the original load_*/save_* functions; the
+    # point operations let a backend answer a single lookup without
+    # materializing a table. Course mutations take an optional `expected`
+    # record (None meaning "must not exist") and raise ConflictError if the
+    # stored course no longer matches it; writers that cannot get the write
+    # lock in time raise LockTimeout.
+
+    def load_students(self):
+        raise NotImplementedError
+
+    def save_students(self, students):
+        raise NotImplementedError
+
+    def load_courses(self):
+        raise NotImplementedError
+
+    def save_courses(self, courses):
+        raise NotImplementedError
+
+    def load_enrollments(self):
+        raise NotImplementedError
+
+    def save_enrollments(self, enrollments):
+        raise NotImplementedError
+
+    def get_student(self, student_number):
+        raise NotImplementedError
+
+    def get_course(self, course_code):
+        raise NotImplementedError
+
+    def list_courses(self):
+        raise NotImplementedError
+
+    def course_count(self):
+        raise NotImplementedError
+
+    def put_course(self, course, expected=ANY):
+        raise NotImplementedError
+
+    def delete_course(self, course_code, expected=ANY, archive=False):
+        # Also removes the course's enrollments and waitlist, copying the
+        # enrollments to the archive when asked, in one atomic commit.
+        # Returns None if there is no such course, else how many enrollments
+        # and waitlist requests went with it.
+        raise NotImplementedError
+
+    def rename_course(self, course_code, new_code, expected=ANY):
+        # Recodes the course and every enrollment and waitlist request that
+        # refers to it, in one atomic commit. Returns None if there is no
+        # such course, else how many references moved.
+        raise NotImplementedError
+
+    def archived_enrollments(self, course_code=None):
+        raise NotImplementedError
+
+    def save_archived_enrollments(self, archived):
+        raise NotImplementedError
+
+    def search_courses(self, keyword):
+        raise NotImplementedError
+
+    def rank_courses(self, query, limit, offset=0):
+        # The courses ranked offset..offset+limit by relevance to the query,
+        # typos allowed; see search_index.top_matches.
+        raise NotImplementedError
+
+    def iter_sorted_courses(self, after=None, department=None, units=None):
+        # Yields courses in course-code order, starting after the cursor
+        # `after`, fetching a chunk at a time rather than the whole catalog.
+        # `department` matches case-insensitively; `units` is an int.
+        raise NotImplementedError
+
+    def put_students(self, students):
+        raise NotImplementedError
+
+    def put_courses(self, courses):
+        raise NotImplementedError
+
+    def iter_students(self):
+        return iter(self.load_students().values())
+
+    def iter_courses(self):
+        return iter(self.load_courses().values())
+
+    def iter_enrollments(self):
+        for student_enrollments in self.load_enrollments().values():
+            yield from student_enrollments
+
+    def student_enrollments(self, student_number):
+        raise NotImplementedError
+
+    def enroll(self, enrollment):
+        raise NotImplementedError
+
+    def append_enrollment(self, enrollment):
+        raise NotImplementedError
+
+    def append_enrollments(self, enrollments):
+        raise NotImplementedError
+
+    def remove_enrollment(self, student_number, course_code):
+        raise NotImplementedError
+
+    def course_roster(self, course_code):
+        raise NotImplementedError
+
+    def course_headcount(self, course_code):
+        raise NotImplementedError
+
+    def course_headcounts(self):
+        raise NotImplementedError
+
+    def enrollment_counts(self, recompute=False):
+        # Counters of distinct enrollments by 'courses' (course_code),
+        # 'students' (student_number) and 'days' (days since the epoch of
+        # enrollment_date, -1 if unreadable); see reports.py. With recompute
+        # the whole table is recounted instead of read from live counters.
+        raise NotImplementedError
+
+    def student_unit_totals(self):
+        # student_number -> units carried, over courses still in the catalog.
+        raise NotImplementedError
+
+    def prerequisite_graph(self):
+        # The PrerequisiteGraph of the current catalog (see prerequisites.py).
+        graph = PrerequisiteGraph()
+        graph.rebuild(self.list_courses())
+        return graph
+
+    def student_timetable(self, student_number):
+        # Weekly bitmask of the meeting times of the student's enrolled
+        # courses (see schedule.py); 0 when none of them have any.
+        mask = 0
+        for enrollment in self.student_enrollments(student_number):
+            mask |= course_mask(self.get_course(enrollment['course_code']))
+        return mask
+
+    # Seats and waitlists. A course's optional `capacity` caps its headcount;
+    # requests beyond it join a first-come, first-served waitlist whose head
+    # is enrolled as soon as a seat frees up.
+
+    # Seat-taking writes accept `validate(enrolled, waitlisted, seats)`, called
+    # under the write lock with the student's enrolled and waitlisted course
+    # codes and the free seats of each requested course (None for unlimited,
+    # 0 while others are waitlisted). It raises to abort the write.
+
+    def request_seat(self, enrollment, validate=None):
+        raise NotImplementedError
+
+    def enroll_batch(self, enrollments, validate=None):
+        # One student's enrollments are written with a single append or
+        # transaction, or not at all. Raises ConflictError if any course is
+        # already taken or has no free seat.
+        raise NotImplementedError
+
+    def drop_enrollment(self, student_number, course_code):
+        # Returns None if the student held no seat or waitlist spot, else
+        # the student numbers promoted into the freed seat.
+        raise NotImplementedError
+
+    def promote_waitlist(self, course_code):
+        raise NotImplementedError
+
+    def waitlist(self, course_code):
+        raise NotImplementedError
+
+    def load_waitlists(self):
+        # {course_code: [entry]}, each queue in request order.
+        raise NotImplementedError
+
+    def save_waitlists(self, waitlists):
+        raise NotImplementedError
+
+    def student_waitlist(self, student_number):
+        raise NotImplementedError
+
+    def waitlist_position(self, student_number, course_code):
+        raise NotImplementedError
+
+    def compact_enrollments(self):
+        return False
+
+    def end_term(self, archive):
+        # Calls archive(enrollments), with the enrollments table as
+        # load_enrollments() returns it, under the write lock and then empties
+        # the enrollments and waitlist, so nothing enrolled in between is
+        # lost. If archive raises, nothing is emptied.
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+def open_storage(backend, data_dir):
+    if backend == 'jsonl':
+        return JsonLinesStorage(data_dir)
+    if backend == 'sqlite':
+        return SQLiteStorage(os.path.join(data_dir, SQLITE_FILENAME))
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+def read_enrollments(path):
+    # An enrollments file outside any storage, such as an archived term.
+    enrollments = {}
+    _read_log(path, enrollments, 0, _apply_enrollment_record, parse=_parse_enrollment_line)
+    return enrollments
+
+def read_courses(path):
+    courses = {}
+    _read_log(path, courses, 0, _keyed_record_applier('course_code'))
+    return courses
+
+def migrate(source, target):
+    # Copies every table either backend stores. Term data lives in files
+    # beside the tables; see terms.copy_terms.
+    target.save_students(source.load_students())
+    target.save_courses(source.load_courses())
+    target.save_enrollments(source.load_enrollments())
+    target.save_waitlists(source.load_waitlists())
+    target.save_archived_enrollments(source.archived_enrollments())
+
+# =========================
+# JSON-Lines Files
+# =========================
+
+def _keyed_record_applier(key):
+    # Students and courses files are read last-write-wins, so a batch of
+    # upserts can be appended and later folded by a full save. A record
+    # marked deleted removes its key.
+    def apply(records, data):
+        if data.get('deleted'):
+            records.pop(data[key], None)
+        else:
+            records[data[key]] = data
+    return apply
+
+def _recode(record, field, course_code, new_code=None):
+    # A copy of the record whose sorted list of course codes under field has
+    # course_code replaced by new_code, or dropped without one; None when the
+    # record does not list course_code.
+    codes = record.get(field) or ()
+    if course_code not in codes:
+        return None
+    codes = {code for code in codes if code != course_code}
+    if new_code:
+        codes.add(new_code)
+    record = dict(record)
+    if codes:
+        record[field] = sorted(codes)
+    else:
+        del record[field]
+    return record
+
+def _tombstone(**key):
+    return json.dumps(dict(key, deleted=True)) + '\n'
+
+def _apply_enrollment_record(enrollments, data):
+    student_num = data['student_number']
+    if data.get('deleted'):
+        remaining = [e for e in enrollments.get(student_num, [])
+                     if e['course_code'] != data['course_code']]
+        if remaining:
+            enrollments[student_num] = remaining
+        else:
+            enrollments.pop(student_num, None)
+        return
+    if student_num not in enrollments:
+        enrollments[student_num] = []
+    enrollments[student_num].append(data)
+
+def _apply_waitlist_record(waitlist, data):
+    # course_code -> {student_number: entry}, in request order.
+    queue = waitlist.get(data['course_code'])
+    if data.get('deleted'):
+        if queue is not None:
+            queue.pop(data['student_number'], None)
+            if not queue:
+                del waitlist[data['course_code']]
+        return
+    if queue is None:
+        queue = waitlist[data['course_code']] = {}
+    queue.setdefault(data['student_number'], data)
+
+def _parse_log_line(line):
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError:
+        # A torn append from a crash; the record was never acknowledged.
+        return None
+
+def _parse_enrollment_line(line):
+    # Enrollments are held as compact records (see enrollment_records.py);
+    # tombstones and records they cannot hold stay plain dicts.
+    enrollment = parse_enrollment_line(line)
+    if enrollment is not None:
+        return enrollment
+    data = _parse_log_line(line)
+    return compact_enrollment(data) if data else data
+
+def _read_log(path, records, offset, apply, on_record=None, parse=_parse_log_line):
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as f:
+        return _read_log_file(f, records, offset, apply, on_record, parse)
+
+def _read_log_file(f, records, offset, apply, on_record=None, parse=_parse_log_line):
+    f.seek(offset)
+    start, parsed = offset, 0
+    for raw in f:
+        data = parse(raw.decode())
+        if data is None and not raw.endswith(b'\n'):
+            # Leave a partially written final record for the next read.
+            break
+        offset += len(raw)
+        if data:
+            parsed += 1
+            if on_record is not None:
+                on_record(data)
+            apply(records, data)
+    tally('bytes_read', f.name, offset - start)
+    tally('records_parsed', f.name, parsed)
+    return offset
+
+def _fsync_directory(path):
+    if os.name == 'nt':
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _replace_file(path, lines, tail=None):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        for line in lines:
+            f.write(line)
+        if tail is not None:
+            f.write(tail)
+        f.flush()
+        os.fsync(f.fileno())
+        tally('bytes_written', path, f.tell())
+    os.replace(tmp_path, path)
+    _fsync_directory(path)
+
+def _durable(method):
+    # Mutations return only once the write-ahead log records they made are on
+    # disk; threads waiting here share fsyncs (see WriteAheadLog.sync).
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.wal.sync()
+    return wrapper
+
+class JsonLinesStorage(Storage):
+    def __init__(self, data_dir, compact_threshold=ENROLLMENT_COMPACT_THRESHOLD):
+        self.data_dir = data_dir
+        self.students_file = os.path.join(data_dir, STUDENTS_FILENAME)
+        self.courses_file = os.path.join(data_dir, COURSES_FILENAME)
+        self.enrollments_file = os.path.join(data_dir, ENROLLMENTS_FILENAME)
+        self.waitlist_file = os.path.join(data_dir, WAITLIST_FILENAME)
+        self.archive_file = os.path.join(data_dir, ARCHIVE_FILENAME)
+        self.wal = WriteAheadLog(os.path.join(data_dir, WAL_FILENAME), [
+            self.students_file, self.courses_file, self.enrollments_file,
+            self.waitlist_file, self.archive_file
+        ])
+        self.compact_threshold = compact_threshold
+        self._locks = {
+            'students': FileLock(self.students_file + '.lock'),
+            'courses': FileLock(self.courses_file + '.lock'),
+            'enrollments': FileLock(self.enrollments_file + '.lock')
+        }
+        self._compaction_lock = threading.Lock()
+        self._compaction_thread = None
+        self._appends_since_compaction = 0
+
+        self.store = DataStore()
+        self.store.register('students', lambda: self.students_file, self.load_student_log)
+        self.store.register('courses', lambda: self.courses_file, self.load_course_log)
+        self.store.register('enrollments', lambda: self.enrollments_file,
+                            self.load_enrollment_log)
+        self.store.register('waitlist', lambda: self.waitlist_file, self.load_waitlist_log)
+        self.course_index = CourseSearchIndex()
+        self.store.attach('courses', self.course_index)
+        self.prerequisite_index = PrerequisiteGraph()
+        self.store.attach('courses', self.prerequisite_index)
+        self.roster_index = CourseRosterIndex()
+        self.store.attach('enrollments', self.roster_index)
+        self.report_counters = EnrollmentCounters()
+        self.store.attach('enrollments', self.report_counters)
+        self.timetable_index = TimetableIndex(lambda: self.store.get('courses'),
+                                              lambda: self.store.version('courses'))
+        self.store.attach('enrollments', self.timetable_index)
+
+        # Optional binary snapshots (see snapshot.py) answer point lookups
+        # until something needs the whole table.
+        self._logs = {
+            'students': (self.students_file, 'student_number',
+                         _keyed_record_applier('student_number')),
+            'courses': (self.courses_file, 'course_code', _keyed_record_applier('course_code')),
+            'enrollments': (self.enrollments_file, 'student_number', _apply_enrollment_record)
+        }
+        self.lazy = {table: LazyTable(path, key, apply)
+                     for table, (path, key, apply) in self._logs.items()}
+
+        # Puts back any logged appends a crash kept from the data files.
+        self.wal.recover()
+
+    # Whole tables
+
+    def load_student_log(self, students, offset=0, on_record=None):
+        return _read_log(self.students_file, students, offset,
+                         _keyed_record_applier('student_number'), on_record)
+
+    @timed('storage.load_students')
+    def load_students(self):
+        students = {}
+        self.load_student_log(students)
+        return students
+
+    @timed('storage.save_students')
+    def save_students(self, students):
+        with self._locks['students'], self.wal.replacing():
+            _replace_file(self.students_file,
+                          (json.dumps(student) + '\n' for student in students.values()))
+        self._refresh_snapshot('students')
+
+    def load_course_log(self, courses, offset=0, on_record=None):
+        return _read_log(self.courses_file, courses, offset,
+                         _keyed_record_applier('course_code'), on_record)
+
+    @timed('storage.load_courses')
+    def load_courses(self):
+        courses = {}
+        self.load_course_log(courses)
+        return courses
+
+    @timed('storage.save_courses')
+    def save_courses(self, courses):
+        with self._locks['courses'], self.wal.replacing():
+            _replace_file(self.courses_file,
+                          (json.dumps(course) + '\n' for course in courses.values()))
+        self._refresh_snapshot('courses')
+
+    def load_enrollment_log(self, enrollments, offset=0, on_record=None):
+        return _read_log(self.enrollments_file, enrollments, offset,
+                         _apply_enrollment_record, on_record, _parse_enrollment_line)
+
+    @timed('storage.load_enrollments')
+    def load_enrollments(self):
+        enrollments = {}
+        self.load_enrollment_log(enrollments)
+        return enrollments
+
+    @timed('storage.save_enrollments')
+    def save_enrollments(self, enrollments):
+        lines = (enrollment_json(enrollment) + '\n'
+                 for student_enrollments in enrollments.values()
+                 for enrollment in student_enrollments)
+        with self._locks['enrollments'], self.wal.replacing():
+            _replace_file(self.enrollments_file, lines)
+        self._refresh_snapshot('enrollments')
+
+    @timed('storage.end_term')
+    def end_term(self, archive):
+        with self._locks['enrollments'], self.wal.replacing():
+            enrollments = {}
+            self.load_enrollment_log(enrollments)
+            archive(enrollments)
+            _replace_file(self.enrollments_file, ())
+            _replace_file(self.waitlist_file, ())
+        self._refresh_snapshot('enrollments')
+
+    # Snapshots
+
+    @timed('storage.build_snapshot')
+    def build_snapshot(self, table):
+        # Reads the log through one handle without taking the write lock: a
+        # concurrent append lands past the recorded offset and a concurrent
+        # rewrite changes the inode, so neither can make the snapshot wrong.
+        path, _, apply = self._logs[table]
+        snapshot_path = path + SNAPSHOT_SUFFIX
+        if not os.path.exists(path):
+            return False
+        parse = _parse_enrollment_line if table == 'enrollments' else _parse_log_line
+        records = {}
+        with open(path, 'rb') as f:
+            ino = os.fstat(f.fileno()).st_ino
+            offset = _read_log_file(f, records, 0, apply, parse=parse)
+            digest = log_digest(f, offset)
+        if table == 'enrollments':
+            built = write_enrollment_snapshot(snapshot_path, records, ino, offset, digest)
+        else:
+            write_keyed_snapshot(snapshot_path, records, ino, offset, digest)
+            built = True
+        if not built and os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+        return built
+
+    def build_snapshots(self):
+        return {table: self.build_snapshot(table) for table in self._logs}
+
+    def remove_snapshots(self):
+        removed = []
+        for table, (path, _, _) in self._logs.items():
+            self.lazy[table].close()
+            if os.path.exists(path + SNAPSHOT_SUFFIX):
+                os.remove(path + SNAPSHOT_SUFFIX)
+                removed.append(table)
+        return removed
+
+    def _refresh_snapshot(self, table):
+        # Keeps an existing snapshot in step after the log is rewritten.
+        if os.path.exists(self._logs[table][0] + SNAPSHOT_SUFFIX):
+            self.build_snapshot(table)
+
+    def _lookup(self, table, key, default=None):
+        if not self.store.is_loaded(table):
+            value = self.lazy[table].get(key)
+            if value is not LazyTable.MISSING:
+                return default if value is None else value
+        return self.store.get(table).get(key, default)
+
+    # Point operations, served from the in-memory store
+
+    def get_student(self, student_number):
+        return self._lookup('students', student_number)
+
+    def get_course(self, course_code):
+        return self._lookup('courses', course_code)
+
+    def list_courses(self):
+        return self.store.get('courses')
+
+    def course_count(self):
+        return len(self.store.get('courses'))
+
+    @timed('storage.put_course')
+    @_durable
+    def put_course(self, course, expected=ANY):
+        code = course['course_code']
+        with self._locks['courses']:
+            with self.store.lock:
+                _check_expected(code, self.store.get('courses').get(code), expected)
+            self.wal.commit([(self.courses_file, [json.dumps(course) + '\n'])])
+
+    @timed('storage.delete_course')
+    @_durable
+    def delete_course(self, course_code, expected=ANY, archive=False):
+        with self._locks['courses'], self._locks['enrollments'], self._locks['students']:
+            self.wal.catch_up()
+            with self.store.lock:
+                courses = self.store.get('courses')
+                _check_expected(course_code, courses.get(course_code), expected)
+                if course_code not in courses:
+                    return None
+                # A duplicate row counts and is archived once, as on SQLite.
+                enrollments = {}
+                for e in self._course_enrollments(course_code):
+                    enrollments.setdefault(e['student_number'], e)
+                queue = list(self.store.get('waitlist').get(course_code, {}).values())
+                dependents, students = self._references(course_code)
+            appends = [
+                (self.courses_file, [_tombstone(course_code=course_code)] + dependents),
+                (self.students_file, students),
+                (self.enrollments_file, [_tombstone(student_number=number, course_code=course_code)
+                                         for number in enrollments]),
+                (self.waitlist_file, [_tombstone(student_number=entry['student_number'],
+                                                 course_code=course_code) for entry in queue])
+            ]
+            if archive:
+                archived_at = _now()
+                appends.append((self.archive_file, [
+                    json.dumps(dict(enrollment_dict(e), archived_at=archived_at)) + '\n'
+                    for e in enrollments.values()
+                ]))
+            self.wal.commit(appends)
+            return {'enrollments': len(enrollments), 'waitlist': len(queue)}
+
+    @timed('storage.rename_course')
+    @_durable
+    def rename_course(self, course_code, new_code, expected=ANY):
+        with self._locks['courses'], self._locks['enrollments'], self._locks['students']:
+            self.wal.catch_up()
+            with self.store.lock:
+                courses = self.store.get('courses')
+                current = courses.get(course_code)
+                _check_expected(course_code, current, expected)
+                if current is None:
+                    return None
+                if new_code in courses:
+                    raise ConflictError(f"Course {new_code} already exists")
+                enrollments = self._course_enrollments(course_code)
+                queue = list(self.store.get('waitlist').get(course_code, {}).values())
+                # Rows the new code already has (orphans of an earlier
+                # course) win; the old code's duplicates are dropped.
+                kept = {e['student_number'] for e in enrollments
+                        if self.roster_index.is_enrolled(e['student_number'], new_code)}
+                dependents, students = self._references(course_code, new_code)
+            enrollment_lines = []
+            moved = set()
+            for e in enrollments:
+                number = e['student_number']
+                if number in moved or number in kept:
+                    continue
+                moved.add(number)
+                enrollment_lines.append(_tombstone(student_number=number, course_code=course_code))
+                enrollment_lines.append(
+                    json.dumps(dict(enrollment_dict(e), course_code=new_code)) + '\n')
+            enrollment_lines.extend(_tombstone(student_number=number, course_code=course_code)
+                                    for number in kept)
+            waitlist_lines = [_tombstone(student_number=entry['student_number'], course_code=course_code)
+                              for entry in queue]
+            waitlist_lines.extend(json.dumps(dict(entry, course_code=new_code)) + '\n'
+                                  for entry in queue)
+            self.wal.commit([
+                (self.courses_file, [_tombstone(course_code=course_code),
+                                     json.dumps(dict(current, course_code=new_code)) + '\n']
+                 + dependents),
+                (self.students_file, students),
+                (self.enrollments_file, enrollment_lines),
+                (self.waitlist_file, waitlist_lines)
+            ])
+            return {'enrollments': len(moved), 'waitlist': len(queue)}
+
+    def _references(self, course_code, new_code=None):
+        # Lines rewriting the courses that require course_code and the
+        # students who completed it, for a rename (to new_code) or a delete
+        # to commit along with it. Called under the store lock.
+        courses = self.store.get('courses')
+        dependents = [_recode(courses[code], 'prerequisites', course_code, new_code)
+                      for code in self.prerequisite_index.required_by(course_code)
+                      if code in courses]
+        students = [_recode(student, 'completed_courses', course_code, new_code)
+                    for student in self.store.get('students').values()]
+        return ([json.dumps(course) + '\n' for course in dependents if course],
+                [json.dumps(student) + '\n' for student in students if student])
+
+    def _course_enrollments(self, course_code):
+        # Found through the roster index, so the cost follows the course's
+        # headcount rather than the size of the enrollment log.
+        enrollments = self.store.get('enrollments')
+        return [e for number in self.roster_index.roster(course_code)
+                for e in enrollments.get(number, ()) if e['course_code'] == course_code]
+
+    def archived_enrollments(self, course_code=None):
+        if not os.path.exists(self.archive_file):
+            return []
+        with open(self.archive_file, 'rb') as f:
+            records = (_parse_log_line(raw.decode()) for raw in f)
+            return [e for e in records if e and course_code in (None, e['course_code'])]
+
+    @timed('storage.save_archived_enrollments')
+    def save_archived_enrollments(self, archived):
+        with self._locks['enrollments'], self.wal.replacing():
+            _replace_file(self.archive_file, (json.dumps(e) + '\n' for e in archived))
+
+    def iter_students(self):
+        return iter(list(self.store.get('students').values()))
+
+    def iter_courses(self):
+        return iter(list(self.store.get('courses').values()))
+
+    def iter_enrollments(self):
+        for student_enrollments in list(self.store.get('enrollments').values()):
+            yield from list(student_enrollments)
+
+    @timed('storage.put_students')
+    @_durable
+    def put_students(self, students):
+        with self._locks['students']:
+            self.wal.commit([(self.students_file,
+                              (json.dumps(student) + '\n' for student in students))])
+
+    @timed('storage.put_courses')
+    @_durable
+    def put_courses(self, courses):
+        with self._locks['courses']:
+            self.wal.commit([(self.courses_file,
+                              (json.dumps(course) + '\n' for course in courses))])
+
+    @timed('storage.search_courses')
+    def search_courses(self, keyword):
+        with self.store.lock:
+            courses = self.store.get('courses')
+            return [courses[code] for code in self.course_index.search(keyword)]
+
+    @timed('storage.rank_courses')
+    def rank_courses(self, query, limit, offset=0):
+        with self.store.lock:
+            courses = self.store.get('courses')
+            return [courses[code] for code in self.course_index.rank(query, limit, offset)]
+
+    def iter_sorted_courses(self, after=None, department=None, units=None):
+        while True:
+            with self.store.lock:
+                courses = self.store.get('courses')
+                codes = self.course_index.sorted_codes(after, department, COURSE_SCAN_CHUNK)
+                chunk = [courses[code] for code in codes]
+            if not chunk:
+                return
+            for course in chunk:
+                if units is None or str(course['units']) == str(units):
+                    yield course
+            after = codes[-1]
+
+    def student_enrollments(self, student_number):
+        return self._lookup('enrollments', student_number, [])
+
+    def course_roster(self, course_code):
+        with self.store.lock:
+            self.store.get('enrollments')
+            return self.roster_index.roster(course_code)
+
+    def course_headcount(self, course_code):
+        with self.store.lock:
+            self.store.get('enrollments')
+            return self.roster_index.headcount(course_code)
+
+    def course_headcounts(self):
+        with self.store.lock:
+            self.store.get('enrollments')
+            return self.roster_index.headcounts()
+
+    @timed('storage.enrollment_counts')
+    def enrollment_counts(self, recompute=False):
+        with self.store.lock:
+            enrollments = self.store.get('enrollments')
+            if recompute:
+                return EnrollmentColumns.from_table(enrollments).counts()
+            return self.report_counters.counts()
+
+    @timed('storage.student_unit_totals')
+    def student_unit_totals(self):
+        with self.store.lock:
+            columns = EnrollmentColumns.from_table(self.store.get('enrollments'))
+            return columns.unit_totals(self.store.get('courses'))
+
+    def prerequisite_graph(self):
+        with self.store.lock:
+            self.store.get('courses')
+            return self.prerequisite_index
+
+    def student_timetable(self, student_number):
+        with self.store.lock:
+            self.store.get('enrollments')
+            return self.timetable_index.timetable(student_number)
+
+    # Append-only enrollment log
+
+    def _append_enrollment_lines(self, lines, waitlist_lines=()):
+        with self._locks['enrollments']:
+            self.wal.commit([(self.enrollments_file, lines),
+                             (self.waitlist_file, waitlist_lines)])
+            self._appends_since_compaction += len(lines)
+            due = self._appends_since_compaction >= self.compact_threshold
+            if due:
+                self._appends_since_compaction = 0
+        if due:
+            self.schedule_compaction()
+
+    @timed('storage.enroll')
+    @_durable
+    def enroll(self, enrollment):
+        with self._locks['enrollments']:
+            course_code = enrollment['course_code']
+            existing = self.student_enrollments(enrollment['student_number'])
+            if any(e['course_code'] == course_code for e in existing):
+                return False
+            self._append_enrollment_lines([json.dumps(enrollment) + '\n'])
+            return True
+
+    @timed('storage.append_enrollment')
+    @_durable
+    def append_enrollment(self, enrollment):
+        self._append_enrollment_lines([json.dumps(enrollment) + '\n'])
+        return True
+
+    @timed('storage.append_enrollments')
+    @_durable
+    def append_enrollments(self, enrollments):
+        self._append_enrollment_lines([json.dumps(e) + '\n' for e in enrollments])
+
+    @timed('storage.remove_enrollment')
+    @_durable
+    def remove_enrollment(self, student_number, course_code):
+        self._append_enrollment_lines([json.dumps({
+            'student_number': student_number,
+            'course_code': course_code,
+            'deleted': True
+        }) + '\n'])
+
+    # Seats and waitlists. waitlist.txt is only written while holding the
+    # enrollments lock, so each seat decision and the records it produces
+    # form one critical section across threads and processes.
+
+    def load_waitlist_log(self, waitlist, offset=0, on_record=None):
+        return _read_log(self.waitlist_file, waitlist, offset, _apply_waitlist_record, on_record)
+
+    def waitlist(self, course_code):
+        with self.store.lock:
+            return list(self.store.get('waitlist').get(course_code, {}).values())
+
+    def load_waitlists(self):
+        waitlist = {}
+        self.load_waitlist_log(waitlist)
+        return {code: list(queue.values()) for code, queue in waitlist.items()}
+
+    @timed('storage.save_waitlists')
+    def save_waitlists(self, waitlists):
+        with self._locks['enrollments'], self.wal.replacing():
+            _replace_file(self.waitlist_file, (json.dumps(entry) + '\n'
+                                               for queue in waitlists.values() for entry in queue))
+
+    def student_waitlist(self, student_number):
+        with self.store.lock:
+            return [queue[student_number] for queue in self.store.get('waitlist').values()
+                    if student_number in queue]
+
+    def waitlist_position(self, student_number, course_code):
+        with self.store.lock:
+            queue = self.store.get('waitlist').get(course_code, {})
+            return list(queue).index(student_number) + 1 if student_number in queue else None
+
+    def _student_state(self, student_number, course_codes):
+        with self.store.lock:
+            enrollments = self.store.get('enrollments')
+            waitlist = self.store.get('waitlist')
+            courses = self.store.get('courses')
+            enrolled = {e['course_code'] for e in enrollments.get(student_number, [])}
+            waitlisted = {code for code, queue in waitlist.items() if student_number in queue}
+            seats = {}
+            for code in course_codes:
+                left = _seats_left(courses.get(code), self.roster_index.headcount(code))
+                seats[code] = 0 if waitlist.get(code) else left
+            return enrolled, waitlisted, seats
+
+    @timed('storage.request_seat')
+    @_durable
+    def request_seat(self, enrollment, validate=None):
+        student_number = enrollment['student_number']
+        course_code = enrollment['course_code']
+        with self._locks['enrollments']:
+            self._promote(course_code)
+            enrolled, waitlisted, seats = self._student_state(student_number, [course_code])
+            if course_code in enrolled:
+                return ALREADY_ENROLLED
+            if course_code in waitlisted:
+                return ALREADY_WAITLISTED
+            if validate is not None:
+                validate(enrolled, waitlisted, seats)
+            if seats[course_code] is None or seats[course_code] > 0:
+                self._append_enrollment_lines([json.dumps(enrollment) + '\n'])
+                return ENROLLED
+            self.wal.commit([(self.waitlist_file, [json.dumps({
+                'student_number': student_number,
+                'course_code': course_code,
+                'requested_at': enrollment['enrollment_date']
+            }) + '\n'])])
+            return WAITLISTED
+
+    @timed('storage.enroll_batch')
+    @_durable
+    def enroll_batch(self, enrollments, validate=None):
+        if not enrollments:
+            return
+        codes = [e['course_code'] for e in enrollments]
+        with self._locks['enrollments']:
+            for code in codes:
+                self._promote(code)
+            state = self._student_state(enrollments[0]['student_number'], codes)
+            if validate is not None:
+                validate(*state)
+            _check_batch(enrollments, *state)
+            self._append_enrollment_lines([json.dumps(e) + '\n' for e in enrollments])
+
+    @timed('storage.drop_enrollment')
+    @_durable
+    def drop_enrollment(self, student_number, course_code):
+        tombstone = json.dumps({
+            'student_number': student_number,
+            'course_code': course_code,
+            'deleted': True
+        }) + '\n'
+        with self._locks['enrollments']:
+            enrolled, waitlisted, _ = self._student_state(student_number, ())
+            if course_code in enrolled:
+                self._append_enrollment_lines([tombstone])
+            elif course_code in waitlisted:
+                self.wal.commit([(self.waitlist_file, [tombstone])])
+            else:
+                return None
+            return self._promote(course_code)
+
+    @timed('storage.promote_waitlist')
+    @_durable
+    def promote_waitlist(self, course_code):
+        with self._locks['enrollments']:
+            return self._promote(course_code)
+
+    def _promote(self, course_code):
+        # Caller holds the enrollments lock. The enrollments and the retired
+        # waitlist entries are one log record; entries left for enrolled
+        # students by older versions are dropped here too.
+        with self.store.lock:
+            self.store.get('enrollments')
+            queue = self.store.get('waitlist').get(course_code)
+            seats = _seats_left(self.store.get('courses').get(course_code),
+                                self.roster_index.headcount(course_code))
+            if not queue or (seats is not None and seats <= 0):
+                return []
+            queue = list(queue.values())
+            enrolled = {entry['student_number'] for entry in queue
+                        if self.roster_index.is_enrolled(entry['student_number'], course_code)}
+        promoted = []
+        enrollment_lines = []
+        waitlist_lines = []
+        for entry in queue:
+            student_number = entry['student_number']
+            if student_number not in enrolled:
+                if seats is not None and len(promoted) >= seats:
+                    break
+                promoted.append(student_number)
+                enrollment_lines.append(json.dumps({
+                    'student_number': student_number,
+                    'course_code': course_code,
+                    'enrollment_date': _now()
+                }) + '\n')
+            waitlist_lines.append(json.dumps({
+                'student_number': student_number,
+                'course_code': course_code,
+                'deleted': True
+            }) + '\n')
+        self._append_enrollment_lines(enrollment_lines, waitlist_lines)
+        return promoted
+
+    @timed('storage.compact_enrollments')
+    def compact_enrollments(self):
+        if not os.path.exists(self.enrollments_file):
+            return False
+        # Fold everything up to the current end of the log without holding the
+        # lock, then copy across whatever was appended meanwhile before swapping.
+        folded = {}
+        consumed = 0
+        with open(self.enrollments_file, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            for raw in f:
+                if consumed + len(raw) > stat.st_size or not raw.endswith(b'\n'):
+                    break
+                consumed += len(raw)
+                data = _parse_log_line(raw.decode())
+                if not data:
+                    continue
+                key = (data['student_number'], data['course_code'])
+                if data.get('deleted'):
+                    folded.pop(key, None)
+                elif key not in folded:
+                    folded[key] = data
+        lines = (json.dumps(data) + '\n' for data in folded.values())
+        with self._locks['enrollments'], self.wal.replacing():
+            if os.stat(self.enrollments_file).st_ino != stat.st_ino:
+                return False
+            with open(self.enrollments_file, 'rb') as f:
+                f.seek(consumed)
+                tail = f.read().decode()
+            _replace_file(self.enrollments_file, lines, tail)
+            if os.path.exists(self.waitlist_file):
+                # Waitlists stay short, so they are folded under the lock.
+                waitlist = {}
+                self.load_waitlist_log(waitlist)
+                _replace_file(self.waitlist_file, (json.dumps(entry) + '\n'
+                                                   for queue in waitlist.values()
+                                                   for entry in queue.values()))
+        self._refresh_snapshot('enrollments')
+        return True
+
+    @timed('storage.check_enrollments')
+    def check_enrollments(self, repair=False):
+        # Streams the enrollment log through the integrity scanner (see
+        # integrity.py) under the write lock. With repair, a log with
+        # problems is replaced by the lines that passed.
+        with self._locks['enrollments']:
+            self.wal.catch_up()
+            students = log_keys(self.students_file, 'student_number')
+            courses = log_keys(self.courses_file, 'course_code')
+            if not repair:
+                return scan_enrollments(self.enrollments_file, students, courses)
+            tmp_path = self.enrollments_file + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                report = scan_enrollments(self.enrollments_file, students, courses, f)
+                f.flush()
+                os.fsync(f.fileno())
+            if report.clean:
+                os.remove(tmp_path)
+                return report
+            with self.wal.replacing():
+                os.replace(tmp_path, self.enrollments_file)
+            _fsync_directory(self.enrollments_file)
+        self._refresh_snapshot('enrollments')
+        return report
+
+    def schedule_compaction(self):
+        with self._compaction_lock:
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return self._compaction_thread
+            self._compaction_thread = threading.Thread(target=self.compact_enrollments, daemon=True)
+            self._compaction_thread.start()
+            return self._compaction_thread
+
+    def close(self):
+        self.wal.close()
+
+# =========================
+# SQLite Database
+# =========================
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    student_number TEXT PRIMARY KEY,
+    email TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS courses (
+    course_code TEXT PRIMARY KEY,
+    course_name TEXT NOT NULL,
+    department TEXT NOT NULL,
+    units INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS enrollments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    student_number TEXT NOT NULL,
+    course_code TEXT NOT NULL,
+    enrollment_date TEXT NOT NULL,
+    UNIQUE (student_number, course_code)
+);
+CREATE INDEX IF NOT EXISTS courses_by_department ON courses (department COLLATE NOCASE, course_code);
+CREATE INDEX IF NOT EXISTS enrollments_by_course ON enrollments (course_code);
+CREATE TABLE IF NOT EXISTS waitlist (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    student_number TEXT NOT NULL,
+    course_code TEXT NOT NULL,
+    requested_at TEXT NOT NULL,
+    UNIQUE (student_number, course_code)
+);
+CREATE INDEX IF NOT EXISTS waitlist_by_course ON waitlist (course_code, id);
+CREATE TABLE IF NOT EXISTS archived_enrollments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    student_number TEXT NOT NULL,
+    course_code TEXT NOT NULL,
+    enrollment_date TEXT NOT NULL,
+    archived_at TEXT NOT NULL
+);
+-- Bumped by every write to courses, from any process, so a cache built
+-- from the catalog can tell when it is stale.
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS courses_version_insert AFTER INSERT ON courses BEGIN
+    INSERT INTO catalog_version (id, version) VALUES (0, 1)
+    ON CONFLICT (id) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS courses_version_delete AFTER DELETE ON courses BEGIN
+    INSERT INTO catalog_version (id, version) VALUES (0, 1)
+    ON CONFLICT (id) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS courses_version_update AFTER UPDATE ON courses BEGIN
+    INSERT INTO catalog_version (id, version) VALUES (0, 1)
+    ON CONFLICT (id) DO UPDATE SET version = version + 1;
+END;
+"""
+
+# Trigram full-text index over the searchable course columns, kept in step
+# with the courses table by triggers. Needs SQLite 3.34+ built with FTS5.
+SQLITE_SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS course_search USING fts5(
+    course_code, course_name, department,
+    content='courses', content_rowid='rowid', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS courses_search_insert AFTER INSERT ON courses BEGIN
+    INSERT INTO course_search (rowid, course_code, course_name, department)
+    VALUES (new.rowid, new.course_code, new.course_name, new.department);
+END;
+CREATE TRIGGER IF NOT EXISTS courses_search_delete AFTER DELETE ON courses BEGIN
+    INSERT INTO course_search (course_search, rowid, course_code, course_name, department)
+    VALUES ('delete', old.rowid, old.course_code, old.course_name, old.department);
+END;
+CREATE TRIGGER IF NOT EXISTS courses_search_update AFTER UPDATE ON courses BEGIN
+    INSERT INTO course_search (course_search, rowid, course_code, course_name, department)
+    VALUES ('delete', old.rowid, old.course_code, old.course_name, old.department);
+    INSERT INTO course_search (rowid, course_code, course_name, department)
+    VALUES (new.rowid, new.course_code, new.course_name, new.department);
+END;
+"""
+
+def _waitlist_row(row):
+    return {
+        'student_number': row[0],
+        'course_code': row[1],
+        'requested_at': row[2]
+    }
+
+def _enrollment_row(row):
+    return compact_enrollment({
+        'student_number': row[0],
+        'course_code': row[1],
+        'enrollment_date': row[2]
+    })
+
+class _ConnectionLease:
+    # Held in a thread-local; when the thread exits and the local is cleared,
+    # the connection goes back to the idle pool for the next request thread
+    # instead of each short-lived thread opening (and warming) a new one.
+
+    def __init__(self, conn, idle):
+        self.conn = conn
+        self.idle = idle
+
+    def __del__(self):
+        if self.conn is not None:
+            self.idle.append(self.conn)
+
+class SQLiteStorage(Storage):
+    def __init__(self, path):
+        self.path = path
+        # Where the rest of the partition (terms, job queue) lives.
+        self.data_dir = os.path.dirname(path)
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._idle = []
+        self._full_text = None
+        self._graph_lock = threading.Lock()
+        self._graph = None
+
+    def _connection(self):
+        lease = getattr(self._local, 'lease', None)
+        if lease is None:
+            with self._schema_lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._connect()
+            lease = self._local.lease = _ConnectionLease(conn, self._idle)
+        return lease.conn
+
+    def _connect(self):
+        # check_same_thread is off because a pooled connection moves to a new
+        # thread once its previous thread has exited; it is never shared.
+        conn = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with self._schema_lock:
+            conn.executescript(SQLITE_SCHEMA)
+            if self._full_text is None:
+                try:
+                    conn.executescript(SQLITE_SEARCH_SCHEMA)
+                    self._full_text = True
+                except sqlite3.OperationalError:
+                    self._full_text = False
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        # Writers in this process queue on a lock in arrival order instead of
+        # polling SQLite's busy handler, which starves some of them when many
+        # threads contend for the same hot course.
+        conn = self._connection()
+        if not self._write_lock.acquire(timeout=LOCK_TIMEOUT):
+            raise LockTimeout(f"Timed out waiting for {self.path}")
+        try:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as e:
+                raise LockTimeout(f"Timed out waiting for {self.path}: {e}") from e
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            self._write_lock.release()
+
+    # Whole tables
+
+    @timed('storage.load_students')
+    def load_students(self):
+        rows = self._connection().execute("SELECT data FROM students ORDER BY rowid")
+        students = {}
+        for (data,) in rows:
+            student = json.loads(data)
+            students[student['student_number']] = student
+        return students
+
+    @timed('storage.save_students')
+    def save_students(self, students):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM students")
+            conn.executemany(
+                "INSERT INTO students (student_number, email, data) VALUES (?, ?, ?)",
+                ((s['student_number'], s['email'], json.dumps(s)) for s in students.values()))
+
+    @timed('storage.load_courses')
+    def load_courses(self):
+        rows = self._connection().execute("SELECT data FROM courses ORDER BY rowid")
+        courses = {}
+        for (data,) in rows:
+            course = json.loads(data)
+            courses[course['course_code']] = course
+        return courses
+
+    @timed('storage.save_courses')
+    def save_courses(self, courses):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM courses")
+            conn.executemany(
+                "INSERT INTO courses (course_code, course_name, department, units, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                ((c['course_code'], c['course_name'], c['department'], c['units'], json.dumps(c))
+                 for c in courses.values()))
+
+    @timed('storage.load_enrollments')
+    def load_enrollments(self):
+        rows = self._connection().execute(
+            "SELECT student_number, course_code, enrollment_date FROM enrollments ORDER BY id")
+        enrollments = {}
+        for row in rows:
+            enrollment = _enrollment_row(row)
+            enrollments.setdefault(enrollment['student_number'], []).append(enrollment)
+        return enrollments
+
+    @timed('storage.save_enrollments')
+    def save_enrollments(self, enrollments):
+        # Duplicate (student_number, course_code) rows collapse to the first.
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM enrollments")
+            conn.executemany(
+                "INSERT OR IGNORE INTO enrollments (student_number, course_code, enrollment_date) "
+                "VALUES (?, ?, ?)",
+                ((e['student_number'], e['course_code'], e['enrollment_date'])
+                 for student_enrollments in enrollments.values()
+                 for e in student_enrollments))
+
+    @timed('storage.end_term')
+    def end_term(self, archive):
+        with self._transaction() as conn:
+            enrollments = {}
+            for row in conn.execute(
+                    "SELECT student_number, course_code, enrollment_date FROM enrollments ORDER BY id"):
+                enrollment = _enrollment_row(row)
+                enrollments.setdefault(enrollment['student_number'], []).append(enrollment)
+            archive(enrollments)
+            conn.execute("DELETE FROM enrollments")
+            conn.execute("DELETE FROM waitlist")
+
+    # Point operations
+
+    def get_student(self, student_number):
+        row = self._connection().execute(
+            "SELECT data FROM students WHERE student_number = ?", (student_number,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_course(self, course_code):
+        return self._current_course(self._connection(), course_code)
+
+    def list_courses(self):
+        return self.load_courses()
+
+    def course_count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM courses").fetchone()[0]
+
+    def _current_course(self, conn, course_code):
+        row = conn.execute(
+            "SELECT data FROM courses WHERE course_code = ?", (course_code,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @timed('storage.put_course')
+    def put_course(self, course, expected=ANY):
+        with self._transaction() as conn:
+            if expected is not ANY:
+                _check_expected(course['course_code'],
+                                self._current_course(conn, course['course_code']), expected)
+            conn.execute(
+                "INSERT INTO courses (course_code, course_name, department, units, data) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (course_code) DO UPDATE SET course_name = excluded.course_name, "
+                "department = excluded.department, units = excluded.units, data = excluded.data",
+                (course['course_code'], course['course_name'], course['department'],
+                 course['units'], json.dumps(course)))
+
+    @timed('storage.delete_course')
+    def delete_course(self, course_code, expected=ANY, archive=False):
+        with self._transaction() as conn:
+            if expected is not ANY:
+                _check_expected(course_code, self._current_course(conn, course_code), expected)
+            cursor = conn.execute("DELETE FROM courses WHERE course_code = ?", (course_code,))
+            if not cursor.rowcount:
+                return None
+            self._recode_references(conn, course_code)
+            if archive:
+                conn.execute(
+                    "INSERT INTO archived_enrollments "
+                    "(student_number, course_code, enrollment_date, archived_at) "
+                    "SELECT student_number, course_code, enrollment_date, ? FROM enrollments "
+                    "WHERE course_code = ? ORDER BY id", (_now(), course_code))
+            return {
+                table: conn.execute(f"DELETE FROM {table} WHERE course_code = ?",
+                                    (course_code,)).rowcount
+                for table in ('enrollments', 'waitlist')
+            }
+
+    @timed('storage.rename_course')
+    def rename_course(self, course_code, new_code, expected=ANY):
+        with self._transaction() as conn:
+            current = self._current_course(conn, course_code)
+            if expected is not ANY:
+                _check_expected(course_code, current, expected)
+            if current is None:
+                return None
+            if self._current_course(conn, new_code) is not None:
+                raise ConflictError(f"Course {new_code} already exists")
+            conn.execute("UPDATE courses SET course_code = ?, data = ? WHERE course_code = ?",
+                         (new_code, json.dumps(dict(current, course_code=new_code)), course_code))
+            self._recode_references(conn, course_code, new_code)
+            moved = {}
+            for table in ('enrollments', 'waitlist'):
+                # Rows the new code already has (orphans of an earlier
+                # course) win; the old code's duplicates are dropped.
+                moved[table] = conn.execute(
+                    f"UPDATE OR IGNORE {table} SET course_code = ? WHERE course_code = ?",
+                    (new_code, course_code)).rowcount
+                conn.execute(f"DELETE FROM {table} WHERE course_code = ?", (course_code,))
+            return moved
+
+    def _recode_references(self, conn, course_code, new_code=None):
+        # Rewrites the courses that require course_code and the students who
+        # completed it, in the caller's transaction. LIKE narrows the scan to
+        # rows whose JSON mentions the code; _recode checks the field itself.
+        pattern = '%' + json.dumps(course_code) + '%'
+        for table, key, field in (('courses', 'course_code', 'prerequisites'),
+                                  ('students', 'student_number', 'completed_courses')):
+            rows = conn.execute(f"SELECT {key}, data FROM {table} WHERE data LIKE ?",
+                                (pattern,)).fetchall()
+            for row_key, data in rows:
+                record = _recode(json.loads(data), field, course_code, new_code)
+                if record is not None:
+                    conn.execute(f"UPDATE {table} SET data = ? WHERE {key} = ?",
+                                 (json.dumps(record), row_key))
+
+    def archived_enrollments(self, course_code=None):
+        rows = self._connection().execute(
+            "SELECT student_number, course_code, enrollment_date, archived_at "
+            "FROM archived_enrollments WHERE ? IS NULL OR course_code = ? ORDER BY id",
+            (course_code, course_code))
+        return [dict(zip(('student_number', 'course_code', 'enrollment_date', 'archived_at'), row))
+                for row in rows]
+
+    @timed('storage.save_archived_enrollments')
+    def save_archived_enrollments(self, archived):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM archived_enrollments")
+            conn.executemany(
+                "INSERT INTO archived_enrollments "
+                "(student_number, course_code, enrollment_date, archived_at) VALUES (?, ?, ?, ?)",
+                ((e['student_number'], e['course_code'], e['enrollment_date'], e['archived_at'])
+                 for e in archived))
+
+    @timed('storage.search_courses')
+    def search_courses(self, keyword):
+        keyword = keyword.lower()
+        conn = self._connection()
+        if self._full_text and len(keyword) >= 3:
+            rows = conn.execute(
+                "SELECT courses.data FROM course_search "
+                "JOIN courses ON courses.rowid = course_search.rowid "
+                "WHERE course_search MATCH ? ORDER BY courses.rowid",
+                ('"' + keyword.replace('"', '""') + '"',))
+        else:
+            rows = conn.execute("SELECT data FROM courses ORDER BY rowid")
+        # Re-check candidates so results match the plain substring search.
+        results = []
+        for (data,) in rows:
+            course = json.loads(data)
+            if any(keyword in str(course[field]).lower() for field in SEARCH_FIELDS):
+                results.append(course)
+        return results
+
+    @timed('storage.rank_courses')
+    def rank_courses(self, query, limit, offset=0):
+        conn = self._connection()
+        grams = query_trigrams(query)
+        if self._full_text and grams:
+            rows = conn.execute(
+                "SELECT courses.rowid, courses.data FROM course_search "
+                "JOIN courses ON courses.rowid = course_search.rowid "
+                "WHERE course_search MATCH ?",
+                (' OR '.join('"' + gram.replace('"', '""') + '"' for gram in sorted(grams)),))
+        else:
+            rows = conn.execute("SELECT rowid, data FROM courses")
+        courses = {}
+        candidates = []
+        for rowid, data in rows:
+            course = json.loads(data)
+            courses[course['course_code']] = course
+            candidates.append((course['course_code'],
+                               tuple(str(course[field]).lower() for field in SEARCH_FIELDS), rowid))
+        return [courses[code] for code in top_matches(query, candidates, limit, offset)]
+
+    def iter_sorted_courses(self, after=None, department=None, units=None):
+        query = "SELECT course_code, data FROM courses WHERE course_code > ?"
+        filters = []
+        if department is not None:
+            query += " AND department = ? COLLATE NOCASE"
+            filters.append(department)
+        if units is not None:
+            query += " AND units = ?"
+            filters.append(units)
+        query += " ORDER BY course_code LIMIT ?"
+        after = '' if after is None else after
+        while True:
+            rows = self._connection().execute(
+                query, (after, *filters, COURSE_SCAN_CHUNK)).fetchall()
+            if not rows:
+                return
+            for _, data in rows:
+                yield json.loads(data)
+            after = rows[-1][0]
+
+    @timed('storage.put_students')
+    def put_students(self, students):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO students (student_number, email, data) VALUES (?, ?, ?) "
+                "ON CONFLICT (student_number) DO UPDATE SET email = excluded.email, "
+                "data = excluded.data",
+                ((s['student_number'], s['email'], json.dumps(s)) for s in students))
+
+    @timed('storage.put_courses')
+    def put_courses(self, courses):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO courses (course_code, course_name, department, units, data) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (course_code) DO UPDATE SET course_name = excluded.course_name, "
+                "department = excluded.department, units = excluded.units, data = excluded.data",
+                ((c['course_code'], c['course_name'], c['department'], c['units'], json.dumps(c))
+                 for c in courses))
+
+    def iter_students(self):
+        for (data,) in self._connection().execute("SELECT data FROM students ORDER BY rowid"):
+            yield json.loads(data)
+
+    def iter_courses(self):
+        for (data,) in self._connection().execute("SELECT data FROM courses ORDER BY rowid"):
+            yield json.loads(data)
+
+    def iter_enrollments(self):
+        rows = self._connection().execute(
+            "SELECT student_number, course_code, enrollment_date FROM enrollments ORDER BY id")
+        for row in rows:
+            yield _enrollment_row(row)
+
+    def student_enrollments(self, student_number):
+        rows = self._connection().execute(
+            "SELECT student_number, course_code, enrollment_date FROM enrollments "
+            "WHERE student_number = ? ORDER BY id", (student_number,))
+        return [_enrollment_row(row) for row in rows]
+
+    @timed('storage.enroll')
+    def enroll(self, enrollment):
+        return self.append_enrollment(enrollment)
+
+    @timed('storage.append_enrollment')
+    def append_enrollment(self, enrollment):
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO enrollments (student_number, course_code, enrollment_date) "
+                "VALUES (?, ?, ?)",
+                (enrollment['student_number'], enrollment['course_code'],
+                 enrollment['enrollment_date']))
+            return cursor.rowcount > 0
+
+    @timed('storage.append_enrollments')
+    def append_enrollments(self, enrollments):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO enrollments (student_number, course_code, enrollment_date) "
+                "VALUES (?, ?, ?)",
+                ((e['student_number'], e['course_code'], e['enrollment_date']) for e in enrollments))
+
+    @timed('storage.remove_enrollment')
+    def remove_enrollment(self, student_number, course_code):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM enrollments WHERE student_number = ? AND course_code = ?",
+                         (student_number, course_code))
+
+    def course_roster(self, course_code):
+        rows = self._connection().execute(
+            "SELECT student_number FROM enrollments WHERE course_code = ? ORDER BY student_number",
+            (course_code,))
+        return [row[0] for row in rows]
+
+    def course_headcount(self, course_code):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM enrollments WHERE course_code = ?", (course_code,)).fetchone()[0]
+
+    def course_headcounts(self):
+        rows = self._connection().execute(
+            "SELECT course_code, COUNT(*) FROM enrollments GROUP BY course_code")
+        return dict(rows.fetchall())
+
+    @timed('storage.enrollment_counts')
+    def enrollment_counts(self, recompute=False):
+        # Aggregated by SQLite on every call, so there is nothing to recompute.
+        conn = self._connection()
+        days = Counter()
+        for day, count in conn.execute(
+                "SELECT substr(enrollment_date, 1, 10), COUNT(*) FROM enrollments GROUP BY 1"):
+            seconds = encode_date(f"{day} 00:00:00")
+            days[-1 if seconds is None else seconds // SECONDS_PER_DAY] += count
+        return {
+            'courses': Counter(dict(conn.execute(
+                "SELECT course_code, COUNT(*) FROM enrollments GROUP BY course_code"))),
+            'students': Counter(dict(conn.execute(
+                "SELECT student_number, COUNT(*) FROM enrollments GROUP BY student_number"))),
+            'days': days
+        }
+
+    @timed('storage.student_unit_totals')
+    def student_unit_totals(self):
+        return Counter(dict(self._connection().execute(
+            "SELECT enrollments.student_number, SUM(courses.units) FROM enrollments "
+            "JOIN courses ON courses.course_code = enrollments.course_code "
+            "GROUP BY enrollments.student_number")))
+
+    def prerequisite_graph(self):
+        # Rebuilt only when catalog_version shows a course was written since,
+        # by this process or another; enrollments read the cached graph.
+        version = self._connection().execute(
+            "SELECT COALESCE((SELECT version FROM catalog_version), 0)").fetchone()[0]
+        with self._graph_lock:
+            if self._graph is None or self._graph[0] != version:
+                graph = PrerequisiteGraph()
+                graph.rebuild(self.list_courses())
+                self._graph = (version, graph)
+            return self._graph[1]
+
+    # Seats and waitlists; BEGIN IMMEDIATE serializes every seat decision.
+
+    def waitlist(self, course_code):
+        rows = self._connection().execute(
+            "SELECT student_number, course_code, requested_at FROM waitlist "
+            "WHERE course_code = ? ORDER BY id", (course_code,))
+        return [_waitlist_row(row) for row in rows]
+
+    def load_waitlists(self):
+        rows = self._connection().execute(
+            "SELECT student_number, course_code, requested_at FROM waitlist ORDER BY id")
+        waitlists = {}
+        for row in rows:
+            entry = _waitlist_row(row)
+            waitlists.setdefault(entry['course_code'], []).append(entry)
+        return waitlists
+
+    @timed('storage.save_waitlists')
+    def save_waitlists(self, waitlists):
+        # Inserted queue by queue, so ids keep each course's request order.
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM waitlist")
+            conn.executemany(
+                "INSERT OR IGNORE INTO waitlist (student_number, course_code, requested_at) "
+                "VALUES (?, ?, ?)",
+                ((e['student_number'], e['course_code'], e['requested_at'])
+                 for queue in waitlists.values() for e in queue))
+
+    def student_waitlist(self, student_number):
+        rows = self._connection().execute(
+            "SELECT student_number, course_code, requested_at FROM waitlist "
+            "WHERE student_number = ? ORDER BY id", (student_number,))
+        return [_waitlist_row(row) for row in rows]
+
+    def waitlist_position(self, student_number, course_code):
+        row = self._connection().execute(
+            "SELECT COUNT(*) FROM waitlist WHERE course_code = ? AND id <= "
+            "(SELECT id FROM waitlist WHERE student_number = ? AND course_code = ?)",
+            (course_code, student_number, course_code)).fetchone()
+        return row[0] or None
+
+    def _seats_left(self, conn, course_code):
+        headcount = conn.execute(
+            "SELECT COUNT(*) FROM enrollments WHERE course_code = ?", (course_code,)).fetchone()[0]
+        return _seats_left(self._current_course(conn, course_code), headcount)
+
+    def _student_state(self, conn, student_number, course_codes):
+        enrolled = {row[0] for row in conn.execute(
+            "SELECT course_code FROM enrollments WHERE student_number = ?", (student_number,))}
+        waitlisted = {row[0] for row in conn.execute(
+            "SELECT course_code FROM waitlist WHERE student_number = ?", (student_number,))}
+        seats = {}
+        for code in course_codes:
+            queued = conn.execute("SELECT 1 FROM waitlist WHERE course_code = ? LIMIT 1",
+                                  (code,)).fetchone() is not None
+            seats[code] = 0 if queued else self._seats_left(conn, code)
+        return enrolled, waitlisted, seats
+
+    @timed('storage.request_seat')
+    def request_seat(self, enrollment, validate=None):
+        student_number = enrollment['student_number']
+        course_code = enrollment['course_code']
+        with self._transaction() as conn:
+            self._promote(conn, course_code)
+            enrolled, waitlisted, seats = self._student_state(conn, student_number, [course_code])
+            if course_code in enrolled:
+                return ALREADY_ENROLLED
+            if course_code in waitlisted:
+                return ALREADY_WAITLISTED
+            if validate is not None:
+                validate(enrolled, waitlisted, seats)
+            if seats[course_code] is None or seats[course_code] > 0:
+                conn.execute(
+                    "INSERT INTO enrollments (student_number, course_code, enrollment_date) "
+                    "VALUES (?, ?, ?)", (student_number, course_code, enrollment['enrollment_date']))
+                return ENROLLED
+            conn.execute(
+                "INSERT INTO waitlist (student_number, course_code, requested_at) VALUES (?, ?, ?)",
+                (student_number, course_code, enrollment['enrollment_date']))
+            return WAITLISTED
+
+    @timed('storage.enroll_batch')
+    def enroll_batch(self, enrollments, validate=None):
+        if not enrollments:
+            return
+        codes = [e['course_code'] for e in enrollments]
+        with self._transaction() as conn:
+            for code in codes:
+                self._promote(conn, code)
+            state = self._student_state(conn, enrollments[0]['student_number'], codes)
+            if validate is not None:
+                validate(*state)
+            _check_batch(enrollments, *state)
+            conn.executemany(
+                "INSERT INTO enrollments (student_number, course_code, enrollment_date) "
+                "VALUES (?, ?, ?)",
+                ((e['student_number'], e['course_code'], e['enrollment_date']) for e in enrollments))
+
+    @timed('storage.drop_enrollment')
+    def drop_enrollment(self, student_number, course_code):
+        with self._transaction() as conn:
+            dropped = 0
+            for table in ('enrollments', 'waitlist'):
+                dropped += conn.execute(
+                    f"DELETE FROM {table} WHERE student_number = ? AND course_code = ?",
+                    (student_number, course_code)).rowcount
+            if not dropped:
+                return None
+            return self._promote(conn, course_code)
+
+    @timed('storage.promote_waitlist')
+    def promote_waitlist(self, course_code):
+        with self._transaction() as conn:
+            return self._promote(conn, course_code)
+
+    def _promote(self, conn, course_code):
+        seats = self._seats_left(conn, course_code)
+        if seats is not None and seats <= 0:
+            return []
+        rows = conn.execute(
+            "SELECT id, student_number FROM waitlist WHERE course_code = ? ORDER BY id LIMIT ?",
+            (course_code, -1 if seats is None else seats)).fetchall()
+        promoted = []
+        for row_id, student_number in rows:
+            if seats is not None and len(promoted) >= seats:
+                break
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO enrollments (student_number, course_code, enrollment_date) "
+                "VALUES (?, ?, ?)", (student_number, course_code, _now()))
+            if cursor.rowcount:
+                promoted.append(student_number)
+            conn.execute("DELETE FROM waitlist WHERE id = ?", (row_id,))
+        return promoted
+
+    @timed('storage.compact_enrollments')
+    def compact_enrollments(self):
+        self._connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return True
+
+    def close(self):
+        lease = getattr(self._local, 'lease', None)
+        if lease is not None:
+            lease.conn.close()
+            lease.conn = None
+            self._local.lease = None
+        with self._schema_lock:
+            idle = self._idle[:]
+            del self._idle[:]
+        for conn in idle:
+            conn.close()
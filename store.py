@@ -0,0 +1,103 @@
+import os
+import threading
+
+# =========================
+# File Signatures
+# =========================
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+# =========================
+# Data Store
+# =========================
+
+class _Table:
+    __slots__ = ('path', 'load_from', 'data', 'signature', 'offset', 'version', 'indexes')
+
+    def __init__(self, path, load_from):
+        self.path = path
+        self.load_from = load_from
+        self.data = None
+        self.signature = None
+        self.offset = 0
+        self.version = 0
+        self.indexes = []
+
+class DataStore:
+    # Keeps each registered table in memory and re-reads its backing file
+    # only when the file's inode, size or mtime changes. Tables are logs:
+    # one that has only grown is extended by reading just the bytes added
+    # since the last load. Attached indexes are rebuilt on reload
+    # and fed each record read from an append-only tail (before it is applied
+    # to the table, so an index can still see the rows it replaces). Writers
+    # only append to or replace the files; the store catches up on the next
+    # get().
+
+    def __init__(self):
+        self._tables = {}
+        self.lock = threading.RLock()
+
+    def register(self, name, path, load_from):
+        # load_from(data, offset, on_record=None) reads the log from offset
+        # into data and returns the offset it stopped at.
+        self._tables[name] = _Table(path, load_from)
+
+    def attach(self, name, index):
+        with self.lock:
+            table = self._tables[name]
+            table.indexes.append(index)
+            if table.data is not None:
+                index.rebuild(table.data)
+
+    def get(self, name):
+        with self.lock:
+            table = self._tables[name]
+            signature = file_signature(table.path())
+            if table.data is not None and signature == table.signature:
+                return table.data
+            grown = (table.data is not None and signature is not None
+                     and table.signature is not None
+                     and signature[0] == table.signature[0]
+                     and signature[1] >= table.offset)
+            if grown:
+                table.offset = table.load_from(table.data, table.offset,
+                                               self._record_listener(table))
+            else:
+                table.data = {}
+                table.offset = table.load_from(table.data, 0)
+            table.signature = signature
+            table.version += 1
+            if not grown:
+                for index in table.indexes:
+                    index.rebuild(table.data)
+            return table.data
+
+    def _record_listener(self, table):
+        if not table.indexes:
+            return None
+        def on_record(record):
+            for index in table.indexes:
+                index.apply(record)
+        return on_record
+
+    def is_loaded(self, name):
+        with self.lock:
+            return self._tables[name].data is not None
+
+    def version(self, name):
+        with self.lock:
+            return self._tables[name].version
+
+    def invalidate(self, name=None):
+        with self.lock:
+            names = [name] if name else list(self._tables)
+            for table_name in names:
+                table = self._tables[table_name]
+                table.data = None
+                table.signature = None
+                table.offset = 0
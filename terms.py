@@ -0,0 +1,294 @@
+import os
+import re
+import json
+import shutil
+import argparse
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from enrollment_records import enrollment_json
+from storage import COURSES_FILENAME, ENROLLMENTS_FILENAME, read_courses, read_enrollments
+
+TERMS_DIRNAME = "terms"
+CAMPUSES_DIRNAME = "campuses"
+TERM_FILENAME = "term.json"
+MANIFEST_FILENAME = "manifest.json"
+# How many archived terms stay loaded; the rest are read again on demand.
+COLD_CACHE_TERMS = 4
+
+_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]*$')
+
+# =========================
+# Partitions
+# =========================
+
+def check_name(kind, name):
+    # Term and campus names become directory names.
+    name = str(name or '').strip()
+    if not _NAME.match(name):
+        raise ValueError(f"{kind} names use letters, digits, '.', '_' and '-', not {name!r}")
+    return name
+
+def partition_dir(root, campus=None):
+    # Each campus is a tenant with a data directory of its own under
+    # <root>/campuses; without a campus the root is used as it always was.
+    if not campus:
+        return root
+    return os.path.join(root, CAMPUSES_DIRNAME, check_name('Campus', campus))
+
+def campuses(root):
+    # The campuses with a partition under root.
+    path = os.path.join(root, CAMPUSES_DIRNAME)
+    if not os.path.isdir(path):
+        return []
+    return sorted(name for name in os.listdir(path)
+                  if _NAME.match(name) and os.path.isdir(os.path.join(path, name)))
+
+def _write_file(path, lines):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        for line in lines:
+            f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+# =========================
+# Term Archive
+# =========================
+
+class TermArchive:
+    # The current term lives in the data directory's own files, the hot
+    # partition every storage operation works on. Rolling over moves its
+    # enrollments to <data_dir>/terms/<term>/, a cold partition that is never
+    # written again, along with the catalog as it stood and a manifest of
+    # the students and courses in it. Cross-term queries check the manifests
+    # first and read only the partitions that can answer them; those read
+    # are kept in a small LRU cache.
+
+    def __init__(self, data_dir, cache_terms=COLD_CACHE_TERMS):
+        self.data_dir = data_dir
+        self.terms_dir = os.path.join(data_dir, TERMS_DIRNAME)
+        self.cache_terms = cache_terms
+        self._manifests = {}
+        self._partitions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def current_term(self):
+        try:
+            with open(os.path.join(self.data_dir, TERM_FILENAME)) as f:
+                return json.load(f).get('term')
+        except FileNotFoundError:
+            return None
+
+    def set_current_term(self, term):
+        term = check_name('Term', term)
+        os.makedirs(self.data_dir, exist_ok=True)
+        _write_file(os.path.join(self.data_dir, TERM_FILENAME), [json.dumps({'term': term}) + '\n'])
+        return term
+
+    def terms(self):
+        # Archived terms, oldest first.
+        if not os.path.isdir(self.terms_dir):
+            return []
+        manifests = [self.manifest(name) for name in os.listdir(self.terms_dir)]
+        return [m['term'] for m in sorted((m for m in manifests if m), key=lambda m: m['archived_at'])]
+
+    def manifest(self, term):
+        # None unless the term has been archived.
+        path = os.path.join(self.terms_dir, term, MANIFEST_FILENAME)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        cached = self._manifests.get(term)
+        if cached is None or cached[0] != mtime:
+            with open(path) as f:
+                manifest = json.load(f)
+            manifest['students'] = set(manifest['students'])
+            manifest['courses'] = set(manifest['courses'])
+            cached = self._manifests[term] = (mtime, manifest)
+        return cached[1]
+
+    def enrollments(self, term):
+        # {student_number: [enrollment]} for an archived term.
+        return self._partition(term)[0]
+
+    def courses(self, term):
+        # The catalog as it stood when the term was archived.
+        return self._partition(term)[1]
+
+    def _partition(self, term):
+        manifest = self.manifest(term)
+        if manifest is None:
+            raise KeyError(term)
+        with self._lock:
+            cached = self._partitions.get(term)
+            if cached is not None and cached[0] == manifest['archived_at']:
+                self._partitions.move_to_end(term)
+                return cached[1:]
+        directory = os.path.join(self.terms_dir, term)
+        enrollments = read_enrollments(os.path.join(directory, ENROLLMENTS_FILENAME))
+        courses = read_courses(os.path.join(directory, COURSES_FILENAME))
+        with self._lock:
+            self._partitions[term] = (manifest['archived_at'], enrollments, courses)
+            self._partitions.move_to_end(term)
+            while len(self._partitions) > self.cache_terms:
+                self._partitions.popitem(last=False)
+        return enrollments, courses
+
+    def _select(self, terms):
+        if terms is None:
+            return self.terms()
+        for term in terms:
+            if self.manifest(term) is None:
+                raise KeyError(term)
+        return list(terms)
+
+    # Cross-term queries
+
+    def student_history(self, student_number, terms=None):
+        # The student's enrollments in each archived term (all of them, or
+        # those named), skipping the terms they had none in.
+        history = []
+        for term in self._select(terms):
+            if student_number not in self.manifest(term)['students']:
+                continue
+            enrollments, courses = self._partition(term)
+            history.append({'term': term, 'courses': [
+                {'course_code': e['course_code'],
+                 'course_name': courses.get(e['course_code'], {}).get('course_name', ''),
+                 'enrollment_date': e['enrollment_date']}
+                for e in enrollments.get(student_number, ())
+            ]})
+        return history
+
+    def course_history(self, course_code, terms=None):
+        # The course as it stood and the students enrolled in it, for each
+        # archived term it had enrollments in.
+        history = []
+        for term in self._select(terms):
+            if course_code not in self.manifest(term)['courses']:
+                continue
+            enrollments, courses = self._partition(term)
+            history.append({
+                'term': term,
+                'course': courses.get(course_code),
+                'students': [student_number for student_number, rows in enrollments.items()
+                             if any(e['course_code'] == course_code for e in rows)]
+            })
+        return history
+
+    # Rollover
+
+    def rollover(self, storage, next_term):
+        # Archives the current term and starts next_term with no enrollments
+        # or waitlists; students and courses carry over. Runs under the
+        # storage's write lock, so no enrollment made meanwhile is lost.
+        term = self.current_term()
+        if term is None:
+            raise ValueError("No current term is set")
+        next_term = check_name('Term', next_term)
+        if next_term == term or self.manifest(next_term) is not None:
+            raise ValueError(f"Term {next_term} already exists")
+        archived = {}
+
+        def archive(enrollments):
+            archived['enrollments'] = self._write_partition(term, enrollments, storage.list_courses())
+            # Switched before the hot files are emptied: after a crash in
+            # between, the new term starts with the old enrollments still in
+            # it rather than the archive being overwritten by an empty term.
+            self.set_current_term(next_term)
+
+        storage.end_term(archive)
+        return {'term': term, 'next_term': next_term, 'enrollments': archived['enrollments']}
+
+    def _write_partition(self, term, enrollments, courses):
+        # The manifest is written last; a directory without one is the
+        # leftover of a crash and is overwritten.
+        directory = os.path.join(self.terms_dir, term)
+        rows = [e for student_enrollments in enrollments.values() for e in student_enrollments]
+        if self.manifest(term) is not None:
+            # Archived before, by a rollover that did not get to switch terms.
+            seen = {(e['student_number'], e['course_code']) for e in rows}
+            rows = [e for student_enrollments in self.enrollments(term).values()
+                    for e in student_enrollments
+                    if (e['student_number'], e['course_code']) not in seen] + rows
+        os.makedirs(directory, exist_ok=True)
+        _write_file(os.path.join(directory, ENROLLMENTS_FILENAME),
+                    (enrollment_json(e) + '\n' for e in rows))
+        _write_file(os.path.join(directory, COURSES_FILENAME),
+                    (json.dumps(course) + '\n' for course in courses.values()))
+        _write_file(os.path.join(directory, MANIFEST_FILENAME), [json.dumps({
+            'term': term,
+            'archived_at': datetime.now().isoformat(),
+            'enrollments': len(rows),
+            'students': sorted({e['student_number'] for e in rows}),
+            'courses': sorted({e['course_code'] for e in rows})
+        }) + '\n'])
+        return len(rows)
+
+def copy_terms(source_dir, target_dir):
+    # Copies the current term and the archived partitions, which live beside
+    # either backend's tables, to another data directory; migrate_data.py
+    # uses it when the database goes elsewhere. Returns the archived terms.
+    source = TermArchive(source_dir)
+    if os.path.abspath(source_dir) == os.path.abspath(target_dir):
+        return source.terms()
+    term = source.current_term()
+    if term is not None:
+        TermArchive(target_dir).set_current_term(term)
+    if os.path.isdir(source.terms_dir):
+        shutil.copytree(source.terms_dir, os.path.join(target_dir, TERMS_DIRNAME),
+                        dirs_exist_ok=True)
+    return source.terms()
+
+# =========================
+# Command Line
+# =========================
+
+def main():
+    from config import CAMPUS, DATA_ROOT, STORAGE_BACKEND
+    from storage import open_storage
+
+    parser = argparse.ArgumentParser(description="Show or roll over academic terms.")
+    parser.add_argument("--data-dir", default=DATA_ROOT)
+    parser.add_argument("--campus", default=CAMPUS)
+    parser.add_argument("--backend", default=STORAGE_BACKEND, choices=["jsonl", "sqlite"])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="the current term and the archived ones")
+    commands.add_parser("campuses", help="the campuses with data of their own")
+    start = commands.add_parser("start", help="name the current term")
+    start.add_argument("term")
+    rollover = commands.add_parser("rollover", help="archive the current term and begin the next")
+    rollover.add_argument("next_term")
+    history = commands.add_parser("history", help="a student's enrollments in past terms")
+    history.add_argument("student_number")
+    args = parser.parse_args()
+
+    if args.command == "campuses":
+        for campus in campuses(args.data_dir):
+            print(f"{campus}: {TermArchive(partition_dir(args.data_dir, campus)).current_term() or '(no term set)'}")
+        return
+    data_dir = partition_dir(args.data_dir, args.campus)
+    archive = TermArchive(data_dir)
+    if args.command == "list":
+        print(f"Current term: {archive.current_term() or '(not set)'}")
+        for term in archive.terms():
+            manifest = archive.manifest(term)
+            print(f"{term}: {manifest['enrollments']} enrollment(s), archived {manifest['archived_at'][:19]}")
+    elif args.command == "start":
+        print(f"Current term is now {archive.set_current_term(args.term)}")
+    elif args.command == "rollover":
+        result = archive.rollover(open_storage(args.backend, data_dir), args.next_term)
+        print(f"Archived {result['enrollments']} enrollment(s) from {result['term']}; "
+              f"current term is now {result['next_term']}")
+    else:
+        for entry in archive.student_history(args.student_number):
+            print(f"{entry['term']}:")
+            for course in entry['courses']:
+                print(f"  {course['course_code']}: {course['course_name']}")
+
+if __name__ == "__main__":
+    main()
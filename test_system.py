@@ -1,37 +1,70 @@
 import os
 import json
+import shutil
+import tempfile
+import multiprocessing
+from contextlib import contextmanager
+
+import main as app
+from storage import (
+    JsonLinesStorage, SQLiteStorage, ConflictError, migrate, open_storage,
+    ENROLLMENTS_FILENAME, STUDENTS_FILENAME
+)
 from main import (
     load_students, load_courses, load_enrollments,
     authenticate_student, hash_password,
     save_courses, save_enrollments
 )
 
+@contextmanager
+def temporary_data_dir(*shipped):
+    # A scratch data directory, starting with copies of the shipped files
+    # named, so tests that write leave data/ as it is in git.
+    with tempfile.TemporaryDirectory() as tmp:
+        for filename in shipped:
+            shutil.copy(os.path.join(app.DATA_DIR, filename), tmp)
+        saved = app.use_storage(JsonLinesStorage(tmp))
+        try:
+            yield tmp
+        finally:
+            app.use_storage(saved)
+
 def test_student_authentication():
     print("\n=== Testing Student Authentication ===")
     
-    student = authenticate_student('2021001', '2021001@mocku.edu.ph', 'password123')
-    if student:
-        print(f" Authentication successful for {student['name']}")
-        print(f"  Email: {student['email']}")
-        print(f"  Year: {student['year']}")
-        print(f"  Degree: {student['degree']}")
-    else:
-        print("Authentication failed")
-        return False
+    from auth import check_password, needs_rehash
     
-    invalid = authenticate_student('2021001', '2021001@mocku.edu.ph', 'wrongpassword')
-    if not invalid:
-        print("Invalid password correctly rejected")
-    else:
-        print("Invalid password incorrectly accepted")
-        return False
+    with temporary_data_dir(STUDENTS_FILENAME):
+        student = authenticate_student('2021001', '2021001@mocku.edu.ph', 'password123')
+        if student:
+            print(f" Authentication successful for {student['name']}")
+            print(f"  Email: {student['email']}")
+            print(f"  Year: {student['year']}")
+            print(f"  Degree: {student['degree']}")
+        else:
+            print("Authentication failed")
+            return False
     
-    wrong_email = authenticate_student('2021001', 'wrong@mocku.edu.ph', 'password123')
-    if not wrong_email:
-        print(" Invalid email correctly rejected")
-    else:
-        print("Invalid email incorrectly accepted")
-        return False
+        invalid = authenticate_student('2021001', '2021001@mocku.edu.ph', 'wrongpassword')
+        if not invalid:
+            print("Invalid password correctly rejected")
+        else:
+            print("Invalid password incorrectly accepted")
+            return False
+    
+        wrong_email = authenticate_student('2021001', 'wrong@mocku.edu.ph', 'password123')
+        if not wrong_email:
+            print(" Invalid email correctly rejected")
+        else:
+            print("Invalid email incorrectly accepted")
+            return False
+        
+        # The shipped SHA-256 hash is upgraded in the copy, not in data/.
+        upgraded = app.storage.get_student('2021001')['password']
+        if needs_rehash(upgraded) or not check_password('password123', upgraded):
+            print("Password hash was not upgraded on login")
+            return False
+        print("Login upgraded the stored hash in the scratch copy")
     
     return True
 
@@ -124,36 +157,1878 @@ def test_course_crud():
 def test_enrollment():
     print("\n=== Testing Enrollment Functionality ===")
     
-    enrollments = load_enrollments()
+    with temporary_data_dir(ENROLLMENTS_FILENAME):
+        enrollments = load_enrollments()
+    
+        test_enrollment = {
+            'student_number': '2021001',
+            'course_code': 'CS101',
+            'enrollment_date': '2025-10-22 00:00:00'
+        }
+    
+        if '2021001' not in enrollments:
+            enrollments['2021001'] = []
+    
+        original_count = len(enrollments.get('2021001', []))
     
-    test_enrollment = {
-        'student_number': '2021001',
-        'course_code': 'CS101',
-        'enrollment_date': '2025-10-22 00:00:00'
+        enrollments['2021001'].append(test_enrollment)
+        save_enrollments(enrollments)
+        print("Enrollment added")
+    
+        enrollments = load_enrollments()
+        if '2021001' in enrollments and len(enrollments['2021001']) > original_count:
+            print("Enrollment persisted to file")
+        
+            enrolled_courses = [e['course_code'] for e in enrollments['2021001']]
+            if 'CS101' in enrolled_courses:
+                print("Correct course enrolled")
+            else:
+                print("Course not found in enrollments")
+                return False
+        else:
+            print("Enrollment not saved correctly")
+            return False
+    
+    return True
+
+def test_enrollment_log():
+    print("\n=== Testing Append-Only Enrollment Log ===")
+    
+    with temporary_data_dir():
+        for code in ['CS101', 'CS201', 'CS101', 'IT101']:
+            app.append_enrollment({
+                'student_number': '2021001',
+                'course_code': code,
+                'enrollment_date': '2025-10-22 00:00:00'
+            })
+        app.remove_enrollment('2021001', 'IT101')
+        
+        enrolled = [e['course_code'] for e in load_enrollments()['2021001']]
+        if enrolled != ['CS101', 'CS201', 'CS101']:
+            print(f"Unexpected enrollments after appends: {enrolled}")
+            return False
+        print("Appends and tombstones replayed correctly")
+        
+        with open(app.storage.enrollments_file, 'a') as f:
+            f.write('{"student_number": "2021001", "course_')
+        app.append_enrollment({
+            'student_number': '2021002',
+            'course_code': 'CS101',
+            'enrollment_date': '2025-10-22 00:00:00'
+        })
+        if '2021002' not in load_enrollments():
+            print("Append after a torn record was lost")
+            return False
+        print("Torn record skipped without losing later appends")
+        
+        if not app.compact_enrollments():
+            print("Compaction did not run")
+            return False
+        with open(app.storage.enrollments_file, 'r') as f:
+            lines = [json.loads(line) for line in f]
+        pairs = [(e['student_number'], e['course_code']) for e in lines]
+        if pairs != [('2021001', 'CS101'), ('2021001', 'CS201'), ('2021002', 'CS101')]:
+            print(f"Unexpected compacted log: {pairs}")
+            return False
+        print("Compaction folded duplicates and deletions")
+    
+    return True
+
+def test_data_store():
+    print("\n=== Testing Shared Data Store ===")
+    
+    with temporary_data_dir():
+        save_courses({'CS101': {
+            'course_code': 'CS101',
+            'course_name': 'Introduction to Programming',
+            'department': 'Computer Science',
+            'units': 3
+        }})
+        courses = app.storage.store.get('courses')
+        if app.storage.store.get('courses') is not courses:
+            print("Unchanged file was re-parsed")
+            return False
+        print("Repeated reads served from memory")
+        
+        courses = load_courses()
+        courses['CS201'] = dict(courses['CS101'], course_code='CS201')
+        save_courses(courses)
+        if 'CS201' not in app.storage.store.get('courses'):
+            print("External change to courses file not picked up")
+            return False
+        print("External file change triggered a reload")
+        
+        app.append_enrollment({
+            'student_number': '2021001',
+            'course_code': 'CS101',
+            'enrollment_date': '2025-10-22 00:00:00'
+        })
+        enrollments = app.storage.store.get('enrollments')
+        app.append_enrollment({
+            'student_number': '2021001',
+            'course_code': 'CS201',
+            'enrollment_date': '2025-10-22 00:00:00'
+        })
+        if app.storage.store.get('enrollments') is not enrollments:
+            print("Enrollment log was fully reloaded instead of tail-read")
+            return False
+        if [e['course_code'] for e in enrollments['2021001']] != ['CS101', 'CS201']:
+            print("Appended enrollment missing from store")
+            return False
+        print("Appended enrollments read incrementally")
+        
+        app.compact_enrollments()
+        if app.storage.store.get('enrollments') == enrollments and app.storage.store.get('enrollments') is not enrollments:
+            print("Compacted log reloaded with the same contents")
+        else:
+            print("Store did not reload after compaction")
+            return False
+    
+    return True
+
+def linear_search(courses, keyword):
+    return [code for code, course in courses.items()
+            if (keyword in course['course_code'].lower() or
+                keyword in course['course_name'].lower() or
+                keyword in course['department'].lower())]
+
+def test_course_search_index():
+    print("\n=== Testing Course Search Index ===")
+    
+    from search_index import CourseSearchIndex
+    
+    courses = load_courses()
+    index = CourseSearchIndex()
+    index.rebuild(courses)
+    
+    keywords = ['', 'c', 'cs', 'cs1', 'cs101', 'computer', 'data str', 'ing', 'xyz', 'calculus i']
+    for keyword in keywords:
+        if index.search(keyword) != linear_search(courses, keyword):
+            print(f"Index results differ from linear scan for '{keyword}'")
+            return False
+    print(f"Index matches linear scan for {len(keywords)} keywords")
+    
+    courses['TEST101'] = {
+        'course_code': 'TEST101',
+        'course_name': 'Computer Testing',
+        'department': 'Testing',
+        'units': 3
     }
+    index.update('TEST101', None, courses['TEST101'])
+    old = dict(courses['CS201'])
+    courses['CS201']['course_name'] = 'Advanced Algorithms'
+    index.update('CS201', old, courses['CS201'])
+    index.update('MATH101', courses.pop('MATH101'), None)
+    
+    for keyword in keywords + ['test', 'advanced', 'data struct']:
+        if index.search(keyword) != linear_search(courses, keyword):
+            print(f"Incremental index differs from linear scan for '{keyword}'")
+            return False
+    print("Incremental add/update/delete kept the index consistent")
+    
+    if index.sorted_codes(department='computer science') \
+            != sorted(c for c in courses if courses[c]['department'] == 'Computer Science') \
+            or index.sorted_codes(department='testing') != ['TEST101']:
+        print("Department listing returned unexpected results")
+        return False
+    print("Department listings stay in sync with the index")
+    
+    return True
+
+def test_course_roster_index():
+    print("\n=== Testing Course Roster Index ===")
+    
+    with temporary_data_dir():
+        for student_num, code in [('2021001', 'CS101'), ('2021002', 'CS101'),
+                                  ('2021001', 'CS201'), ('2021001', 'CS101')]:
+            app.append_enrollment({
+                'student_number': student_num,
+                'course_code': code,
+                'enrollment_date': '2025-10-22 00:00:00'
+            })
+        if app.get_course_roster('CS101') != ['2021001', '2021002']:
+            print(f"Unexpected CS101 roster: {app.get_course_roster('CS101')}")
+            return False
+        print("Roster lists distinct enrolled students")
+        
+        app.remove_enrollment('2021001', 'CS101')
+        app.append_enrollment({
+            'student_number': '2022001',
+            'course_code': 'CS201',
+            'enrollment_date': '2025-10-22 00:00:00'
+        })
+        expected = {}
+        for student_num, student_enrollments in load_enrollments().items():
+            for enrollment in student_enrollments:
+                expected.setdefault(enrollment['course_code'], set()).add(student_num)
+        actual = app.get_course_headcounts()
+        if actual != {code: len(students) for code, students in expected.items()}:
+            print(f"Headcounts out of sync with enrollments: {actual}")
+            return False
+        print("Headcounts stay consistent after enroll and delete")
+    
+    return True
+
+def test_sqlite_storage():
+    print("\n=== Testing SQLite Storage Backend ===")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SQLiteStorage(os.path.join(tmp, "enrollment.db"))
+        try:
+            migrate(JsonLinesStorage("data"), db)
+            if db.load_students() != load_students() or db.load_courses() != load_courses():
+                print("Migrated students or courses differ from the text files")
+                return False
+            print("Students and courses migrated")
+            
+            pairs = set()
+            for student_enrollments in load_enrollments().values():
+                for e in student_enrollments:
+                    pairs.add((e['student_number'], e['course_code']))
+            migrated = [(e['student_number'], e['course_code'])
+                        for student_enrollments in db.load_enrollments().values()
+                        for e in student_enrollments]
+            if sorted(migrated) != sorted(pairs):
+                print("Migrated enrollments were not deduplicated correctly")
+                return False
+            print(f"{len(migrated)} unique enrollments migrated")
+            
+            record = {
+                'student_number': '2022002',
+                'course_code': 'ENG101',
+                'enrollment_date': '2025-10-22 00:00:00'
+            }
+            if not db.append_enrollment(record) or db.append_enrollment(record):
+                print("Unique (student_number, course_code) constraint not enforced")
+                return False
+            if 'ENG101' not in [e['course_code'] for e in db.student_enrollments('2022002')]:
+                print("Point lookup did not return the new enrollment")
+                return False
+            print("Enrollment inserted once and found by point lookup")
+            
+            courses = load_courses()
+            for keyword in ['', 'cs', 'computer', 'data str', 'xyz']:
+                expected = linear_search(courses, keyword)
+                if [c['course_code'] for c in db.search_courses(keyword)] != expected:
+                    print(f"SQLite search differs for '{keyword}'")
+                    return False
+            print("SQLite search matches the linear scan")
+            
+            db.put_course(dict(courses['CS201'], course_name='Advanced Algorithms'))
+            db.delete_course('MATH101')
+            if ([c['course_code'] for c in db.search_courses('advanced')] != ['CS201']
+                    or db.get_course('MATH101') is not None):
+                print("Course update or delete not reflected in the search index")
+                return False
+            print("Course changes kept the full-text index in sync")
+        finally:
+            db.close()
+    
+    # Waitlists, the archive and terms survive a migration and back.
+    from service import EnrollmentService
+    from terms import TermArchive, copy_terms
+    with tempfile.TemporaryDirectory() as tmp:
+        source_dir, target_dir, back_dir = (os.path.join(tmp, name)
+                                            for name in ('jsonl', 'sqlite', 'back'))
+        for directory in (source_dir, target_dir, back_dir):
+            os.makedirs(directory)
+        source = JsonLinesStorage(source_dir)
+        service = EnrollmentService(source)
+        service.add_course('CS101', 'Computer Science', 3, 'Programming', capacity=1)
+        service.add_course('CS150', 'Computer Science', 3, 'Old Programming')
+        service.enroll('s9', 'CS150')
+        source.delete_course('CS150', archive=True)
+        archive = TermArchive(source_dir)
+        archive.set_current_term('2025-1')
+        service.enroll('s0', 'CS101')
+        archive.rollover(source, '2025-2')
+        for number in ('s1', 's4', 's2', 's3'):
+            service.enroll(number, 'CS101')
+        
+        db = SQLiteStorage(os.path.join(target_dir, 'enrollment.db'))
+        back = JsonLinesStorage(back_dir)
+        try:
+            migrate(source, db)
+            migrate(db, back)
+            queues = [[e['student_number'] for e in storage.waitlist('CS101')]
+                      for storage in (db, back)]
+            if queues != [['s4', 's2', 's3']] * 2 or back.load_waitlists() != source.load_waitlists():
+                print(f"Migration lost or reordered the waitlist: {queues}")
+                return False
+            if back.archived_enrollments() != source.archived_enrollments() \
+                    or [e['student_number'] for e in db.archived_enrollments('CS150')] != ['s9']:
+                print("Migration lost the archived enrollments")
+                return False
+            if back.waitlist_position('s3', 'CS101') != 3 or back.drop_enrollment('s1', 'CS101') != ['s4']:
+                print("The migrated waitlist does not promote in order")
+                return False
+            print("Waitlists and archived enrollments survive a round trip through SQLite")
+        finally:
+            db.close()
+        
+        if copy_terms(source_dir, target_dir) != ['2025-1'] \
+                or TermArchive(target_dir).current_term() != '2025-2' \
+                or list(TermArchive(target_dir).enrollments('2025-1')) != ['s0']:
+            print("Term data was not copied with the migration")
+            return False
+        print("The current term and archived terms are copied to the new directory")
+    
+    return True
+
+def concurrent_writer(data_dir, worker, count):
+    storage = JsonLinesStorage(data_dir)
+    for i in range(count):
+        storage.put_course({
+            'course_code': f'W{worker}C{i}',
+            'course_name': f'Worker {worker} Course {i}',
+            'department': 'Testing',
+            'units': 3
+        })
+        storage.enroll({
+            'student_number': f'{worker:03d}{i:04d}',
+            'course_code': 'CS101',
+            'enrollment_date': '2025-10-22 00:00:00'
+        })
+
+def test_concurrent_writers():
+    print("\n=== Testing Concurrent Writers ===")
+    
+    workers, count = 4, 25
+    with tempfile.TemporaryDirectory() as tmp:
+        processes = [multiprocessing.Process(target=concurrent_writer, args=(tmp, w, count))
+                     for w in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        
+        storage = JsonLinesStorage(tmp)
+        if len(storage.load_courses()) != workers * count:
+            print(f"Lost course updates: {len(storage.load_courses())} of {workers * count}")
+            return False
+        print(f"All {workers * count} courses written by {workers} processes survived")
+        
+        if storage.course_headcount('CS101') != workers * count:
+            print(f"Lost enrollments: {storage.course_headcount('CS101')} of {workers * count}")
+            return False
+        print(f"All {workers * count} concurrent enrollments recorded")
+        
+        if storage.enroll({'student_number': '0000000', 'course_code': 'CS101',
+                           'enrollment_date': '2025-10-22 00:00:00'}):
+            print("Duplicate enrollment accepted")
+            return False
+        
+        original = storage.get_course('W0C0')
+        other = JsonLinesStorage(tmp)
+        other.put_course(dict(original, course_name='Changed Elsewhere'), expected=original)
+        try:
+            storage.put_course(dict(original, units=4), expected=original)
+            print("Stale update overwrote a concurrent change")
+            return False
+        except ConflictError:
+            print("Stale update rejected with a conflict")
     
-    if '2021001' not in enrollments:
-        enrollments['2021001'] = []
+    return True
+
+def test_bulk_import_export():
+    print("\n=== Testing Bulk Import/Export ===")
     
-    original_count = len(enrollments.get('2021001', []))
+    import io
+    from bulk import import_records, export_records
     
-    enrollments['2021001'].append(test_enrollment)
-    save_enrollments(enrollments)
-    print("Enrollment added")
+    students_csv = io.StringIO(
+        "student_number,name,year,degree,password\n"
+        "2023001,Lea Cruz,1st Year,BS Computer Science,secret\n"
+        "2023002,Ramon Lim,1st Year,BS Information Technology,secret\n"
+        "2023003,,1st Year,BS Computer Science,secret\n"
+        "2023001,Lea Cruz,1st Year,BS Computer Science,secret\n"
+        "2023004,Noel Tan,1st Year,BS Computer Science,secret\n"
+    )
+    courses_jsonl = io.StringIO(
+        '{"course_code": "cs101", "course_name": "Intro", "department": "CS", "units": 3}\n'
+        '{"course_code": "CS102", "course_name": "Intro II", "department": "CS", "units": "x"}\n'
+        'not json\n'
+    )
+    enrollments_csv = io.StringIO(
+        "student_number,course_code,enrollment_date\n"
+        "2023001,CS101,2025-10-22 08:00:00\n"
+        "2023002,CS101,\n"
+        "2023001,CS101,2025-10-22 09:00:00\n"
+        "2099999,CS101,2025-10-22 08:00:00\n"
+    )
     
-    enrollments = load_enrollments()
-    if '2021001' in enrollments and len(enrollments['2021001']) > original_count:
-        print("Enrollment persisted to file")
+    with temporary_data_dir():
+        storage = app.storage
+        report = import_records(storage, 'students', students_csv, 'csv', chunk_size=2)
+        if (report.accepted, report.rejected, report.chunks) != (3, 2, 2):
+            print(f"Unexpected student import report: {report.accepted}/{report.rejected}/{report.chunks}")
+            return False
+        if authenticate_student('2023004', '2023004@mocku.edu.ph', 'secret') is None:
+            print("Imported student cannot log in")
+            return False
+        print("Students imported in chunks with invalid and duplicate rows rejected")
         
-        enrolled_courses = [e['course_code'] for e in enrollments['2021001']]
-        if 'CS101' in enrolled_courses:
-            print("Correct course enrolled")
+        report = import_records(storage, 'courses', courses_jsonl, 'jsonl')
+        if (report.accepted, report.rejected) != (1, 2) or storage.get_course('CS101') is None:
+            print("Course import did not validate units and malformed lines")
+            return False
+        print("Courses validated like add_course")
+        
+        # Capacity is parsed as add_course does, so imported courses fill.
+        from service import EnrollmentService, Conflict
+        from storage import WAITLISTED
+        report = import_records(storage, 'courses', io.StringIO(
+            "course_code,course_name,department,units,capacity\n"
+            "CS110,Seminar,CS,1,1\n"
+            "CS111,Lab,CS,1,lots\n"
+            "CS112,Open Lab,CS,1,\n"), 'csv')
+        service = EnrollmentService(storage)
+        statuses = [service.enroll(number, 'CS110')['status'] for number in ('2023001', '2023002')]
+        if (report.accepted, report.rejected) != (2, 1) or statuses[1] != WAITLISTED \
+                or 'capacity' in storage.get_course('CS112'):
+            print(f"Imported capacity not parsed: {report.rejects}, {statuses}")
+            return False
+        print("Imported capacities are numbers that enrollment enforces")
+        
+        # Meeting times are normalized, so clash checks see the same masks.
+        report = import_records(storage, 'courses', io.StringIO(
+            '{"course_code": "CS120", "course_name": "A", "department": "CS", "units": 1, '
+            '"schedule": "mon 9:00-10:00"}\n'
+            '{"course_code": "CS121", "course_name": "B", "department": "CS", "units": 1, '
+            '"schedule": "Mon 09:30-10:30"}\n'
+            '{"course_code": "CS122", "course_name": "C", "department": "CS", "units": 1, '
+            '"schedule": "someday"}\n'), 'jsonl')
+        service.enroll('2023001', 'CS120')
+        try:
+            service.enroll('2023001', 'CS121')
+            print("Imported meeting times did not clash")
+            return False
+        except Conflict:
+            pass
+        if (report.accepted, report.rejected) != (2, 1) \
+                or storage.get_course('CS120')['schedule'] != 'Mon 09:00-10:00':
+            print(f"Imported schedule not parsed: {report.rejects}")
+            return False
+        print("Imported meeting times are validated and clash-checked")
+        
+        # Prerequisites are parsed and checked as add_course does; they may
+        # name a course earlier in the same file.
+        report = import_records(storage, 'courses', io.StringIO(
+            "course_code,course_name,department,units,prerequisites\n"
+            "PRE1,Base,CS,3,\n"
+            'PRE2,Next,CS,3,"pre1, CS101"\n'
+            "PRE3,Unknown,CS,3,ZZ999\n"
+            "PRE4,Loop,CS,3,PRE4\n"), 'csv')
+        if (report.accepted, report.rejected) != (2, 2) \
+                or storage.prerequisite_graph().prerequisites('PRE2') != ['CS101', 'PRE1']:
+            print(f"Imported prerequisites not parsed: {report.rejects}")
+            return False
+        report = import_records(storage, 'courses', io.StringIO(
+            "course_code,course_name,department,units,prerequisites\n"
+            "PRE5,After,CS,3,PRE2\n"
+            "PRE1,Base,CS,3,PRE5\n"), 'csv', replace=True)
+        if (report.accepted, report.rejected) != (1, 1) or 'prerequisites' in storage.get_course('PRE1'):
+            print(f"Cycle through a row in the same chunk accepted: {report.rejects}")
+            return False
+        print("Imported prerequisites must exist and cannot form a cycle")
+        
+        report = import_records(storage, 'enrollments', enrollments_csv, 'csv')
+        if (report.accepted, report.rejected) != (2, 2) or storage.course_headcount('CS101') != 2:
+            print(f"Unexpected enrollment import: {report.accepted}/{report.rejected}")
+            return False
+        print("Enrollments imported with unknown students and duplicates rejected")
+        
+        out = io.StringIO()
+        count = export_records(storage, 'students', out, 'csv')
+        out.seek(0)
+        with tempfile.TemporaryDirectory() as tmp:
+            copy = JsonLinesStorage(tmp)
+            report = import_records(copy, 'students', out, 'csv')
+            if count != 3 or report.accepted != 3 or copy.get_student('2023004') != storage.get_student('2023004'):
+                print("Exported students did not round-trip through the importer")
+                return False
+        print("Exported students round-trip through the importer")
+    
+    return True
+
+def test_generator_and_benchmark():
+    print("\n=== Testing Data Generator and Benchmarks ===")
+    
+    from generate_data import generate_dataset
+    from benchmark import run_benchmarks
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        counts = generate_dataset(tmp, 50, 20, 300, seed=1)
+        storage = JsonLinesStorage(tmp)
+        pairs = [(e['student_number'], e['course_code'])
+                 for student_enrollments in storage.load_enrollments().values()
+                 for e in student_enrollments]
+        if counts != {'students': 50, 'courses': 20, 'enrollments': 300} or len(set(pairs)) != 300:
+            print(f"Unexpected generated dataset: {counts}")
+            return False
+        if len(storage.load_students()) != 50 or len(storage.load_courses()) != 20:
+            print("Generated files do not load with the storage layer")
+            return False
+        print("Generated dataset has the requested sizes and unique enrollments")
+    
+    report = run_benchmarks(['20:10:100'], repeat=1)
+    operations = {r['operation'] for r in report['results']}
+    expected = {'load_students', 'save_enrollments', 'authenticate_student', 'enroll',
+                'student_unit_totals', 'search_courses[cs]'}
+    if not expected <= operations or json.loads(json.dumps(report)) != report:
+        print(f"Benchmark report missing operations: {expected - operations}")
+        return False
+    print(f"Benchmark produced {len(report['results'])} machine-readable results")
+    
+    return True
+
+def http_request(base_url, method, path, body=None, token=None):
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+    data = json.dumps(body).encode() if body is not None else None
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f"Bearer {token}"
+    request = Request(base_url + path, data=data, method=method, headers=headers)
+    try:
+        with urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except HTTPError as e:
+        return e.code, json.loads(e.read())
+
+def test_capacity_and_waitlist():
+    print("\n=== Testing Capacity and Waitlists ===")
+    
+    from service import EnrollmentService, Conflict, NotFound
+    from storage import ENROLLED, WAITLISTED
+    from load_test import run_load_test
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in (JsonLinesStorage(tmp), SQLiteStorage(os.path.join(tmp, 'enrollment.db'))):
+            service = EnrollmentService(storage)
+            service.add_course('CS101', 'Computer Science', 3, 'Intro', capacity=2)
+            statuses = [service.enroll(number, 'CS101')['status'] for number in ('s1', 's2', 's3', 's4')]
+            if statuses != [ENROLLED, ENROLLED, WAITLISTED, WAITLISTED] \
+                    or service.waitlist_position('s4', 'CS101') != 2:
+                print(f"{type(storage).__name__}: unexpected seat outcomes {statuses}")
+                return False
+            try:
+                service.enroll('s3', 'CS101')
+                print("Duplicate waitlist request accepted")
+                return False
+            except Conflict:
+                pass
+            
+            if service.drop('s1', 'CS101')['promoted'] != ['s3'] \
+                    or service.course_roster('CS101')['students'] != ['s2', 's3']:
+                print(f"{type(storage).__name__}: dropping a seat did not promote the waitlist head")
+                return False
+            service.drop('s4', 'CS101')
+            try:
+                service.drop('s4', 'CS101')
+                print("Dropping twice did not raise NotFound")
+                return False
+            except NotFound:
+                pass
+            
+            service.enroll('s5', 'CS101')
+            service.enroll('s6', 'CS101')
+            service.update_course('CS101', capacity=4)
+            roster = service.course_roster('CS101')
+            if roster['students'] != ['s2', 's3', 's5', 's6'] or roster['waitlist']:
+                print(f"{type(storage).__name__}: raising capacity did not promote: {roster}")
+                return False
+            
+            # Capacity is kept unless given; None lifts the limit.
+            service.enroll('s7', 'CS101')
+            service.update_course('CS101', 'Intro II', schedule='Mon 09:00-10:00')
+            service.update_course('CS101', capacity=None, schedule=None)
+            course = storage.get_course('CS101')
+            if 'capacity' in course or 'schedule' in course \
+                    or service.course_roster('CS101')['students'][-1] != 's7':
+                print(f"{type(storage).__name__}: clearing capacity and schedule left {course}")
+                return False
+            storage.close()
+        print("Full courses waitlist in order and promote on drops and capacity increases")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        report = run_load_test(tmp, requests=300, capacity=20, concurrency=32)
+        if report['failures']:
+            print(f"Load test failed: {report['failures']}")
+            return False
+        print(f"{report['requests']} simultaneous requests filled exactly {report['enrolled']} seats")
+    
+    return True
+
+def test_batch_enrollment():
+    print("\n=== Testing Batch Enrollment ===")
+    
+    import wal
+    from service import EnrollmentService, Conflict, InvalidInput, MAX_UNITS
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in (JsonLinesStorage(tmp), SQLiteStorage(os.path.join(tmp, 'enrollment.db'))):
+            name = type(storage).__name__
+            service = EnrollmentService(storage)
+            for code, units in (('CS101', 3), ('CS102', 3), ('CS103', 4), ('BIG1', MAX_UNITS - 6)):
+                service.add_course(code, 'Computer Science', units, code)
+            service.add_course('FULL1', 'Computer Science', 1, 'Full', capacity=0)
+            
+            appends = []
+            original = wal.write_at
+            wal.write_at = lambda path, offset, data: appends.append(path) or original(path, offset, data)
+            try:
+                batch = service.enroll_many('s1', ['cs101', 'CS102', 'CS103'])
+            finally:
+                wal.write_at = original
+            if batch['units'] != 10 or service.enrolled_course_codes('s1') != ['CS101', 'CS102', 'CS103']:
+                print(f"{name}: batch not enrolled: {batch}")
+                return False
+            if isinstance(storage, JsonLinesStorage) and len(appends) != 1:
+                print(f"{name}: batch took {len(appends)} writes")
+                return False
+            
+            for codes, error in ((['CS101', 'BIG1'], Conflict), (['BIG1'], InvalidInput),
+                                 (['FULL1'], Conflict), (['CS101', 'cs101'], InvalidInput)):
+                try:
+                    service.enroll_many('s1', codes)
+                    print(f"{name}: batch {codes} was not rejected")
+                    return False
+                except error:
+                    pass
+            if service.my_courses('s1')['total_units'] != 10:
+                print(f"{name}: a rejected batch was partly written")
+                return False
+            try:
+                service.enroll('s2', 'BIG1')
+                service.enroll('s2', 'CS103')
+                service.enroll('s2', 'CS101')
+                print(f"{name}: single enrollment exceeded the unit limit")
+                return False
+            except InvalidInput:
+                pass
+            storage.close()
+        print("Batches are all-or-nothing, checked for duplicates, seats and the unit limit")
+        print("A batch is written with a single append")
+    
+    return True
+
+def test_binary_snapshots():
+    print("\n=== Testing Binary Snapshots ===")
+    
+    from snapshot import SNAPSHOT_SUFFIX
+    from generate_data import generate_dataset, student_number_for, course_code_for
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        generate_dataset(tmp, 50, 10, 200)
+        full = JsonLinesStorage(tmp)
+        students, courses, enrollments = full.load_students(), full.load_courses(), full.load_enrollments()
+        if not all(full.build_snapshots().values()):
+            print("Snapshots were not written")
+            return False
+        
+        lazy = JsonLinesStorage(tmp)
+        for number in students:
+            if lazy.get_student(number) != students[number] \
+                    or lazy.student_enrollments(number) != enrollments.get(number, []):
+                print(f"Snapshot lookup for {number} differs from the text files")
+                return False
+        if any(lazy.get_course(code) != course for code, course in courses.items()) \
+                or lazy.get_student('0000000') is not None:
+            print("Snapshot course lookups differ from the text files")
+            return False
+        if any(lazy.store.is_loaded(table) for table in ('students', 'courses', 'enrollments')):
+            print("Point lookups loaded whole tables despite the snapshots")
+            return False
+        print("Point lookups are served from the snapshots without loading tables")
+        
+        number = student_number_for(0)
+        taken = [e['course_code'] for e in enrollments[number]]
+        added = next(course_code_for(i) for i in range(10) if course_code_for(i) not in taken)
+        full.remove_enrollment(number, taken[0])
+        full.append_enrollment({'student_number': number, 'course_code': added,
+                                'enrollment_date': '2025-10-22 08:00:00'})
+        codes = [e['course_code'] for e in lazy.student_enrollments(number)]
+        if codes != taken[1:] + [added]:
+            print(f"Log records appended after the snapshot were not applied: {codes}")
+            return False
+        print("Records appended after the snapshot are overlaid on it")
+        
+        os.replace(os.path.join(tmp, 'enrollments.txt') + SNAPSHOT_SUFFIX, os.path.join(tmp, 'stale'))
+        full.save_enrollments({})
+        os.replace(os.path.join(tmp, 'stale'), os.path.join(tmp, 'enrollments.txt') + SNAPSHOT_SUFFIX)
+        if lazy.student_enrollments(number) != [] or lazy.store.is_loaded('enrollments') is False:
+            print("A snapshot of an older log was used after the log was rewritten")
+            return False
+        print("Snapshots of a rewritten log are ignored")
+    
+    return True
+
+def test_compact_enrollments():
+    print("\n=== Testing Compact Enrollment Records ===")
+    
+    from enrollment_records import Enrollment, enrollment_dict
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = {'student_number': '2021001', 'course_code': 'CS101',
+                 'enrollment_date': '2025-10-20 09:30:00'}
+        odd = [
+            {'student_number': '2021001', 'course_code': 'IT101', 'enrollment_date': '20/10/2025'},
+            {'student_number': '2021001', 'course_code': 'CE101',
+             'enrollment_date': '2025-10-20 09:31:00', 'note': 'transfer'}
+        ]
+        with open(os.path.join(tmp, 'enrollments.txt'), 'w') as f:
+            for record in [plain] + odd + [dict(plain, student_number='2021002')]:
+                f.write(json.dumps(record) + '\n')
+        with open(os.path.join(tmp, 'enrollments.txt')) as f:
+            original = f.read()
+        
+        storage = JsonLinesStorage(tmp)
+        enrollments = storage.load_enrollments()
+        rows = enrollments['2021001']
+        if not isinstance(rows[0], Enrollment) or rows[1:] != odd or type(rows[1]) is not dict:
+            print(f"Unexpected record types: {[type(e).__name__ for e in rows]}")
+            return False
+        if rows[0] != plain or dict(rows[0]) != plain or rows[0].get('deleted') is not None \
+                or enrollments['2021002'][0]['student_number'] != '2021002':
+            print(f"Compact record does not read like the original: {rows[0]!r}")
+            return False
+        if rows[0]['student_number'] is not storage.load_enrollments()['2021001'][0]['student_number']:
+            print("Student numbers are not interned")
+            return False
+        print("Plain records load compactly; records with other fields stay dicts")
+        
+        storage.save_enrollments(enrollments)
+        with open(os.path.join(tmp, 'enrollments.txt')) as f:
+            if f.read() != original:
+                print("Saving compact records changed the file")
+                return False
+        if json.loads(json.dumps(enrollment_dict(rows[0]))) != plain \
+                or storage.course_roster('CS101') != ['2021001', '2021002']:
+            print("Compact records do not serialize or index like dicts")
+            return False
+        print("Compact records save byte-for-byte and feed the indexes")
+    
+    return True
+
+def test_integrity_checker():
+    print("\n=== Testing Enrollment Integrity Checker ===")
+    
+    from integrity import DUPLICATE, MALFORMED, ORPHANED_COURSE, UNKNOWN_STUDENT
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = JsonLinesStorage(tmp)
+        storage.save_students({number: {'student_number': number, 'email': f"{number}@mocku.edu.ph"}
+                               for number in ('2021001', '2021002')})
+        storage.save_courses({code: {'course_code': code, 'course_name': code, 'department': 'CS',
+                                     'units': 3} for code in ('CS101', 'CS201')})
+        
+        def row(number, code):
+            return json.dumps({'student_number': number, 'course_code': code,
+                               'enrollment_date': '2025-10-20 09:30:00'}) + '\n'
+        
+        def tombstone(number, code):
+            return json.dumps({'student_number': number, 'course_code': code, 'deleted': True}) + '\n'
+        
+        with open(storage.enrollments_file, 'w') as f:
+            f.writelines([
+                row('2021001', 'CS101'),
+                row('2021001', 'CS101'),          # duplicate
+                row('2021002', 'CS999'),          # course no longer exists
+                row('2029999', 'CS101'),          # unknown student
+                'not json\n',
+                tombstone('2021001', 'CS101'),
+                row('2021001', 'CS101'),          # re-enrolled after dropping
+                tombstone('2021002', 'CS999'),    # cancels a dropped row
+                row('2021002', 'CS201'),
+                row('2029999', 'CS101'),          # unknown again, not a duplicate
+                '{"student_number": "2021002", "course_'
+            ])
+        
+        report = storage.check_enrollments()
+        expected = {DUPLICATE: 1, ORPHANED_COURSE: 1, UNKNOWN_STUDENT: 2, MALFORMED: 2}
+        if report.counts != expected or [issue[0] for issue in report.issues] != [2, 3, 4, 5, 10, 11]:
+            print(f"Unexpected findings: {report.counts} {report.issues}")
+            return False
+        print(f"Found {report.problems} problems in {report.lines} records")
+        
+        # Split into partitions by pair, the scan reaches the same verdicts.
+        import io
+        from integrity import scan_enrollments
+        students, courses = {'2021001', '2021002'}, {'CS101', 'CS201'}
+        whole, split = io.BytesIO(), io.BytesIO()
+        one = scan_enrollments(storage.enrollments_file, students, courses, whole)
+        many = scan_enrollments(storage.enrollments_file, students, courses, split, partition_bytes=64)
+        if (one.counts, one.issues, one.kept, one.lines) != (many.counts, many.issues, many.kept, many.lines) \
+                or whole.getvalue() != split.getvalue():
+            print(f"Partitioned scan differs: {many.counts} {many.issues}")
+            return False
+        print("A partitioned scan finds the same problems and keeps the same lines")
+        
+        before = storage.load_enrollments()
+        del before['2029999']
+        report = storage.check_enrollments(repair=True)
+        if report.kept != 4 or storage.load_enrollments() != before \
+                or not storage.check_enrollments().clean:
+            print("Repair changed live enrollments or left problems behind")
+            return False
+        ino = os.stat(storage.enrollments_file).st_ino
+        if not storage.check_enrollments(repair=True).clean \
+                or os.stat(storage.enrollments_file).st_ino != ino:
+            print("Repairing a clean log rewrote it")
+            return False
+        print("Repair keeps live enrollments and drops only bad lines")
+    
+    return True
+
+def test_course_cascade():
+    print("\n=== Testing Course Cascade and Rename ===")
+    
+    import wal
+    from service import EnrollmentService, Conflict
+    
+    def setup(storage):
+        service = EnrollmentService(storage)
+        service.add_course('CS101', 'Computer Science', 3, 'Programming', capacity=2)
+        service.add_course('CS201', 'Computer Science', 3, 'Data Structures')
+        for number in ('s1', 's2', 's3', 's4'):
+            service.enroll(number, 'CS101')
+        service.enroll('s1', 'CS201')
+        return service
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in (JsonLinesStorage(tmp), SQLiteStorage(os.path.join(tmp, 'enrollment.db'))):
+            name = type(storage).__name__
+            service = setup(storage)
+            dates = {e['student_number']: e['enrollment_date'] for e in storage.iter_enrollments()}
+            
+            try:
+                service.rename_course('CS101', 'cs201')
+                print(f"{name}: renamed onto an existing course")
+                return False
+            except Conflict:
+                pass
+            result = service.rename_course('CS101', 'cs150')
+            roster = service.course_roster('CS150')
+            if result['moved'] != {'enrollments': 2, 'waitlist': 2} \
+                    or roster['students'] != ['s1', 's2'] or roster['waitlist'] != ['s3', 's4'] \
+                    or storage.get_course('CS101') is not None or storage.course_roster('CS101') \
+                    or [c['course_code'] for c in storage.search_courses('programming')] != ['CS150']:
+                print(f"{name}: rename did not carry the roster and waitlist: {roster}")
+                return False
+            if [e['enrollment_date'] for e in storage.student_enrollments('s1')
+                    if e['course_code'] == 'CS150'] != [dates['s1']]:
+                print(f"{name}: rename changed enrollment dates")
+                return False
+            print(f"{name}: rename moved {result['moved']['enrollments']} enrollments "
+                  f"and the waitlist in order")
+            
+            result = service.delete_course('CS150')
+            archived = storage.archived_enrollments('CS150')
+            if result['removed'] != {'enrollments': 2, 'waitlist': 2} or storage.course_roster('CS150') \
+                    or storage.waitlist('CS150') or service.enrolled_course_codes('s1') != ['CS201'] \
+                    or sorted(e['student_number'] for e in archived) != ['s1', 's2']:
+                print(f"{name}: delete did not cascade to enrollments: {result} {archived}")
+                return False
+            print(f"{name}: delete removed and archived the course's enrollments")
+            storage.close()
+        
+        # A duplicate row in the log counts once, as SQLite's unique rows do.
+        os.makedirs(os.path.join(tmp, 'duplicates'))
+        storage = JsonLinesStorage(os.path.join(tmp, 'duplicates'))
+        service = setup(storage)
+        storage.append_enrollment({'student_number': 's2', 'course_code': 'CS101',
+                                   'enrollment_date': '2025-10-22 00:00:00'})
+        result = service.delete_course('CS101')
+        if result['removed'] != {'enrollments': 2, 'waitlist': 2} \
+                or len(storage.archived_enrollments('CS101')) != 2:
+            print(f"Duplicate rows counted in the delete: {result['removed']}")
+            return False
+        storage.close()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = JsonLinesStorage(tmp)
+        setup(storage)
+        ino = os.stat(storage.enrollments_file).st_ino
+        calls = []
+        original = wal.write_at
+        
+        def crash_after_first_file(path, offset, data):
+            calls.append(path)
+            if len(calls) > 1:
+                raise OSError("simulated crash")
+            original(path, offset, data)
+        
+        wal.write_at = crash_after_first_file
+        try:
+            storage.delete_course('CS101', archive=True)
+            print("Simulated crash did not happen")
+            return False
+        except OSError:
+            pass
+        finally:
+            wal.write_at = original
+        if not os.path.getsize(storage.wal.path):
+            print("The interrupted delete was not in the write-ahead log")
+            return False
+        
+        recovered = JsonLinesStorage(tmp)
+        again = JsonLinesStorage(tmp)
+        if os.path.getsize(storage.wal.path) or recovered.get_course('CS101') is not None \
+                or recovered.course_roster('CS101') or recovered.waitlist('CS101') \
+                or len(again.archived_enrollments('CS101')) != 2 \
+                or os.stat(storage.enrollments_file).st_ino != ino:
+            print("Recovery did not finish the interrupted delete exactly once")
+            return False
+        print("An interrupted cascade is finished from the write-ahead log on the next open")
+    
+    return True
+
+def crashing_writer(data_dir, crash_at, ack_path):
+    # Enrolls students one at a time, recording each enrollment once it is
+    # acknowledged, and is killed half-way through its crash_at'th data write.
+    import signal
+    import wal
+    storage = JsonLinesStorage(data_dir)
+    storage.put_course({'course_code': 'CS101', 'course_name': 'Programming',
+                        'department': 'CS', 'units': 3})
+    storage.put_students([{'student_number': f'S{i:03d}', 'name': f'Student {i}'}
+                          for i in range(crash_at)])
+    storage.wal.checkpoint()
+    writes = 0
+    original = wal.write_at
+    
+    def write_at(path, offset, data):
+        nonlocal writes
+        writes += 1
+        if writes == crash_at:
+            original(path, offset, data[:len(data) // 2])
+            os.kill(os.getpid(), signal.SIGKILL)
+        original(path, offset, data)
+    
+    wal.write_at = write_at
+    acks = os.open(ack_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+    for i in range(crash_at):
+        storage.append_enrollment({'student_number': f'S{i:03d}', 'course_code': 'CS101',
+                                   'enrollment_date': '2025-10-22 00:00:00'})
+        os.write(acks, f'S{i:03d}\n'.encode())
+
+def test_write_ahead_log():
+    print("\n=== Testing Write-Ahead Log ===")
+    
+    import time
+    import signal
+    import threading
+    
+    # The writer is killed mid-write. With lose_unsynced the data file is
+    # then thrown away too, as a power cut may do to anything written since
+    # the last checkpoint; only the fsynced log is left to recover from.
+    for crash_at, lose_unsynced in ((12, False), (20, True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            ack_path = os.path.join(tmp, 'acks')
+            process = multiprocessing.Process(target=crashing_writer, args=(tmp, crash_at, ack_path))
+            process.start()
+            process.join()
+            if process.exitcode != -signal.SIGKILL:
+                print(f"Writer was not killed: exit code {process.exitcode}")
+                return False
+            with open(ack_path) as f:
+                acked = set(f.read().split())
+            if lose_unsynced:
+                os.remove(os.path.join(tmp, 'enrollments.txt'))
+            storage = JsonLinesStorage(tmp)
+            roster = storage.course_roster('CS101')
+            in_flight = f'S{crash_at - 1:03d}'
+            if not acked <= set(roster) or not set(roster) <= acked | {in_flight} \
+                    or not storage.check_enrollments().clean or os.path.getsize(storage.wal.path):
+                print(f"Recovery lost or damaged enrollments: {len(acked)} acknowledged, "
+                      f"roster {roster}")
+                return False
+            print(f"Killed mid-write{' and lost unsynced data' if lose_unsynced else ''}: "
+                  f"all {len(acked)} acknowledged enrollments recovered")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = JsonLinesStorage(tmp)
+        storage.put_course({'course_code': 'CS101', 'course_name': 'Programming',
+                            'department': 'CS', 'units': 3})
+        commits, syncs = storage.wal.commits, storage.wal.syncs
+        workers, count = 8, 25
+        
+        def writer(worker):
+            for i in range(count):
+                storage.append_enrollment({'student_number': f'{worker:03d}{i:04d}',
+                                           'course_code': 'CS101',
+                                           'enrollment_date': '2025-10-22 00:00:00'})
+        
+        # A slow disk, so writers pile up behind each fsync.
+        real_fsync = os.fsync
+        os.fsync = lambda fd: time.sleep(0.005) or real_fsync(fd)
+        try:
+            threads = [threading.Thread(target=writer, args=(w,)) for w in range(workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            os.fsync = real_fsync
+        commits = storage.wal.commits - commits
+        syncs = storage.wal.syncs - syncs
+        if storage.course_headcount('CS101') != workers * count or commits != workers * count \
+                or syncs * 2 > commits:
+            print(f"Group commit: {commits} commits took {syncs} fsyncs")
+            return False
+        print(f"Group commit: {commits} concurrent enrollments shared {syncs} fsyncs")
+    
+    return True
+
+def test_course_pagination():
+    print("\n=== Testing Course Pagination ===")
+    
+    from server import Request, list_courses
+    from service import EnrollmentService, InvalidInput
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in (JsonLinesStorage(tmp), SQLiteStorage(os.path.join(tmp, 'enrollment.db'))):
+            name = type(storage).__name__
+            service = EnrollmentService(storage)
+            for i in range(45, 0, -1):
+                service.add_course(f'C{i:03d}', ('Math', 'Science', 'Arts')[i % 3], 2 + i % 2,
+                                   f'Course {i}')
+            
+            codes = []
+            after = None
+            while True:
+                page = service.course_page(after, 10)
+                codes.extend(c['course_code'] for c in page['courses'])
+                if page['next'] is None:
+                    break
+                after = page['next']
+                if after == 'C020':
+                    # Changes behind the cursor do not shift later pages.
+                    service.add_course('A001', 'Math', 3, 'Added')
+                    service.delete_course('C005')
+            if codes != [f'C{i:03d}' for i in range(1, 46)]:
+                print(f"{name}: paging returned {codes}")
+                return False
+            
+            science = [c['course_code'] for c in service.courses(department='science', units='2')]
+            expected = [f'C{i:03d}' for i in range(1, 46) if i % 3 == 1 and i % 2 == 0]
+            if science != expected:
+                print(f"{name}: filtered listing returned {science}")
+                return False
+            
+            service.enroll('s1', 'A001')
+            page = service.course_page(limit=3, student_number='s1')
+            if [c['course_code'] for c in page['courses']] != ['C001', 'C002', 'C003'] \
+                    or page['next'] != 'C003':
+                print(f"{name}: student page returned {page}")
+                return False
+            
+            try:
+                service.course_page(units='two')
+                print(f"{name}: bad units filter accepted")
+                return False
+            except InvalidInput:
+                pass
+            
+            status, body = list_courses(service, Request({}, {'after': ['C040'], 'department': ['Arts']}, None))
+            if status != 200 or [c['course_code'] for c in body['courses']] != ['C041', 'C044'] \
+                    or body['next'] is not None:
+                print(f"{name}: GET /courses paging returned {body}")
+                return False
+            print(f"{name}: paged through 45 courses by cursor, with filters")
+            storage.close()
+    
+    return True
+
+def test_ranked_search():
+    print("\n=== Testing Ranked Search ===")
+    
+    import random
+    from generate_data import generate_courses
+    from search_index import CourseSearchIndex, top_matches
+    from server import Request, list_courses
+    from service import EnrollmentService
+    
+    courses = {course['course_code']: course for course in generate_courses(3000, random.Random(7))}
+    index = CourseSearchIndex()
+    index.rebuild(courses)
+    for code in list(courses)[::7]:
+        index.update(code, courses.pop(code), None)
+    for code in list(courses)[::11]:
+        old = dict(courses[code])
+        courses[code]['course_name'] += ' II'
+        index.update(code, old, courses[code])
+    
+    def scan(query, limit, offset=0):
+        fields = ((code, tuple(str(course[f]).lower() for f in ('course_code', 'course_name', 'department')), i)
+                  for i, (code, course) in enumerate(courses.items()))
+        return top_matches(query, fields, limit, offset)
+    
+    queries = ['calclus', 'intro programing', 'algo', 'cs1', 'CS101', 'computer science', 'ii', 'xyzzy']
+    for query in queries:
+        for offset in (0, 15):
+            if index.rank(query, 15, offset) != scan(query, 15, offset):
+                print(f"Ranked index differs from a full scan for '{query}' at offset {offset}")
+                return False
+    print(f"Ranked index matches a full scan for {len(queries)} queries")
+    
+    # Everything the substring search finds comes first.
+    shipped = load_courses()
+    index = CourseSearchIndex()
+    index.rebuild(shipped)
+    for keyword in ['101', 'cs', 'CS1', 'data str', '']:
+        expected = linear_search(shipped, keyword.lower())
+        ranked = index.rank(keyword, 50)
+        if set(ranked[:len(expected)]) != set(expected):
+            print(f"Ranked search for '{keyword}' returned {ranked}, not {expected} first")
+            return False
+    print("Substring matches rank ahead of fuzzy ones")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in (JsonLinesStorage(tmp), SQLiteStorage(os.path.join(tmp, 'enrollment.db'))):
+            name = type(storage).__name__
+            service = EnrollmentService(storage)
+            service.add_course('MATH101', 'Mathematics', 3, 'Calculus I')
+            service.add_course('MATH201', 'Mathematics', 3, 'Calculus II')
+            service.add_course('PHYS101', 'Physics', 3, 'Physics for Calculus Students')
+            service.add_course('CS101', 'Computer Science', 3, 'Intro to Programming')
+            service.add_course('CS102', 'Computer Science', 3, 'Discrete Mathematics')
+            for i in range(25):
+                service.add_course(f'HIST{i:03d}', 'History', 3, f'History of Mathematics {i}')
+            
+            for keyword in ('101', 'cs', 'math'):
+                expected = [c['course_code'] for c in service.search_courses(keyword)]
+                found = [c['course_code'] for c in service.ranked_search(keyword, 50)['courses']]
+                if not expected or set(found[:len(expected)]) != set(expected):
+                    print(f"{name}: ranked '{keyword}' returned {found}, not {expected} first")
+                    return False
+            if service.search_courses('calclus'):
+                print(f"{name}: substring search unexpectedly matched a typo")
+                return False
+            found = [c['course_code'] for c in service.ranked_search('calclus')['courses']]
+            if found != ['MATH101', 'MATH201', 'PHYS101']:
+                print(f"{name}: 'calclus' ranked {found}")
+                return False
+            found = [c['course_code'] for c in service.ranked_search('cs101', 3)['courses']]
+            if found[0] != 'CS101':
+                print(f"{name}: code search ranked {found}")
+                return False
+            
+            codes = []
+            offset = 0
+            while offset is not None:
+                page = service.ranked_search('mathematics', 10, offset)
+                codes.extend(c['course_code'] for c in page['courses'])
+                offset = page['next']
+            # Name matches outrank department matches; ties keep catalog order.
+            if codes != ['CS102'] + [f'HIST{i:03d}' for i in range(25)] + ['MATH101', 'MATH201']:
+                print(f"{name}: paged ranking returned {codes}")
+                return False
+            
+            status, body = list_courses(service, Request({}, {'search': ['intro programing'], 'limit': ['1']}, None))
+            if status != 200 or [c['course_code'] for c in body['courses']] != ['CS101']:
+                print(f"{name}: GET /courses?search= returned {body}")
+                return False
+            print(f"{name}: typos found, results ranked and paged by offset")
+            storage.close()
+    
+    return True
+
+def test_reports():
+    print("\n=== Testing Reports ===")
+    
+    from reports import (
+        course_report, department_report, unit_load_report, year_degree_report,
+        enrollment_rate_report
+    )
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in (JsonLinesStorage(tmp), SQLiteStorage(os.path.join(tmp, 'enrollment.db'))):
+            name = type(storage).__name__
+            storage.put_students([
+                {'student_number': 's1', 'email': '', 'year': '1st Year', 'degree': 'BSCS'},
+                {'student_number': 's2', 'email': '', 'year': '1st Year', 'degree': 'BSCS'},
+                {'student_number': 's3', 'email': '', 'year': '2nd Year', 'degree': 'BSIT'}
+            ])
+            storage.put_courses([
+                {'course_code': 'CS101', 'course_name': 'Programming', 'department': 'CS', 'units': 3},
+                {'course_code': 'CS102', 'course_name': 'Data', 'department': 'CS', 'units': 4},
+                {'course_code': 'IT101', 'course_name': 'Web', 'department': 'IT', 'units': 2}
+            ])
+            for student, code, when in (('s1', 'CS101', '2025-01-05'), ('s1', 'CS102', '2025-01-20'),
+                                        ('s2', 'CS101', '2025-02-01'), ('s3', 'IT101', '2025-02-03'),
+                                        ('s3', 'CS101', '2025-02-04')):
+                storage.enroll({'student_number': student, 'course_code': code,
+                                'enrollment_date': f'{when} 09:00:00'})
+            # Counters loaded now are kept up to date from here on.
+            storage.enrollment_counts()
+            storage.append_enrollment({'student_number': 's2', 'course_code': 'CS101',
+                                       'enrollment_date': '2025-03-01 09:00:00'})
+            storage.remove_enrollment('s3', 'CS101')
+            
+            if storage.enrollment_counts() != storage.enrollment_counts(recompute=True):
+                print(f"{name}: live counters drifted from a full recount")
+                return False
+            courses = [(r['course_code'], r['enrolled']) for r in course_report(storage)]
+            if courses != [('CS101', 2), ('CS102', 1), ('IT101', 1)] \
+                    or [r['course_code'] for r in course_report(storage, 'it')] != ['IT101']:
+                print(f"{name}: course report {courses}")
+                return False
+            if department_report(storage) != {'CS': {'courses': 2, 'enrollments': 3, 'units': 10},
+                                              'IT': {'courses': 1, 'enrollments': 1, 'units': 2}}:
+                print(f"{name}: department report {department_report(storage)}")
+                return False
+            if unit_load_report(storage) != {2: 1, 3: 1, 7: 1}:
+                print(f"{name}: unit load report {unit_load_report(storage)}")
+                return False
+            if year_degree_report(storage) != {('1st Year', 'BSCS'): {'students': 2, 'enrollments': 3},
+                                               ('2nd Year', 'BSIT'): {'students': 1, 'enrollments': 1}}:
+                print(f"{name}: year/degree report {year_degree_report(storage)}")
+                return False
+            if enrollment_rate_report(storage) != {'2025-01': 2, '2025-02': 2} \
+                    or enrollment_rate_report(storage, 'year') != {'2025': 4}:
+                print(f"{name}: rate report {enrollment_rate_report(storage)}")
+                return False
+            print(f"{name}: course, department, unit, load and rate reports match")
+            storage.close()
+    
+    return True
+
+def metrics_workload(data_dir):
+    # Run in a child process started with ENROLLMENT_METRICS set.
+    from service import EnrollmentService
+    service = EnrollmentService(JsonLinesStorage(data_dir))
+    service.storage.put_students([{'student_number': 's1', 'email': '', 'year': '1st Year'}])
+    service.add_course('CS101', 'CS', 3, 'Programming')
+    service.enroll('s1', 'CS101')
+    service.course_page()
+    service.storage.store.invalidate()
+    service.my_courses('s1')
+
+def test_metrics():
+    print("\n=== Testing Metrics ===")
+    
+    import sys
+    import subprocess
+    import metrics
+    
+    if not metrics.ENABLED:
+        def operation():
+            pass
+        if metrics.timed('test.operation')(operation) is not operation:
+            print("Disabled metrics still wrap the function")
+            return False
+        print("Disabled metrics leave functions unwrapped")
+    
+    registry = metrics.MetricsRegistry()
+    for seconds in (0.0002, 0.003, 0.003, 20):
+        registry.observe('service.enroll', seconds)
+    registry.add('bytes_read', 'courses.txt', 120)
+    text = metrics.render(registry.snapshot())
+    for line in ('enrollment_operation_seconds_bucket{operation="service.enroll",le="0.0005"} 1',
+                 'enrollment_operation_seconds_bucket{operation="service.enroll",le="0.005"} 3',
+                 'enrollment_operation_seconds_bucket{operation="service.enroll",le="10.0"} 3',
+                 'enrollment_operation_seconds_bucket{operation="service.enroll",le="+Inf"} 4',
+                 'enrollment_operation_seconds_count{operation="service.enroll"} 4',
+                 'enrollment_bytes_read_total{file="courses.txt"} 120'):
+        if line not in text.splitlines():
+            print(f"Rendered metrics are missing: {line}")
+            return False
+    print("Histogram buckets are cumulative and rendered as Prometheus text")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        dump = os.path.join(tmp, 'metrics.prom')
+        env = dict(os.environ, ENROLLMENT_METRICS='1', ENROLLMENT_METRICS_FILE=dump)
+        script = f"import test_system; test_system.metrics_workload({tmp!r})"
+        subprocess.run([sys.executable, '-c', script], env=env, check=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+        with open(dump) as f:
+            samples = {}
+            for line in f:
+                if not line.startswith('#'):
+                    name, _, value = line.rpartition(' ')
+                    samples[name] = float(value)
+        for name in ('enrollment_operation_seconds_count{operation="service.enroll"}',
+                     'enrollment_operation_seconds_count{operation="storage.request_seat"}',
+                     'enrollment_operation_seconds_count{operation="wal.fsync"}',
+                     'enrollment_bytes_written_total{file="wal.log"}',
+                     'enrollment_bytes_written_total{file="enrollments.txt"}',
+                     'enrollment_bytes_read_total{file="enrollments.txt"}',
+                     'enrollment_records_parsed_total{file="enrollments.txt"}'):
+            if not samples.get(name):
+                print(f"Metrics dump has no {name}")
+                return False
+        print(f"Metrics dump written at exit with {len(samples)} samples")
+    
+    return True
+
+def test_schedule_conflicts():
+    print("\n=== Testing Schedule Conflicts ===")
+    
+    from schedule import find_conflicts, normalize_schedule, schedule_mask
+    from service import EnrollmentService, Conflict, InvalidInput
+    
+    if normalize_schedule('wed/Mon 9:00-10:30, fri 13:00 - 15:00') != \
+            'Mon 09:00-10:30; Wed 09:00-10:30; Fri 13:00-15:00':
+        print(f"Schedule not normalized: {normalize_schedule('wed/Mon 9:00-10:30')}")
+        return False
+    if schedule_mask('Mon 09:00-10:30') & schedule_mask('Mon 10:30-12:00') \
+            or not schedule_mask('Mon 09:00-10:30') & schedule_mask('Mon 10:25-11:00'):
+        print("Back-to-back meetings clash or overlapping ones do not")
+        return False
+    for bad in ('Mon 10:00-09:00', 'Funday 09:00-10:00', 'Mon 09:03-10:00', 'Mon 9am'):
+        try:
+            normalize_schedule(bad)
+            print(f"Invalid schedule accepted: {bad}")
+            return False
+        except ValueError:
+            pass
+    print("Meeting times are parsed, normalized and masked to 5-minute slots")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in (JsonLinesStorage(tmp), SQLiteStorage(os.path.join(tmp, 'enrollment.db'))):
+            name = type(storage).__name__
+            service = EnrollmentService(storage)
+            storage.put_students([{'student_number': 's1', 'email': ''}])
+            service.add_course('CS101', 'CS', 3, 'Programming', schedule='Mon/Wed 09:00-10:30')
+            service.add_course('CS102', 'CS', 3, 'Data', schedule='Wed 10:00-11:00')
+            service.add_course('CS103', 'CS', 3, 'Systems', schedule='Mon 10:30-12:00')
+            service.add_course('CS104', 'CS', 3, 'Theory')
+            try:
+                service.add_course('CS105', 'CS', 3, 'Bad', schedule='Mon 25:00-26:00')
+                print(f"{name}: invalid schedule accepted")
+                return False
+            except InvalidInput:
+                pass
+            
+            service.enroll('s1', 'CS101')
+            try:
+                service.enroll('s1', 'CS102')
+                print(f"{name}: clashing enrollment accepted")
+                return False
+            except Conflict as e:
+                if 'CS101' not in str(e):
+                    print(f"{name}: clash not named: {e}")
+                    return False
+            try:
+                service.enroll_many('s1', ['CS104', 'CS103', 'CS102'])
+                print(f"{name}: clashing batch accepted")
+                return False
+            except Conflict:
+                pass
+            service.enroll_many('s1', ['CS103', 'CS104'])
+            
+            # Moving CS102 clear of CS101 lets the student take it.
+            service.update_course('CS102', schedule='Thu 10:00-11:00')
+            service.enroll('s1', 'CS102')
+            if sorted(service.enrolled_course_codes('s1')) != ['CS101', 'CS102', 'CS103', 'CS104']:
+                print(f"{name}: enrolled in {service.enrolled_course_codes('s1')}")
+                return False
+            
+            # Moving it back onto CS101 shows up in the bulk sweep.
+            service.update_course('CS102', schedule='Wed 10:00-11:00')
+            conflicts = find_conflicts(storage)
+            if [(c['student_number'], sorted([c['course_code']] + c['conflicts_with']))
+                    for c in conflicts] != [('s1', ['CS101', 'CS102'])]:
+                print(f"{name}: conflict sweep found {conflicts}")
+                return False
+            print(f"{name}: clashing enrollments rejected and found by the sweep")
+            storage.close()
+    
+    return True
+
+def test_prerequisites():
+    print("\n=== Testing Prerequisites ===")
+    
+    import random
+    from prerequisites import PrerequisiteGraph
+    from service import EnrollmentService, InvalidInput
+    
+    # Patching the graph course by course must agree with building it anew.
+    rng = random.Random(7)
+    codes = [f"P{i:03d}" for i in range(60)]
+    courses = {}
+    graph = PrerequisiteGraph()
+    for step in range(400):
+        code = rng.choice(codes)
+        old = courses.get(code)
+        if old is not None and rng.random() < 0.2:
+            new = None
+            del courses[code]
         else:
-            print("Course not found in enrollments")
+            earlier = codes[:codes.index(code)]
+            new = {'course_code': code,
+                   'prerequisites': sorted(rng.sample(earlier, min(len(earlier), rng.randint(0, 3))))}
+            courses[code] = new
+        graph.update(code, old, new)
+    fresh = PrerequisiteGraph()
+    fresh.rebuild(courses)
+    if any(graph.all_prerequisites(code) != fresh.all_prerequisites(code) for code in codes):
+        print("Incremental closure differs from a rebuild")
+        return False
+    print("Incremental closure matches a full rebuild after 400 edits")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in (JsonLinesStorage(tmp), SQLiteStorage(os.path.join(tmp, 'enrollment.db'))):
+            name = type(storage).__name__
+            service = EnrollmentService(storage)
+            storage.put_students([{'student_number': 's1', 'email': ''},
+                                  {'student_number': 's2', 'email': ''}])
+            service.add_course('CS101', 'CS', 3, 'Programming')
+            service.add_course('CS201', 'CS', 3, 'Data Structures', prerequisites='cs101')
+            service.add_course('CS301', 'CS', 3, 'Algorithms', prerequisites=['CS201'])
+            service.add_course('MA101', 'Math', 3, 'Calculus')
+            
+            for prerequisites in (['CS301'], ['CS201'], ['ZZ999']):
+                try:
+                    service.update_course('CS101', prerequisites=prerequisites)
+                    print(f"{name}: prerequisites {prerequisites} accepted for CS101")
+                    return False
+                except InvalidInput:
+                    pass
+            if storage.prerequisite_graph().all_prerequisites('CS301') != ['CS101', 'CS201']:
+                print(f"{name}: closure {storage.prerequisite_graph().all_prerequisites('CS301')}")
+                return False
+            
+            available = [c['course_code'] for c in service.available_courses('s1')]
+            if available != ['CS101', 'MA101']:
+                print(f"{name}: s1 can see {available}")
+                return False
+            try:
+                service.enroll('s1', 'CS201')
+                print(f"{name}: enrolled without the prerequisite")
+                return False
+            except InvalidInput as e:
+                if 'CS101' not in str(e):
+                    print(f"{name}: missing prerequisite not named: {e}")
+                    return False
+            
+            # Passing CS201 also covers CS101 for CS301.
+            service.record_completed('s2', ['CS201'])
+            paged = [c['course_code'] for c in service.course_page(student_number='s2')['courses']]
+            if paged != ['CS101', 'CS201', 'CS301', 'MA101']:
+                print(f"{name}: s2 can see {paged}")
+                return False
+            service.enroll('s2', 'CS301')
+            
+            # Dropping CS201's prerequisite opens it to s1.
+            service.update_course('CS201', prerequisites='none')
+            available = [c['course_code'] for c in service.available_courses('s1')]
+            if available != ['CS101', 'CS201', 'MA101']:
+                print(f"{name}: after the edit s1 can see {available}")
+                return False
+            print(f"{name}: available courses and enrollment follow prerequisites")
+
+            # Renaming a course carries its code into the courses requiring
+            # it and the students who passed it; deleting one drops it.
+            service.update_course('CS201', prerequisites=['CS101'])
+            service.record_completed('s1', ['CS101'])
+            service.rename_course('CS101', 'CS110')
+            reopened = type(storage)(storage.path if isinstance(storage, SQLiteStorage) else tmp)
+            for view in (storage, reopened):
+                if (view.get_course('CS201').get('prerequisites') != ['CS110']
+                        or view.get_student('s1').get('completed_courses') != ['CS110']
+                        or view.prerequisite_graph().all_prerequisites('CS301') != ['CS110', 'CS201']):
+                    print(f"{name}: rename left {view.get_course('CS201')}, {view.get_student('s1')}")
+                    return False
+            reopened.close()
+            service.enroll('s1', 'CS201')
+            service.delete_course('CS110')
+            storage.put_students([{'student_number': 's3', 'email': ''}])
+            if ('prerequisites' in storage.get_course('CS201')
+                    or 'completed_courses' in storage.get_student('s1')
+                    or storage.prerequisite_graph().all_prerequisites('CS301') != ['CS201']):
+                print(f"{name}: delete left {storage.get_course('CS201')}, {storage.get_student('s1')}")
+                return False
+            service.enroll('s3', 'CS201')
+            print(f"{name}: renames and deletes carry over to prerequisites and completed courses")
+            storage.close()
+
+        # SQLite keeps its graph until a course is written, from any process.
+        storage = SQLiteStorage(os.path.join(tmp, 'enrollment.db'))
+        other = SQLiteStorage(storage.path)
+        graph = storage.prerequisite_graph()
+        if storage.prerequisite_graph() is not graph:
+            print("SQLiteStorage: graph rebuilt without a course write")
             return False
-    else:
-        print("Enrollment not saved correctly")
+        EnrollmentService(other).add_course('CS401', 'CS', 3, 'Compilers', prerequisites=['CS301'])
+        if storage.prerequisite_graph().all_prerequisites('CS401') != ['CS201', 'CS301']:
+            print("SQLiteStorage: cached graph missed another connection's write")
+            return False
+        print("SQLiteStorage: graph cached until the catalog changes")
+        storage.close()
+        other.close()
+
+    return True
+
+def test_background_notices():
+    print("\n=== Testing Background Notices ===")
+    
+    import jobs
+    from jobs import JobQueue, StubMailer
+    from service import EnrollmentService, start_notices
+    
+    class FlakyMailer(StubMailer):
+        # Fails the first delivery to each of the given students.
+        def __init__(self, flaky):
+            super().__init__()
+            self.flaky = set(flaky)
+        
+        def deliver(self, recipient, subject, body, key):
+            if recipient in self.flaky:
+                self.flaky.discard(recipient)
+                raise OSError("mail server unavailable")
+            super().deliver(recipient, subject, body, key)
+    
+    saved = jobs.RETRY_DELAY, jobs.LEASE_SECONDS
+    jobs.RETRY_DELAY = 0.01
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            service = EnrollmentService(JsonLinesStorage(tmp))
+            service.storage.put_students([{'student_number': f'S{i:02d}', 'email': ''}
+                                          for i in range(20)])
+            service.add_course('CS101', 'CS', 3, 'Programming', capacity=15)
+            service.add_course('MA101', 'Math', 3, 'Calculus')
+            for i in range(20):
+                service.enroll(f'S{i:02d}', 'CS101')
+            service.enroll('S00', 'MA101')
+            
+            mailer = FlakyMailer(['S03', 'S17'])
+            workers = start_notices(service, tmp, mailer)
+            try:
+                service.update_course('CS101', units=4)
+                workers.wait(timeout=10)
+                result = service.delete_course('CS101')
+                if not workers.wait(timeout=10):
+                    print(f"Notices still running: {service.notice_batches()}")
+                    return False
+            finally:
+                workers.stop()
+            progress = service.notice_progress(result['notices'])
+            if (progress['total'], progress['done']) != (20, 20) or len(mailer.sent) != 40:
+                print(f"Not every student was notified: {progress}, {len(mailer.sent)} sent")
+                return False
+            s00 = sorted((n for n in mailer.sent.values() if n['to'] == 'S00'),
+                         key=lambda n: 'cancelled' in n['body'])
+            if 'units changed' not in s00[0]['body'] or 'CS101: Programming (4 units)' not in s00[0]['body'] \
+                    or 'cancelled' not in s00[1]['body'] or 'CS101:' in s00[1]['body'] \
+                    or 'MA101' not in s00[1]['body']:
+                print(f"Unexpected notices: {s00}")
+                return False
+            retried = [job for job in service.jobs._jobs.values() if job['attempts'] > 1]
+            if sorted(job['payload']['student_number'] for job in retried) != ['S03', 'S17']:
+                print(f"Expected the failed deliveries to be retried once: {retried}")
+                return False
+            print("Enrolled and waitlisted students get a notice with their schedule, "
+                  "and failed deliveries are retried")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, jobs.JOBS_FILENAME)
+            queue = JobQueue(path)
+            batch = queue.enqueue('echo', [{'n': 1}, {'n': 2}])
+            # A claim by a worker that then died is given up once its lease ends.
+            jobs.LEASE_SECONDS = 0
+            queue.claim('dead-worker')
+            restarted = JobQueue(path)
+            if restarted.progress(batch) != {'pending': 1, 'running': 1, 'done': 0, 'failed': 0,
+                                             'total': 2}:
+                print(f"Queue not restored from disk: {restarted.progress(batch)}")
+                return False
+            jobs.LEASE_SECONDS = 60.0
+            seen = []
+            
+            def echo(job):
+                if job['payload']['n'] == 2:
+                    raise ValueError("always fails")
+                seen.append(job['payload']['n'])
+            
+            pool = jobs.WorkerPool(restarted, {'echo': echo}, workers=2).start()
+            try:
+                pool.wait(batch, timeout=10)
+            finally:
+                pool.stop()
+            failed = restarted.failed(batch)
+            if seen != [1] or len(failed) != 1 or failed[0]['attempts'] != jobs.MAX_ATTEMPTS \
+                    or 'always fails' not in failed[0]['error']:
+                print(f"Abandoned or failing jobs mishandled: {seen}, {failed}")
+                return False
+            print("Queued jobs survive a restart, abandoned claims are resumed and "
+                  "jobs fail after the last retry")
+    finally:
+        jobs.RETRY_DELAY, jobs.LEASE_SECONDS = saved
+    
+    return True
+
+def test_term_partitions():
+    print("\n=== Testing Term Partitions ===")
+    
+    from service import EnrollmentService, InvalidInput, NotFound
+    from terms import TermArchive, campuses, partition_dir
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in ('jsonl', 'sqlite'):
+            data_dir = partition_dir(tmp, backend)
+            os.makedirs(data_dir)
+            storage = open_storage(backend, data_dir)
+            name = type(storage).__name__
+            service = EnrollmentService(storage, terms=TermArchive(data_dir))
+            service.add_course('MATH101', 'Mathematics', 3, 'Calculus I')
+            service.add_course('CS101', 'Computer Science', 3, 'Intro to Programming', capacity=1)
+            
+            try:
+                service.rollover_term('2026-1')
+                print(f"{name}: rolled over without a current term")
+                return False
+            except InvalidInput:
+                pass
+            service.terms.set_current_term('2025-2')
+            service.enroll('s1', 'MATH101')
+            service.enroll('s1', 'CS101')
+            service.enroll('s2', 'CS101')
+            result = service.rollover_term('2026-1')
+            if result['enrollments'] != 2 or storage.load_enrollments() or storage.waitlist('CS101'):
+                print(f"{name}: rollover left {storage.load_enrollments()} in the current term")
+                return False
+            
+            service.update_course('MATH101', 'Calculus I (revised)', None, None)
+            service.enroll('s2', 'CS101')
+            service.rollover_term('2026-2')
+            try:
+                service.rollover_term('2025-2')
+                print(f"{name}: rolled over into an archived term")
+                return False
+            except InvalidInput:
+                pass
+            
+            summary = service.term_summary()
+            if summary['current'] != '2026-2' or [t['term'] for t in summary['archived']] != ['2025-2', '2026-1']:
+                print(f"{name}: term summary {summary}")
+                return False
+            
+            # A fresh archive reads only the partitions a query needs.
+            service.terms = TermArchive(data_dir)
+            history = service.student_history('s1')
+            if [(h['term'], [c['course_name'] for c in h['courses']]) for h in history] != \
+                    [('2025-2', ['Calculus I', 'Intro to Programming'])]:
+                print(f"{name}: history of s1 was {history}")
+                return False
+            if list(service.terms._partitions) != ['2025-2']:
+                print(f"{name}: loaded partitions {list(service.terms._partitions)}")
+                return False
+            history = service.course_history('cs101', '2026-1')
+            if [(h['term'], h['students']) for h in history] != [('2026-1', ['s2'])]:
+                print(f"{name}: history of CS101 was {history}")
+                return False
+            try:
+                service.student_history('s1', '1999-1')
+                print(f"{name}: unknown term accepted")
+                return False
+            except NotFound:
+                pass
+            print(f"{name}: rolled over two terms and queried only the partitions needed")
+            storage.close()
+        if campuses(tmp) != ['jsonl', 'sqlite']:
+            print(f"Campuses listed as {campuses(tmp)}")
+            return False
+
+    # Swapping the CLI's storage keeps terms, read from the new directory.
+    with temporary_data_dir() as tmp:
+        app.service.terms.set_current_term('2026-1')
+        app.service.add_course('MATH101', 'Mathematics', 3, 'Calculus I')
+        app.service.enroll('s1', 'MATH101')
+        app.service.rollover_term('2026-2')
+        if [h['term'] for h in app.service.student_history('s1')] != ['2026-1'] or \
+                not os.path.isdir(os.path.join(tmp, 'terms', '2026-1')):
+            print("use_storage() lost the term archive")
+            return False
+    print("use_storage() keeps the term archive of the new storage")
+
+    try:
+        partition_dir(tmp, '../elsewhere')
+        print("Campus name escaping its directory was accepted")
+        return False
+    except ValueError:
+        pass
+    
+    return True
+
+def test_password_hashing():
+    print("\n=== Testing Password Hashing and Sessions ===")
+    
+    import hashlib
+    import auth
+    from auth import check_password, needs_rehash, PasswordVerifier, SessionStore
+    
+    hashed = hash_password('secret')
+    if hashed == hash_password('secret') or not check_password('secret', hashed) \
+            or check_password('wrong', hashed) or needs_rehash(hashed):
+        print(f"Salted hash not verified correctly: {hashed}")
+        return False
+    print("Passwords are stored as salted KDF hashes")
+    
+    legacy = hashlib.sha256(b'secret').hexdigest()
+    with temporary_data_dir():
+        app.storage.put_students([{
+            'student_number': '2024001', 'name': 'Lea Cruz', 'year': '1st Year',
+            'degree': 'BS Computer Science', 'email': '2024001@mocku.edu.ph', 'password': legacy
+        }])
+        if authenticate_student('2024001', '2024001@mocku.edu.ph', 'secret') is None:
+            print("Legacy SHA-256 hash no longer accepted")
+            return False
+        upgraded = app.storage.get_student('2024001')['password']
+        if upgraded == legacy or needs_rehash(upgraded) or not check_password('secret', upgraded):
+            print("Legacy hash was not upgraded on login")
+            return False
+        if authenticate_student('2024001', '2024001@mocku.edu.ph', 'wrong') is not None:
+            print("Wrong password accepted after upgrade")
+            return False
+        print("Legacy SHA-256 hashes are upgraded on the next login")
+    
+    verifier = PasswordVerifier(workers=1)
+    try:
+        checks = []
+        original = auth.check_password
+        auth.check_password = lambda password, stored: checks.append(stored) or original(password, stored)
+        try:
+            results = [verifier.verify('secret', hashed) for _ in range(5)]
+            results.append(verifier.verify('wrong', hashed))
+        finally:
+            auth.check_password = original
+        if results != [True] * 5 + [False] or len(checks) != 1:
+            print(f"Verifier did not cache successful checks: {results}, {len(checks)} KDF runs")
+            return False
+    finally:
+        verifier.close()
+    print("Repeat logins skip the KDF")
+    
+    now = [0]
+    sessions = SessionStore(ttl=10, clock=lambda: now[0])
+    token = sessions.create('2024001')
+    now[0] = 5
+    still_valid = sessions.resolve(token)
+    now[0] = 11
+    if still_valid != '2024001' or sessions.resolve(token) is not None:
+        print("Session tokens do not expire")
         return False
+    print("Session tokens resolve until they expire")
+    
+    return True
+
+def test_http_server():
+    print("\n=== Testing Enrollment Service and HTTP Server ===")
+    
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from service import EnrollmentService, Conflict, NotFound
+    from server import make_server
+    
+    with temporary_data_dir():
+        storage = app.storage
+        storage.put_students([
+            {'student_number': f"202400{i}", 'name': f"Student {i}", 'year': '1st Year',
+             'degree': 'BS Computer Science', 'email': f"202400{i}@mocku.edu.ph",
+             'password': hash_password('secret')}
+            for i in range(1, 9)
+        ])
+        service = EnrollmentService(storage)
+        service.add_course('cs101', 'Computer Science', '3', 'Intro')
+        try:
+            service.add_course('CS101', 'Computer Science', '3', 'Intro')
+            print("Duplicate course was not rejected")
+            return False
+        except Conflict:
+            pass
+        try:
+            service.get_course('ZZ999')
+            print("Missing course was not reported")
+            return False
+        except NotFound:
+            print("Service reports duplicates and missing courses as typed errors")
+        
+        server = make_server(service, port=0, quiet=True, admin_token='registrar')
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            tokens = {}
+            for i in range(1, 9):
+                number = f"202400{i}"
+                status, body = http_request(base_url, 'POST', '/login', {
+                    'student_number': number, 'email': f"{number}@mocku.edu.ph", 'password': 'secret'})
+                if status != 200 or 'password' in body['student']:
+                    print(f"Login failed or leaked the password hash: {status}")
+                    return False
+                tokens[number] = body['token']
+            status, _ = http_request(base_url, 'POST', '/login', {
+                'student_number': '2024001', 'email': '2024001@mocku.edu.ph', 'password': 'wrong'})
+            if status != 401:
+                print(f"Wrong password returned {status}")
+                return False
+            print("Login over HTTP issues session tokens and rejects invalid credentials")
+            
+            no_token, _ = http_request(base_url, 'GET', '/students/2024001/courses')
+            other, _ = http_request(base_url, 'GET', '/students/2024001/courses',
+                                    token=tokens['2024002'])
+            if (no_token, other) != (401, 403):
+                print(f"Student routes not protected: {no_token}, {other}")
+                return False
+            print("Student routes require the student's own session")
+            
+            # Only the registrar records passed courses, and only real ones.
+            path = '/students/2024002/completed-courses'
+            statuses = [http_request(base_url, 'POST', path, {'course_codes': ['CS101']}, token)[0]
+                        for token in (None, tokens['2024002'], 'registrar')]
+            unknown, _ = http_request(base_url, 'POST', path, {'course_codes': ['ZZ999']}, 'registrar')
+            if statuses != [401, 403, 200] or unknown != 400 \
+                    or service.completed_courses('2024002') != ['CS101']:
+                print(f"Completed courses not restricted: {statuses}, {unknown}")
+                return False
+            print("Recording completed courses needs the administrator token")
+            
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                statuses = list(pool.map(
+                    lambda number: http_request(base_url, 'POST', f"/students/{number}/enrollments",
+                                                {'course_code': 'CS101'}, tokens[number])[0],
+                    sorted(tokens)))
+            status, roster = http_request(base_url, 'GET', '/courses/CS101/roster')
+            if statuses != [201] * 8 or roster['headcount'] != 8:
+                print(f"Concurrent enrollments were lost: {statuses}, {roster}")
+                return False
+            print("Concurrent HTTP enrollments are all recorded")
+            
+            status, _ = http_request(base_url, 'POST', '/students/2024001/enrollments',
+                                     {'course_code': 'CS101'}, tokens['2024001'])
+            missing, _ = http_request(base_url, 'GET', '/courses/ZZ999')
+            if (status, missing) != (409, 404):
+                print(f"Unexpected error statuses: {status}, {missing}")
+                return False
+            status, body = http_request(base_url, 'GET', '/students/2024001/courses',
+                                        token=tokens['2024001'])
+            if status != 200 or body['total_units'] != 3:
+                print(f"My courses returned {status}: {body}")
+                return False
+            print("Errors map to HTTP statuses and my courses reports total units")
+            
+            http_request(base_url, 'POST', '/logout', token=tokens['2024001'])
+            status, _ = http_request(base_url, 'GET', '/students/2024001/courses',
+                                     token=tokens['2024001'])
+            if status != 401:
+                print(f"Token still valid after logout: {status}")
+                return False
+            print("Logout revokes the session token")
+            
+            from urllib.request import urlopen
+            with urlopen(base_url + '/metrics') as response:
+                content_type = response.headers['Content-Type']
+                text = response.read().decode()
+            if not content_type.startswith('text/plain') or '# TYPE' not in text:
+                print(f"Metrics endpoint returned {content_type}: {text[:80]}")
+                return False
+            print("Metrics are served as Prometheus text")
+        finally:
+            server.shutdown()
+            server.server_close()
     
     return True
 
@@ -192,7 +2067,32 @@ def main():
         ("Course Loading", test_course_loading),
         ("Student Authentication", test_student_authentication),
         ("Course CRUD Operations", test_course_crud),
-        ("Enrollment Functionality", test_enrollment)
+        ("Enrollment Functionality", test_enrollment),
+        ("Append-Only Enrollment Log", test_enrollment_log),
+        ("Shared Data Store", test_data_store),
+        ("Course Search Index", test_course_search_index),
+        ("Course Roster Index", test_course_roster_index),
+        ("SQLite Storage Backend", test_sqlite_storage),
+        ("Concurrent Writers", test_concurrent_writers),
+        ("Bulk Import/Export", test_bulk_import_export),
+        ("Data Generator and Benchmarks", test_generator_and_benchmark),
+        ("Password Hashing and Sessions", test_password_hashing),
+        ("HTTP Server", test_http_server),
+        ("Capacity and Waitlists", test_capacity_and_waitlist),
+        ("Batch Enrollment", test_batch_enrollment),
+        ("Binary Snapshots", test_binary_snapshots),
+        ("Compact Enrollment Records", test_compact_enrollments),
+        ("Enrollment Integrity Checker", test_integrity_checker),
+        ("Course Cascade and Rename", test_course_cascade),
+        ("Write-Ahead Log", test_write_ahead_log),
+        ("Course Pagination", test_course_pagination),
+        ("Ranked Search", test_ranked_search),
+        ("Reports", test_reports),
+        ("Metrics", test_metrics),
+        ("Schedule Conflicts", test_schedule_conflicts),
+        ("Prerequisites", test_prerequisites),
+        ("Background Notices", test_background_notices),
+        ("Term Partitions", test_term_partitions)
     ]
     
     results = []
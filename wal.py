@@ -0,0 +1,238 @@
+import os
+import json
+import zlib
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+from locking import FileLock
+from metrics import observe, tally
+
+WAL_FILENAME = "wal.log"
+
+# Once the log grows past this many bytes the data files are fsynced and
+# the log is started afresh (a checkpoint).
+CHECKPOINT_BYTES = 4 * 1024 * 1024
+
+# =========================
+# Records
+# =========================
+
+def _encode(entries):
+    # "<crc32 of the JSON> <JSON>\n", so a torn or garbled record is skipped.
+    body = json.dumps(entries).encode()
+    return b"%08x %s\n" % (zlib.crc32(body), body)
+
+def _decode(raw):
+    checksum, _, body = raw.rstrip(b'\n').partition(b' ')
+    if not raw.endswith(b'\n') or checksum != b"%08x" % zlib.crc32(body):
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+def _append_position(path, data):
+    # The offset an append to `path` lands at, and the data to write there:
+    # a torn final line left by a crash is ended first so it stays separate.
+    try:
+        with open(path, 'rb') as f:
+            offset = f.seek(0, os.SEEK_END)
+            if offset:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    data = '\n' + data
+    except FileNotFoundError:
+        offset = 0
+    return offset, data
+
+def write_at(path, offset, data):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        os.pwrite(fd, data, offset)
+    finally:
+        os.close(fd)
+
+def _fsync_path(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _inode(path):
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+# =========================
+# Write-Ahead Log
+# =========================
+
+class WriteAheadLog:
+    # Every append to the data files is first written here as one record
+    # holding, for each file, the offset the data goes at and the data
+    # itself; a record spanning several files makes that change atomic. The
+    # data files are then written without an fsync of their own, and
+    # sync() makes the calling thread's records durable: threads that
+    # arrive while an fsync is running share the next one (group commit).
+    #
+    # Writing a record at its offset again is harmless, so recovery simply
+    # replays the whole log. Before each commit, records added by other
+    # processes since this one last looked are replayed too, in case their
+    # writer died before applying them; offsets are only taken after that.
+    # A checkpoint fsyncs the data files and swaps in an empty log; whole
+    # files are only rewritten inside replacing(), which checkpoints first,
+    # so no record outlives the copy of the file it points into.
+
+    def __init__(self, path, files, checkpoint_bytes=CHECKPOINT_BYTES):
+        self.path = path
+        self.directory = os.path.dirname(path)
+        self.files = files
+        self.checkpoint_bytes = checkpoint_bytes
+        self._lock = FileLock(path + '.lock')
+        self._file = None
+        self._seen = 0
+        self._local = threading.local()
+        self._sync = threading.Condition()
+        self._written = 0
+        self._durable = 0
+        self._syncing = False
+        self.commits = 0
+        self.syncs = 0
+
+    def commit(self, appends):
+        # appends: [(path, lines)] within the log's directory. The change is
+        # visible once this returns; call sync() before reporting it done.
+        with self._lock:
+            log = self._catch_up()
+            entries = []
+            for path, lines in appends:
+                data = ''.join(lines)
+                if data:
+                    offset, data = _append_position(path, data)
+                    entries.append({'file': os.path.basename(path), 'offset': offset, 'data': data})
+            if not entries:
+                return
+            record = _encode(entries)
+            log.write(record)
+            self._apply(entries)
+            tally('bytes_written', self.path, len(record))
+            for entry in entries:
+                tally('bytes_written', entry['file'], len(entry['data']))
+            self._seen = log.tell()
+            with self._sync:
+                self._written += 1
+                self._local.sequence = self._written
+            self.commits += 1
+            if self._seen >= self.checkpoint_bytes:
+                self._checkpoint()
+
+    def sync(self):
+        sequence = getattr(self._local, 'sequence', 0)
+        with self._sync:
+            while self._durable < sequence:
+                if self._syncing:
+                    self._sync.wait()
+                    continue
+                # Everything written so far is in this file or in one a
+                # checkpoint has already made durable.
+                self._syncing = True
+                target, log = self._written, self._file
+                self._sync.release()
+                start = perf_counter()
+                try:
+                    os.fsync(log.fileno())
+                finally:
+                    observe('wal.fsync', perf_counter() - start)
+                    self._sync.acquire()
+                    self._syncing = False
+                    self._sync.notify_all()
+                self._durable = max(self._durable, target)
+                self.syncs += 1
+
+    def catch_up(self):
+        with self._lock:
+            self._catch_up()
+
+    def recover(self):
+        # Returns the number of records replayed.
+        if not os.path.exists(self.path):
+            return 0
+        with self._lock:
+            self._seen = 0
+            replayed = self._replay(self._open())
+            if replayed:
+                self._checkpoint()
+            return replayed
+
+    def checkpoint(self):
+        with self._lock:
+            self._checkpoint()
+
+    @contextmanager
+    def replacing(self):
+        # Held while a data file is rewritten wholesale.
+        with self._lock:
+            self._checkpoint()
+            yield
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # Caller holds the lock for the rest.
+
+    def _open(self):
+        # The current log, reopened when another process has checkpointed.
+        if self._file is None or _inode(self.path) != os.fstat(self._file.fileno()).st_ino:
+            # The old file object is left to a thread that may be syncing it.
+            self._file = open(self.path, 'ab', buffering=0)
+            self._seen = 0
+        return self._file
+
+    def _catch_up(self):
+        log = self._open()
+        if os.fstat(log.fileno()).st_size != self._seen:
+            self._replay(log)
+        return log
+
+    def _replay(self, log):
+        replayed = 0
+        with open(self.path, 'rb') as f:
+            f.seek(self._seen)
+            for raw in f:
+                entries = _decode(raw)
+                if entries is not None:
+                    self._apply(entries)
+                    replayed += 1
+                elif not raw.endswith(b'\n'):
+                    # Torn by a writer that died; it was never acknowledged.
+                    log.write(b'\n')
+        self._seen = os.fstat(log.fileno()).st_size
+        return replayed
+
+    def _apply(self, entries):
+        for entry in entries:
+            write_at(os.path.join(self.directory, entry['file']), entry['offset'],
+                     entry['data'].encode())
+
+    def _checkpoint(self):
+        self._catch_up()
+        for path in self.files:
+            _fsync_path(path)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        if os.name != 'nt':
+            _fsync_path(self.directory)
+        with self._sync:
+            self._durable = self._written
+            self._sync.notify_all()
+        self._open()